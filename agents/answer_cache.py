@@ -0,0 +1,134 @@
+# In agents/answer_cache.py
+
+import os
+import re
+import math
+import hashlib
+import threading
+from collections import OrderedDict
+
+from .research_cache import normalize_query
+
+DEFAULT_MAX_ENTRIES = int(os.getenv("POLYVOICE_ANSWER_CACHE_ENTRIES", "512"))
+# Cosine similarity needed for a near-duplicate query to reuse an answer; 0 = exact matches only
+DEFAULT_SIMILARITY = float(os.getenv("POLYVOICE_ANSWER_SIMILARITY", "0"))
+# How many earlier user turns make up the conversation fingerprint
+HISTORY_TURNS = 3
+EMBEDDING_DIMS = 512
+
+_TOKEN = re.compile(r"[a-z0-9']+")
+_STOPWORDS = {
+    "a", "an", "the", "is", "are", "was", "were", "of", "to", "in", "on", "for", "and", "or",
+    "what", "how", "why", "does", "do", "can", "you", "me", "please", "explain", "tell", "about",
+}
+
+
+def history_fingerprint(chat_history, query, turns=HISTORY_TURNS):
+    """
+    Hash of the user turns before the current query (the ones the simplifier sees as memory),
+    so a follow-up like "what are the three types of that?" never reuses an answer
+    that was given in a different conversation.
+    """
+    user_turns = [m["content"] for m in chat_history if m.get("role") == "user"]
+    if user_turns and normalize_query(user_turns[-1]) == normalize_query(query):
+        user_turns = user_turns[:-1]  # app.py appends the current query before calling the pipeline
+    recent = [normalize_query(t) for t in user_turns[-turns:]]
+    return hashlib.sha256("\x1f".join(recent).encode("utf-8")).hexdigest()[:16]
+
+
+def hashed_embedding(text, dims=EMBEDDING_DIMS):
+    """
+    Tiny local embedding: hashed unigrams + bigrams (stopwords dropped), L2-normalised.
+    Good enough to match rephrasings like "how do plants make food" / "how plants make their food".
+    """
+    tokens = [t for t in _TOKEN.findall(text.lower()) if t not in _STOPWORDS]
+    features = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+    vector = {}
+    for feature in features:
+        digest = hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest()
+        index = int.from_bytes(digest[:4], "little") % dims
+        sign = 1.0 if digest[4] & 1 else -1.0
+        vector[index] = vector.get(index, 0.0) + sign
+    norm = math.sqrt(sum(v * v for v in vector.values())) or 1.0
+    return {i: v / norm for i, v in vector.items()}
+
+
+def cosine(a, b):
+    if len(a) > len(b):
+        a, b = b, a
+    return sum(v * b.get(i, 0.0) for i, v in a.items())
+
+
+class AnswerCache:
+    """
+    In-memory LRU of full pipeline results, keyed by (level, normalized query, history fingerprint).
+    With a similarity threshold > 0, a miss falls back to the most similar cached query
+    with the same level and fingerprint.
+    """
+
+    def __init__(self, max_entries=None, similarity_threshold=None, embed=hashed_embedding):
+        self.max_entries = DEFAULT_MAX_ENTRIES if max_entries is None else max_entries
+        self.similarity_threshold = DEFAULT_SIMILARITY if similarity_threshold is None else similarity_threshold
+        self.embed = embed
+        self._entries = OrderedDict()  # key -> (result, embedding)
+        self._lock = threading.Lock()
+        self._stats = {"exact_hits": 0, "similar_hits": 0, "misses": 0}
+
+    def key(self, query, complexity_level, chat_history):
+        return (complexity_level, normalize_query(query), history_fingerprint(chat_history, query))
+
+    def get(self, query, complexity_level, chat_history):
+        """Returns (result copy, "exact" | "similar") or (None, "miss")."""
+        key = self.key(query, complexity_level, chat_history)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self._stats["exact_hits"] += 1
+                return dict(entry[0]), "exact"
+
+            if self.similarity_threshold > 0:
+                query_vector = self.embed(key[1])
+                best_key, best_score = None, self.similarity_threshold
+                for other_key, (_, vector) in self._entries.items():
+                    if other_key[0] != key[0] or other_key[2] != key[2]:
+                        continue
+                    score = cosine(query_vector, vector)
+                    if score >= best_score:
+                        best_key, best_score = other_key, score
+                if best_key is not None:
+                    self._entries.move_to_end(best_key)
+                    self._stats["similar_hits"] += 1
+                    return dict(self._entries[best_key][0]), "similar"
+
+            self._stats["misses"] += 1
+            return None, "miss"
+
+    def put(self, query, complexity_level, chat_history, result):
+        key = self.key(query, complexity_level, chat_history)
+        vector = self.embed(key[1]) if self.similarity_threshold > 0 else None
+        with self._lock:
+            self._entries[key] = (dict(result), vector)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats, entries=len(self._entries))
+        lookups = stats["exact_hits"] + stats["similar_hits"] + stats["misses"]
+        stats["hit_rate"] = round((lookups - stats["misses"]) / lookups, 3) if lookups else 0.0
+        return stats
+
+
+_default_cache = None
+_default_lock = threading.Lock()
+
+
+def get_default_cache():
+    """Process-wide answer cache configured from the environment."""
+    global _default_cache
+    with _default_lock:
+        if _default_cache is None:
+            _default_cache = AnswerCache()
+        return _default_cache
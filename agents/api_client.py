@@ -0,0 +1,91 @@
+# In agents/api_client.py
+
+"""
+Thin client for api_server.py. With POLYVOICE_API_URL set, app.py streams answers and
+synthesizes speech through the API service instead of calling the providers itself.
+"""
+
+import os
+import json
+import threading
+
+from .clients import ProviderBusy
+from .scheduler import current_request
+from .memory import ConversationMemory
+
+API_URL = os.getenv("POLYVOICE_API_URL")
+API_TIMEOUT = float(os.getenv("POLYVOICE_API_TIMEOUT_S", "90"))
+
+_http = None
+_http_lock = threading.Lock()
+
+
+def remote_enabled():
+    return bool(API_URL)
+
+
+def _client():
+    global _http
+    with _http_lock:
+        if _http is None:
+            import httpx
+            _http = httpx.Client(
+                base_url=API_URL.rstrip("/"),
+                timeout=httpx.Timeout(API_TIMEOUT, connect=5.0),
+                limits=httpx.Limits(max_connections=64, max_keepalive_connections=32),
+            )
+        return _http
+
+
+def _headers():
+    """The caller's tenant/user/priority, so the server schedules each session on its own."""
+    request = current_request()
+    headers = {"X-PolyVoice-Tenant": request.tenant, "X-PolyVoice-Priority": request.priority}
+    if request.user is not None:
+        headers["X-PolyVoice-User"] = request.user
+    return headers
+
+
+def _memory_state(chat_history):
+    if isinstance(chat_history, ConversationMemory):
+        return chat_history.to_state()
+    return {"turns": [{"role": m["role"], "content": m["content"]} for m in chat_history]}
+
+
+def _check(response):
+    if response.status_code in (429, 503):
+        response.read()
+        retry_after = float(response.headers.get("Retry-After", 0) or 0)
+        reason = "rate limited" if response.status_code == 429 else "server busy"
+        raise ProviderBusy("api", reason, retry_after)
+    if response.status_code >= 400:
+        response.read()
+        raise RuntimeError(f"API error {response.status_code}: {response.text}")
+
+
+def run_pipeline_stream(cb, exa, query, complexity_level, chat_history, **kwargs):
+    """
+    Same (event, payload) stream as orchestrator.run_pipeline_stream, served by the API.
+    `cb` and `exa` are ignored (the server owns the provider clients).
+    """
+    body = {"query": query, "level": complexity_level, "memory": _memory_state(chat_history)}
+    with _client().stream("POST", "/v1/answer/stream", json=body, headers=_headers()) as response:
+        _check(response)
+        event = None
+        for line in response.iter_lines():
+            if line.startswith("event:"):
+                event = line[len("event:"):].strip()
+            elif line.startswith("data:"):
+                payload = json.loads(line[len("data:"):].strip())
+                if event == "error":
+                    raise RuntimeError(payload.get("error", "pipeline failed"))
+                yield event, payload
+
+
+def synthesize(text, voice_id, previous_text=None, speed_rate=1.0, tier="high"):
+    body = {"text": text, "voice_id": voice_id, "speed": speed_rate, "tier": tier}
+    if previous_text:
+        body["previous_text"] = previous_text
+    response = _client().post("/v1/tts", json=body, headers=_headers())
+    _check(response)
+    return response.content
@@ -0,0 +1,83 @@
+# In agents/audio_server.py
+
+import os
+import re
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# Only content-addressed clips are served: <2 hex>/<64 hex>.<ext>
+_CLIP_PATH = re.compile(r"^/([0-9a-f]{2})/([0-9a-f]{64})\.(mp3|opus|ogg|wav)$")
+_CONTENT_TYPES = {"mp3": "audio/mpeg", "opus": "audio/ogg", "ogg": "audio/ogg", "wav": "audio/wav"}
+_RANGE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def _make_handler(directory, store=None):
+    class AudioHandler(BaseHTTPRequestHandler):
+        """Read-only, Range-aware server for cached clips (TTS cache directory or lesson store)."""
+
+        def log_message(self, format, *args):
+            pass  # keep Streamlit's console quiet
+
+        def do_GET(self):
+            match = _CLIP_PATH.match(self.path.split("?", 1)[0])
+            if not match:
+                self.send_error(404)
+                return
+            shard, key, ext = match.groups()
+            if store is not None:
+                size = store.clip_size(key)
+                if size is None:
+                    self.send_error(404)
+                    return
+                self._send(size, ext, lambda start, end: store.read_clip(key, start, end))
+                return
+            path = os.path.join(directory, shard, f"{key}.{ext}")
+            try:
+                f = open(path, "rb")
+            except FileNotFoundError:
+                self.send_error(404)
+                return
+            with f:
+                self._send(os.fstat(f.fileno()).st_size, ext,
+                           lambda start, end: os.pread(f.fileno(), end - start + 1, start))
+
+        def _send(self, size, ext, read):
+            """`read(start, end)` returns the inclusive byte range."""
+            start, end = 0, size - 1
+            status = 200
+            range_match = _RANGE.match(self.headers.get("Range", ""))
+            if range_match and any(range_match.groups()):
+                first, last = range_match.groups()
+                if first:
+                    start, end = int(first), min(int(last), size - 1) if last else size - 1
+                else:
+                    start = max(0, size - int(last))
+                if start > end:
+                    self.send_error(416)
+                    return
+                status = 206
+            self.send_response(status)
+            self.send_header("Content-Type", _CONTENT_TYPES[ext])
+            self.send_header("Accept-Ranges", "bytes")
+            self.send_header("Content-Length", str(end - start + 1))
+            # Clips are content-addressed, so they never change
+            self.send_header("Cache-Control", "public, max-age=31536000, immutable")
+            self.send_header("Access-Control-Allow-Origin", "*")
+            if status == 206:
+                self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+            self.end_headers()
+            for chunk_start in range(start, end + 1, 64 * 1024):
+                chunk = read(chunk_start, min(chunk_start + 64 * 1024 - 1, end))
+                if not chunk:
+                    break  # evicted mid-response
+                self.wfile.write(chunk)
+
+    return AudioHandler
+
+
+def start_audio_server(directory, port, host="0.0.0.0", store=None):
+    """Starts the audio file server on a daemon thread; returns the server object."""
+    server = ThreadingHTTPServer((host, port), _make_handler(directory, store))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="polyvoice-audio", daemon=True).start()
+    return server
@@ -0,0 +1,377 @@
+# In agents/clients.py
+
+"""
+Provider clients, built once per process and shared by every agent.
+
+Each provider (Cerebras, Exa, ElevenLabs) gets:
+- pooled keep-alive HTTP connections with timeouts,
+- a concurrency cap, so a slow provider can't pile up Streamlit worker threads, shared
+  fairly between tenants and users by agents/scheduler.py (priorities, weighted fair
+  queuing, per-user rate limits, fast "busy" rejection),
+- jittered exponential-backoff retries on 429 / 5xx / timeouts,
+- a circuit breaker; while it is open, calls fail fast with ProviderUnavailable so
+  optional stages (quiz, flowchart, TTS) can be skipped instead of hanging.
+"""
+
+import os
+import json
+import time
+import random
+import logging
+import threading
+
+from dotenv import load_dotenv
+
+from . import scheduler
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# Per-provider knobs: concurrent requests, request timeout (s), time to wait for a free slot (s)
+PROVIDER_SETTINGS = {
+    "cerebras": {"concurrency": int(os.getenv("POLYVOICE_CEREBRAS_CONCURRENCY", "16")), "timeout": 30.0, "queue_timeout": 10.0},
+    "exa": {"concurrency": int(os.getenv("POLYVOICE_EXA_CONCURRENCY", "8")), "timeout": 15.0, "queue_timeout": 5.0},
+    "elevenlabs": {"concurrency": int(os.getenv("POLYVOICE_ELEVENLABS_CONCURRENCY", "4")), "timeout": 60.0, "queue_timeout": 10.0},
+}
+MAX_RETRIES = 3
+BACKOFF_BASE = 0.4
+BACKOFF_CAP = 4.0
+BREAKER_FAILURES = 5      # consecutive failures that open the circuit
+BREAKER_RESET_S = 30.0    # how long it stays open before a probe is let through
+RETRYABLE_STATUS = {408, 409, 425, 429, 500, 502, 503, 504}
+
+
+class ProviderUnavailable(Exception):
+    """The provider's circuit is open or all of its slots are busy; callers should degrade."""
+
+    def __init__(self, provider, reason):
+        super().__init__(f"{provider} unavailable: {reason}")
+        self.provider = provider
+        self.reason = reason
+
+
+class ProviderBusy(ProviderUnavailable):
+    """Shed by the scheduler (queue full, or the user is over their rate); retry after `retry_after` s."""
+
+    def __init__(self, provider, reason, retry_after):
+        super().__init__(provider, reason)
+        self.retry_after = retry_after
+
+
+def _status_code(error):
+    status = getattr(error, "status_code", None)
+    if status is None and getattr(error, "response", None) is not None:
+        status = getattr(error.response, "status_code", None)
+    return status
+
+
+def is_retryable(error):
+    status = _status_code(error)
+    if status is not None:
+        return status in RETRYABLE_STATUS
+    name = type(error).__name__
+    return "Timeout" in name or "Connection" in name or isinstance(error, (TimeoutError, ConnectionError))
+
+
+class CircuitBreaker:
+    """closed -> (N consecutive failures) -> open -> (reset timeout) -> half-open -> one probe."""
+
+    def __init__(self, failures=BREAKER_FAILURES, reset_s=BREAKER_RESET_S):
+        self.failures = failures
+        self.reset_s = reset_s
+        self.state = "closed"
+        self._consecutive = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == "open":
+                if time.monotonic() - self._opened_at < self.reset_s:
+                    return False
+                self.state = "half-open"
+            if self.state == "half-open":
+                if self._probe_in_flight:
+                    return False
+                self._probe_in_flight = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self._consecutive = 0
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._consecutive += 1
+            self._probe_in_flight = False
+            if self.state == "half-open" or self._consecutive >= self.failures:
+                self.state = "open"
+                self._opened_at = time.monotonic()
+
+
+class HeldStream:
+    """
+    A streamed response that keeps its provider slot: the chunks still arrive over the
+    provider's connection, so the slot is freed only when iteration ends, close() is
+    called, or the stream is garbage-collected.
+    """
+
+    def __init__(self, stream, fair_scheduler, ticket):
+        self._stream = stream
+        self._scheduler = fair_scheduler
+        self._ticket = ticket
+        self._released = False
+        self._lock = threading.Lock()
+
+    def __iter__(self):
+        try:
+            yield from self._stream
+        finally:
+            self.close()
+
+    def close(self):
+        with self._lock:
+            if self._released:
+                return
+            self._released = True
+        try:
+            close = getattr(self._stream, "close", None)
+            if close is not None:
+                close()
+        finally:
+            self._scheduler.release(self._ticket)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __del__(self):
+        self.close()
+
+
+class ProviderGuard:
+    """Fair-scheduled concurrency cap + retries + circuit breaker around one provider's calls."""
+
+    def __init__(self, name, concurrency, queue_timeout, **_):
+        self.name = name
+        self.queue_timeout = queue_timeout
+        self.breaker = CircuitBreaker()
+        self.scheduler = scheduler.FairScheduler(name, concurrency)
+        self._stats = {"calls": 0, "retries": 0, "failures": 0, "rejected": 0}
+        self._stats_lock = threading.Lock()
+
+    def _count(self, name):
+        with self._stats_lock:
+            self._stats[name] += 1
+
+    def _rejected(self, e):
+        self._count("rejected")
+        return ProviderBusy(self.name, e.reason, e.retry_after)
+
+    def call(self, fn, *args, **kwargs):
+        return self._call(fn, args, kwargs, hold=False)
+
+    def stream(self, fn, *args, **kwargs):
+        """Like call(), but the slot stays taken until the returned stream is exhausted or closed."""
+        return self._call(fn, args, kwargs, hold=True)
+
+    def _call(self, fn, args, kwargs, hold):
+        request = scheduler.current_request()
+        try:
+            scheduler.throttle(request)
+        except scheduler.Rejected as e:
+            raise self._rejected(e) from None
+        for attempt in range(MAX_RETRIES + 1):
+            # Slot first: a half-open breaker's single probe must not be lost to a shed call
+            try:
+                ticket = self.scheduler.acquire(request, self.queue_timeout)
+            except scheduler.Rejected as e:
+                raise self._rejected(e) from None
+            if not self.breaker.allow():
+                self.scheduler.release(ticket)
+                self._count("rejected")
+                raise ProviderUnavailable(self.name, "circuit open")
+            held = False
+            try:
+                self._count("calls")
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                retryable = is_retryable(e)
+                if retryable:
+                    self.breaker.record_failure()
+                else:
+                    # A 4xx like bad request says nothing about the provider's health
+                    self.breaker.record_success()
+                if not retryable or attempt == MAX_RETRIES:
+                    self._count("failures")
+                    raise
+                self._count("retries")
+                logger.warning("%s call failed (%s), retrying", self.name, e)
+            else:
+                self.breaker.record_success()
+                if hold:
+                    held = True
+                    return HeldStream(result, self.scheduler, ticket)
+                return result
+            finally:
+                if not held:
+                    self.scheduler.release(ticket)
+            # Full jitter: spreads retries from many sessions instead of synchronizing them
+            time.sleep(random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt)))
+
+    def stats(self):
+        with self._stats_lock:
+            return dict(self._stats, circuit=self.breaker.state, scheduler=self.scheduler.stats())
+
+
+_guards = {name: ProviderGuard(name, **settings) for name, settings in PROVIDER_SETTINGS.items()}
+
+
+def guarded_call(provider, fn, *args, **kwargs):
+    """Runs fn(*args, **kwargs) under the provider's concurrency cap, retries and circuit breaker."""
+    return _guards[provider].call(fn, *args, **kwargs)
+
+
+def guarded_stream(provider, fn, *args, **kwargs):
+    """guarded_call() for streamed responses: the slot is held until the stream is exhausted or closed."""
+    return _guards[provider].stream(fn, *args, **kwargs)
+
+
+def admit():
+    """
+    Fast admission check before a pipeline run, for the calling request context:
+    raises ProviderBusy (user over their rate, or a provider's queue full) instead of queuing.
+    """
+    for guard in _guards.values():
+        try:
+            scheduler.admit(guard.scheduler)
+        except scheduler.Rejected as e:
+            raise guard._rejected(e) from None
+
+
+def provider_stats():
+    return {name: guard.stats() for name, guard in _guards.items()}
+
+
+# --- CLIENT CONSTRUCTION (once per process) ---
+# Where warm_connections() opens the first keep-alive connection
+PROVIDER_ORIGINS = {
+    "cerebras": "https://api.cerebras.ai",
+    "exa": "https://api.exa.ai",
+    "elevenlabs": "https://api.elevenlabs.io",
+}
+_http_pools = {}  # provider -> the pooled httpx.Client its SDK client uses
+
+
+def _http_client(provider):
+    import httpx
+
+    settings = PROVIDER_SETTINGS[provider]
+    client = _http_pools[provider] = httpx.Client(
+        timeout=httpx.Timeout(settings["timeout"], connect=5.0),
+        limits=httpx.Limits(
+            max_connections=settings["concurrency"],
+            max_keepalive_connections=settings["concurrency"],
+            keepalive_expiry=60.0,
+        ),
+    )
+    return client
+
+
+def _pooled_exa(api_key):
+    """Exa's SDK calls requests.post() per request (new connection, no timeout); give it a pooled Session."""
+    import requests
+    from requests.adapters import HTTPAdapter
+    from exa_py import Exa
+    from exa_py.api import ExaJSONEncoder
+
+    settings = PROVIDER_SETTINGS["exa"]
+
+    class ExaHTTPError(ValueError):
+        def __init__(self, status_code, text):
+            super().__init__(f"Request failed with status code {status_code}: {text}")
+            self.status_code = status_code
+
+    class PooledExa(Exa):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=settings["concurrency"])
+            self.session.mount("https://", adapter)
+
+        def request(self, endpoint, data=None, method="POST", params=None, headers=None):
+            streaming = (isinstance(data, dict) and data.get("stream")) or (params or {}).get("stream") == "true"
+            if streaming or method.upper() not in ("GET", "POST"):
+                return super().request(endpoint, data, method, params, headers)
+            body = data if isinstance(data, str) else (json.dumps(data, cls=ExaJSONEncoder) if data else None)
+            res = self.session.request(
+                method.upper(), self.base_url + endpoint, data=body, params=params,
+                headers={**self.headers, **(headers or {})}, timeout=settings["timeout"],
+            )
+            if res.status_code >= 400:
+                raise ExaHTTPError(res.status_code, res.text)
+            return res.json()
+
+    return PooledExa(api_key=api_key)
+
+
+_clients = None
+_clients_lock = threading.Lock()
+
+
+def get_clients():
+    """(cb, exa, eleven_client), built once per process. Stand-ins when POLYVOICE_OFFLINE=1."""
+    global _clients
+    with _clients_lock:
+        if _clients is None:
+            from .stand_ins import offline_mode, stand_in_clients
+
+            if offline_mode():
+                _clients = stand_in_clients()
+            else:
+                from cerebras.cloud.sdk import Cerebras
+                from elevenlabs.client import ElevenLabs
+
+                cb = Cerebras(
+                    api_key=os.getenv("CEREBRAS_API_KEY"),
+                    http_client=_http_client("cerebras"),
+                    max_retries=0,  # retries happen in ProviderGuard
+                )
+                exa = _pooled_exa(os.getenv("EXA_API_KEY"))
+                eleven_client = ElevenLabs(
+                    api_key=os.getenv("ELEVEN_API_KEY"),
+                    httpx_client=_http_client("elevenlabs"),
+                    timeout=PROVIDER_SETTINGS["elevenlabs"]["timeout"],
+                )
+                _clients = (cb, exa, eleven_client)
+        return _clients
+
+
+def get_eleven_client():
+    return get_clients()[2]
+
+
+def warm_connections():
+    """
+    Opens one pooled keep-alive connection per provider (DNS + TCP + TLS), so the first
+    question doesn't pay for the handshakes. Any HTTP answer will do; returns provider -> ok.
+    """
+    _, exa, _ = get_clients()
+    pools = dict(_http_pools)
+    if getattr(exa, "session", None) is not None:
+        pools["exa"] = exa.session
+    opened = {}
+    for provider, pool in pools.items():
+        try:
+            pool.head(PROVIDER_ORIGINS[provider], timeout=5.0)
+            opened[provider] = True
+        except Exception as e:
+            logger.warning("Could not pre-connect to %s: %s", provider, e)
+            opened[provider] = False
+    return opened
@@ -0,0 +1,135 @@
+# In agents/context_builder.py
+
+import os
+import re
+import math
+import hashlib
+from collections import Counter
+
+# Prompt budget for the research context (approximate tokens, ~4 characters each)
+DEFAULT_TOKEN_BUDGET = int(os.getenv("POLYVOICE_CONTEXT_TOKENS", "900"))
+CHUNK_WORDS = 60
+SHINGLE_WORDS = 4
+MINHASH_PERMUTATIONS = 64
+# Estimated Jaccard similarity above which two passages count as duplicates
+DUPLICATE_THRESHOLD = 0.6
+
+_WORD = re.compile(r"\w+")
+_SENTENCE_SPLIT = re.compile(r"(?<=[.!?])\s+")
+_MERSENNE = (1 << 61) - 1
+_PERMUTATIONS = [
+    (int.from_bytes(hashlib.blake2b(f"a{i}".encode(), digest_size=8).digest(), "little") % _MERSENNE | 1,
+     int.from_bytes(hashlib.blake2b(f"b{i}".encode(), digest_size=8).digest(), "little") % _MERSENNE)
+    for i in range(MINHASH_PERMUTATIONS)
+]
+
+
+def estimate_tokens(text):
+    return (len(text) + 3) // 4
+
+
+def _words(text):
+    return _WORD.findall(text.lower())
+
+
+def chunk_text(text, max_words=CHUNK_WORDS):
+    """Splits a source into sentence-aligned passages of about max_words words."""
+    chunks, current, count = [], [], 0
+    for sentence in _SENTENCE_SPLIT.split(text.strip()):
+        n = len(sentence.split())
+        if current and count + n > max_words:
+            chunks.append(" ".join(current))
+            current, count = [], 0
+        current.append(sentence)
+        count += n
+    if current:
+        chunks.append(" ".join(current))
+    return chunks
+
+
+def minhash_signature(text):
+    words = _words(text)
+    shingles = {
+        " ".join(words[i:i + SHINGLE_WORDS]) for i in range(max(1, len(words) - SHINGLE_WORDS + 1))
+    }
+    hashes = [
+        int.from_bytes(hashlib.blake2b(s.encode(), digest_size=8).digest(), "little") for s in shingles
+    ]
+    return [min((a * h + b) % _MERSENNE for h in hashes) for a, b in _PERMUTATIONS]
+
+
+def _similarity(sig_a, sig_b):
+    return sum(x == y for x, y in zip(sig_a, sig_b)) / len(sig_a)
+
+
+def bm25_scores(query, passages, k1=1.5, b=0.75):
+    """Plain Okapi BM25 of each passage against the query."""
+    docs = [Counter(_words(p)) for p in passages]
+    lengths = [sum(d.values()) for d in docs]
+    avg_len = (sum(lengths) / len(lengths)) if lengths else 0.0
+    terms = set(_words(query))
+    doc_freq = {t: sum(1 for d in docs if t in d) for t in terms}
+    n = len(docs)
+    scores = []
+    for doc, length in zip(docs, lengths):
+        score = 0.0
+        for t in terms:
+            tf = doc.get(t, 0)
+            if not tf:
+                continue
+            idf = math.log(1 + (n - doc_freq[t] + 0.5) / (doc_freq[t] + 0.5))
+            score += idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * length / (avg_len or 1)))
+        scores.append(score)
+    return scores
+
+
+def build_context(sources, query, token_budget=DEFAULT_TOKEN_BUDGET):
+    """
+    Chunk -> dedupe (MinHash over word shingles) -> rank (BM25) -> pack into the token budget.
+    Returns (context, stats). Passages keep their "Source i. Title:" label so the model
+    can still tell sources apart.
+    """
+    passages = []  # (source index, title, text)
+    raw_tokens = 0
+    for i, s in enumerate(sources, 1):
+        text = s.text or ""
+        # What the old "+=" formatter would have sent for this source
+        raw_tokens += estimate_tokens(f"Source {i}. {s.title}: {text[:1800]}...\n")
+        passages.extend((i, s.title, chunk) for chunk in chunk_text(text))
+
+    kept, signatures = [], []
+    for passage in passages:
+        signature = minhash_signature(passage[2])
+        if any(_similarity(signature, other) >= DUPLICATE_THRESHOLD for other in signatures):
+            continue
+        signatures.append(signature)
+        kept.append(passage)
+
+    scores = bm25_scores(query, [p[2] for p in kept])
+    ranked = sorted(zip(scores, range(len(kept))), key=lambda pair: (-pair[0], pair[1]))
+
+    selected, used = [], 0
+    any_relevant = bool(ranked) and ranked[0][0] > 0
+    for score, index in ranked:
+        if any_relevant and score <= 0:
+            break  # passages sharing no query term only dilute the prompt
+        source, title, text = kept[index]
+        line = f"Source {source}. {title}: {text}\n"
+        cost = estimate_tokens(line)
+        if used + cost > token_budget:
+            continue
+        selected.append((source, index, line))
+        used += cost
+
+    # Present the chosen passages in source order so the context still reads naturally
+    context = "".join(line for _, _, line in sorted(selected))
+    stats = {
+        "sources": len(sources),
+        "passages": len(passages),
+        "duplicates_removed": len(passages) - len(kept),
+        "passages_used": len(selected),
+        "raw_tokens": raw_tokens,
+        "context_tokens": used,
+        "tokens_saved": max(0, raw_tokens - used),
+    }
+    return context, stats
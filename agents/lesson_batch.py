@@ -0,0 +1,242 @@
+# In agents/lesson_batch.py
+
+"""
+Batch lesson generation: precompute a curriculum (topics x levels x voices) into the
+research cache and a lesson store (agents/lesson_store.py), which the app then serves
+without live API calls.
+
+    python -m agents.lesson_batch topics.txt --store lessons/
+    python -m agents.lesson_batch syllabus.jsonl --store lessons/ --voices Calm Energetic \
+        --workers 4 --lessons-per-minute 20 --tts-per-minute 30
+    POLYVOICE_LESSON_STORE=lessons/ streamlit run app.py
+
+Topics files are .txt (one topic per line, "#" comments) or .json/.jsonl entries
+{"topic": ..., "levels": [...]?, "voices": [...]?} that override the command-line lists.
+
+Every (topic, level) is one job on a bounded worker pool. Levels of the same topic share
+one Exa search through the research cache (coalesced while in flight, then served from
+SQLite). Each finished job appends a line to <store>/manifest.jsonl, and lessons and clips
+are committed one by one, so an interrupted run picks up where it stopped: rerun the same command.
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from .lesson_store import LessonStore, lesson_id
+from .scheduler import request_context
+
+DEFAULT_LEVELS = ["elementary-dyslexia", "adhd", "plain", "standard-research"]
+DEFAULT_VOICES = ["Teacher-Like"]
+
+
+class RateLimiter:
+    """At most `per_minute` acquisitions per minute, spaced evenly. 0 means unlimited."""
+
+    def __init__(self, per_minute):
+        self.interval = 60.0 / per_minute if per_minute else 0.0
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next)
+            self._next = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class Manifest:
+    """Append-only JSON-lines progress log; the last line per job wins."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # a line cut short by the interruption
+                    self.entries[entry["job"]] = entry
+
+    def is_done(self, job):
+        entry = self.entries.get(job)
+        return entry is not None and entry["status"] == "done"
+
+    def record(self, entry):
+        line = json.dumps(entry, ensure_ascii=False)
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            self.entries[entry["job"]] = entry
+
+
+def resolve_voice(name):
+    """A voice name from the app's menu, or a raw ElevenLabs voice id."""
+    from .voice_agent import VOICES
+    return VOICES.get(name, name)
+
+
+def load_topics(path, levels, voices):
+    """[(topic, level, [voice ids])], grouped by topic so its levels run close together."""
+    with open(path, encoding="utf-8") as f:
+        raw = f.read()
+    if path.endswith(".json"):
+        entries = json.loads(raw)
+    elif path.endswith(".jsonl"):
+        entries = [json.loads(line) for line in raw.splitlines() if line.strip()]
+    else:
+        entries = [line.strip() for line in raw.splitlines()]
+        entries = [line for line in entries if line and not line.startswith("#")]
+
+    jobs, seen = [], set()
+    for entry in entries:
+        if isinstance(entry, str):
+            entry = {"topic": entry}
+        voice_ids = [resolve_voice(v) for v in entry.get("voices") or voices]
+        for level in entry.get("levels") or levels:
+            key = lesson_id(entry["topic"], level)
+            if key not in seen:
+                seen.add(key)
+                jobs.append((entry["topic"], level, voice_ids))
+    return jobs
+
+
+def _lesson_complete(store, lesson, voice_ids):
+    return lesson is not None and lesson["source"] == "batch" and all(
+        v in lesson["audio"] and store.has_clip(lesson["audio"][v]) for v in voice_ids
+    )
+
+
+def run_job(cb, exa, store, topic, level, voice_ids, lesson_limiter, tts_limiter):
+    """Generates (or completes) one lesson; returns what was done for the manifest."""
+    from .orchestrator import run_pipeline, _is_complete
+    from .voice_agent import audio_cache_key, synthesize
+
+    lesson = store.find(topic, level)
+    generated = lesson is None
+    if generated:
+        lesson_limiter.acquire()
+        result = run_pipeline(cb, exa, topic, level, [], concurrent=True)
+        if not _is_complete(result):
+            raise RuntimeError("pipeline returned an incomplete lesson (a stage timed out)")
+        result.pop("answer_cache", None)
+    else:
+        # Interrupted after the text was stored (or already answered live): only audio is missing
+        result = lesson["result"]
+
+    text = result["simplified_text"]
+    audio, synthesized = {}, 0
+
+    def produce(voice_id):
+        nonlocal synthesized
+        tts_limiter.acquire()
+        synthesized += 1
+        return synthesize(text, voice_id)
+
+    for voice_id in voice_ids:
+        # Only the 1.0x base clip is stored; paces and bitrate tiers are derived from it when served
+        key = audio_cache_key(text, voice_id)
+        # Levels with identical text share a clip; concurrent jobs wait for one synthesis
+        audio[voice_id] = store.get_or_create(key, lambda: produce(voice_id), voice_id)
+    store.put_lesson(topic, level, result, audio, source="batch")
+    return {"generated": generated, "clips": synthesized}
+
+
+def run_batch(jobs, store, workers=4, lessons_per_minute=0, tts_per_minute=0, log=print):
+    from .clients import get_clients
+
+    cb, exa, _ = get_clients()
+    manifest = Manifest(os.path.join(store.path, "manifest.jsonl"))
+    lesson_limiter, tts_limiter = RateLimiter(lessons_per_minute), RateLimiter(tts_per_minute)
+    summary = {"done": 0, "skipped": 0, "failed": 0, "generated": 0, "clips": 0}
+
+    pending = []
+    for topic, level, voice_ids in jobs:
+        job = f"{lesson_id(topic, level)}:{','.join(voice_ids)}"
+        if manifest.is_done(job) and _lesson_complete(store, store.find(topic, level), voice_ids):
+            summary["skipped"] += 1
+        else:
+            pending.append((job, topic, level, voice_ids))
+    log(f"📚 {len(jobs)} lessons, {summary['skipped']} already in the store, {len(pending)} to go")
+
+    def work(job, topic, level, voice_ids):
+        started = time.perf_counter()
+        entry = {"job": job, "topic": topic, "level": level, "voices": voice_ids, "time": time.time()}
+        try:
+            # Batch priority: in a shared process, interactive sessions go first
+            with request_context(tenant="batch", priority="batch"):
+                entry.update(run_job(cb, exa, store, topic, level, voice_ids, lesson_limiter, tts_limiter))
+            entry["status"] = "done"
+        except Exception as e:
+            entry.update(status="failed", error=f"{type(e).__name__}: {e}")
+        entry["seconds"] = round(time.perf_counter() - started, 3)
+        manifest.record(entry)
+        return entry
+
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="polyvoice-batch")
+    try:
+        futures = [executor.submit(work, *args) for args in pending]
+        for n, future in enumerate(as_completed(futures), 1):
+            entry = future.result()
+            if entry["status"] == "done":
+                summary["done"] += 1
+                summary["generated"] += entry["generated"]
+                summary["clips"] += entry["clips"]
+                log(f"[{n}/{len(pending)}] ✅ {entry['topic']} / {entry['level']} ({entry['seconds']:.1f}s)")
+            else:
+                summary["failed"] += 1
+                log(f"[{n}/{len(pending)}] ❌ {entry['topic']} / {entry['level']}: {entry['error']}")
+    except KeyboardInterrupt:
+        log("⏹️ Interrupted; finished lessons are saved. Rerun the same command to resume.")
+        executor.shutdown(wait=True, cancel_futures=True)
+        raise
+    executor.shutdown(wait=True)
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Precompute lessons into a lesson store")
+    parser.add_argument("topics", help="topics file (.txt, .json or .jsonl)")
+    parser.add_argument("--store", default=os.getenv("POLYVOICE_LESSON_STORE") or "lesson_store")
+    parser.add_argument("--levels", nargs="+", default=DEFAULT_LEVELS)
+    parser.add_argument("--voices", nargs="+", default=DEFAULT_VOICES, help="voice names or ElevenLabs voice ids")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--lessons-per-minute", type=float, default=0, help="pipeline runs per minute (0 = unlimited)")
+    parser.add_argument("--tts-per-minute", type=float, default=0, help="ElevenLabs calls per minute (0 = unlimited)")
+    args = parser.parse_args()
+
+    # voice_agent imports Streamlit; keep its bare-mode warnings out of the progress log
+    from streamlit import config
+    from streamlit.logger import set_log_level
+    config.get_config_options()
+    set_log_level("error")
+
+    from .orchestrator import research_cache_stats
+    from .clients import provider_stats
+
+    store = LessonStore(args.store)
+    jobs = load_topics(args.topics, args.levels, args.voices)
+    started = time.perf_counter()
+    summary = run_batch(jobs, store, args.workers, args.lessons_per_minute, args.tts_per_minute)
+    print(f"🏁 {summary} in {time.perf_counter() - started:.1f}s")
+    print(f"   research cache: {research_cache_stats()}")
+    print(f"   providers: {provider_stats()}")
+    print(f"   store: {store.stats()} at {os.path.abspath(args.store)}")
+    return 1 if summary["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,392 @@
+# In agents/lesson_store.py
+
+"""
+Lesson store: every generated lesson and clip in one compact, indexed directory.
+
+    store/
+      store.sqlite3         lessons (zlib-compressed result JSON: answer, quiz, flowchart, refs),
+                            clips (TTS cache key -> segment, offset, length) and lesson_audio
+      segments/seg-NNNNNN   append-only audio segments; clips are byte ranges inside them
+      segments/.lock        flock held while appending or compacting
+      manifest.jsonl        batch progress log (agents/lesson_batch.py)
+
+Set POLYVOICE_LESSON_STORE=/path/to/store and:
+  - voice_agent keeps its clips here instead of one MP3 file per clip (the audio server
+    serves them with HTTP Range support straight out of the segments),
+  - the orchestrator saves complete answers to standalone questions and serves them again
+    after a restart; lessons written by the batch CLI are served for any matching
+    (topic, level), which makes a store copied to another box a zero-API-call curriculum.
+
+SQLite runs in WAL mode and segment appends take an exclusive flock, so several Streamlit
+processes, the API workers and a batch run can write at the same time. MP3 is already
+compressed; only the lesson JSON is zlib'd. Identical audio (same bytes) is stored once.
+
+    python -m agents.lesson_store stats /path/to/store
+    python -m agents.lesson_store compact /path/to/store
+"""
+
+import os
+import sys
+import json
+import time
+import zlib
+import fcntl
+import sqlite3
+import hashlib
+import threading
+
+from .research_cache import normalize_query
+
+DEFAULT_STORE_PATH = os.getenv("POLYVOICE_LESSON_STORE")
+# Budget for clips no lesson refers to (the plain TTS cache part); lesson audio is kept
+DEFAULT_MAX_BYTES = int(float(os.getenv("POLYVOICE_LESSON_STORE_MAX_MB", "512")) * 1024 * 1024)
+SEGMENT_MAX_BYTES = 256 * 1024 * 1024
+# Compact once at least this share of segment bytes (and this many bytes) is dead
+COMPACT_DEAD_RATIO = 0.5
+COMPACT_MIN_DEAD_BYTES = 16 * 1024 * 1024
+# last_used is only rewritten when older than this, so reads rarely write
+TOUCH_INTERVAL_S = 60.0
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS lessons (
+    id TEXT PRIMARY KEY, topic TEXT, norm_topic TEXT, level TEXT, source TEXT,
+    content_hash TEXT, result BLOB, created REAL, updated REAL);
+CREATE INDEX IF NOT EXISTS lessons_topic ON lessons (norm_topic, level);
+CREATE INDEX IF NOT EXISTS lessons_level ON lessons (level);
+CREATE INDEX IF NOT EXISTS lessons_hash ON lessons (content_hash);
+CREATE TABLE IF NOT EXISTS clips (
+    key TEXT PRIMARY KEY, voice_id TEXT, sha256 TEXT,
+    segment INTEGER, offset INTEGER, length INTEGER, created REAL, last_used REAL);
+CREATE INDEX IF NOT EXISTS clips_voice ON clips (voice_id);
+CREATE INDEX IF NOT EXISTS clips_sha ON clips (sha256);
+CREATE INDEX IF NOT EXISTS clips_lru ON clips (last_used);
+CREATE TABLE IF NOT EXISTS lesson_audio (
+    lesson_id TEXT, voice_id TEXT, key TEXT, PRIMARY KEY (lesson_id, voice_id));
+CREATE INDEX IF NOT EXISTS lesson_audio_key ON lesson_audio (key);
+"""
+
+
+def lesson_id(topic, level):
+    return hashlib.sha256(f"{level}\x1f{normalize_query(topic)}".encode("utf-8")).hexdigest()[:24]
+
+
+def content_hash(result):
+    return hashlib.sha256(json.dumps(result, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+class _SegmentLock:
+    """Exclusive flock on segments/.lock: one appender or compactor at a time, across processes."""
+
+    def __init__(self, path, local):
+        self.path = path
+        self.local = local  # flock is per open file, so threads of one process also need a lock
+
+    def __enter__(self):
+        self.local.acquire()
+        self.file = open(self.path, "a")
+        fcntl.flock(self.file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        fcntl.flock(self.file, fcntl.LOCK_UN)
+        self.file.close()
+        self.local.release()
+        return False
+
+
+class LessonStore:
+    def __init__(self, path=None, max_bytes=None):
+        self.path = path or DEFAULT_STORE_PATH
+        self.max_bytes = DEFAULT_MAX_BYTES if max_bytes is None else max_bytes
+        self.segments_dir = os.path.join(self.path, "segments")
+        os.makedirs(self.segments_dir, exist_ok=True)
+        self._local = threading.local()
+        self._segment_lock = _SegmentLock(os.path.join(self.segments_dir, ".lock"), threading.Lock())
+        self._key_locks = {}
+        self._locks_guard = threading.Lock()
+        self._stats = {"lesson_hits": 0, "clip_hits": 0, "clip_misses": 0}
+        self._stats_lock = threading.Lock()
+        with self._conn() as conn:
+            conn.executescript(_SCHEMA)
+
+    def _conn(self):
+        # sqlite3 connections can't be shared between threads; keep one per thread
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(os.path.join(self.path, "store.sqlite3"), timeout=10.0)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _count(self, name):
+        with self._stats_lock:
+            self._stats[name] += 1
+
+    # --- lessons ---
+    def put_lesson(self, topic, level, result, audio=None, source="live"):
+        """Saves (or replaces) the lesson for (topic, level); `audio` maps voice_id -> clip key."""
+        lid, now = lesson_id(topic, level), time.time()
+        blob = zlib.compress(json.dumps(result, ensure_ascii=False).encode("utf-8"))
+        with self._conn() as conn:
+            conn.execute(
+                "INSERT INTO lessons (id, topic, norm_topic, level, source, content_hash, result, created, updated)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT(id) DO UPDATE SET"
+                " topic = excluded.topic, source = excluded.source, content_hash = excluded.content_hash,"
+                " result = excluded.result, updated = excluded.updated"
+                # live traffic never overwrites a curated (batch) lesson
+                " WHERE lessons.source = 'live' OR excluded.source = 'batch'",
+                (lid, topic, normalize_query(topic), level, source, content_hash(result), blob, now, now),
+            )
+            conn.executemany(
+                "INSERT OR REPLACE INTO lesson_audio (lesson_id, voice_id, key) VALUES (?, ?, ?)",
+                [(lid, voice_id, key) for voice_id, key in (audio or {}).items()],
+            )
+        return lid
+
+    def find(self, topic, level):
+        """{"topic", "level", "source", "result", "audio": {voice_id: key}} or None."""
+        lid = lesson_id(topic, level)
+        conn = self._conn()
+        row = conn.execute("SELECT topic, level, source, result FROM lessons WHERE id = ?", (lid,)).fetchone()
+        if row is None:
+            return None
+        audio = dict(conn.execute("SELECT voice_id, key FROM lesson_audio WHERE lesson_id = ?", (lid,)).fetchall())
+        return {
+            "topic": row[0], "level": row[1], "source": row[2],
+            "result": json.loads(zlib.decompress(row[3])), "audio": audio,
+        }
+
+    def get_result(self, topic, level, sources=None):
+        """The stored pipeline result for (topic, level), optionally only from the given sources."""
+        lesson = self.find(topic, level)
+        if lesson is None or (sources is not None and lesson["source"] not in sources):
+            return None
+        self._count("lesson_hits")
+        return lesson["result"]
+
+    def lessons(self, topic=None, level=None, voice_id=None, limit=100):
+        """Lesson summaries (newest first), filtered by topic, level and/or voice with audio."""
+        query = "SELECT DISTINCT l.topic, l.level, l.source, l.content_hash, l.updated FROM lessons l"
+        where, params = [], []
+        if voice_id is not None:
+            query += " JOIN lesson_audio a ON a.lesson_id = l.id"
+            where.append("a.voice_id = ?")
+            params.append(voice_id)
+        if topic is not None:
+            where.append("l.norm_topic = ?")
+            params.append(normalize_query(topic))
+        if level is not None:
+            where.append("l.level = ?")
+            params.append(level)
+        if where:
+            query += " WHERE " + " AND ".join(where)
+        query += " ORDER BY l.updated DESC LIMIT ?"
+        rows = self._conn().execute(query, params + [limit]).fetchall()
+        return [dict(zip(("topic", "level", "source", "content_hash", "updated"), row)) for row in rows]
+
+    # --- clips ---
+    def _segment_path(self, segment):
+        return os.path.join(self.segments_dir, f"seg-{segment:06d}")
+
+    def _segments(self):
+        return sorted(int(name[4:]) for name in os.listdir(self.segments_dir) if name.startswith("seg-"))
+
+    def _locate(self, key):
+        return self._conn().execute(
+            "SELECT segment, offset, length, last_used FROM clips WHERE key = ?", (key,)
+        ).fetchone()
+
+    def has_clip(self, key):
+        return self._locate(key) is not None
+
+    def clip_size(self, key):
+        row = self._locate(key)
+        return row[2] if row else None
+
+    def _read_range(self, row, start, end):
+        segment, offset, length, _ = row
+        end = length - 1 if end is None else min(end, length - 1)
+        with open(self._segment_path(segment), "rb") as f:
+            return os.pread(f.fileno(), max(0, end - start + 1), offset + start)
+
+    def read_clip(self, key, start=0, end=None):
+        """Bytes [start, end] (inclusive, like HTTP Range) of a clip, or None if it isn't stored."""
+        row = self._locate(key)
+        if row is None:
+            return None
+        try:
+            data = self._read_range(row, start, end)
+        except FileNotFoundError:
+            # Compacted away between the lookup and the open: resolve again with compaction locked out
+            with self._segment_lock:
+                row = self._locate(key)
+                if row is None:
+                    return None
+                data = self._read_range(row, start, end)
+        if time.time() - row[3] > TOUCH_INTERVAL_S:
+            with self._conn() as conn:
+                conn.execute("UPDATE clips SET last_used = ? WHERE key = ?", (time.time(), key))
+        return data
+
+    def put_clip(self, key, data, voice_id=None):
+        """Appends a clip to the active segment (identical bytes are stored once)."""
+        sha = hashlib.sha256(data).hexdigest()
+        now = time.time()
+        with self._segment_lock:
+            conn = self._conn()
+            same = conn.execute("SELECT segment, offset, length FROM clips WHERE sha256 = ? LIMIT 1", (sha,)).fetchone()
+            if same is not None:
+                segment, offset, _ = same
+            else:
+                segments = self._segments()
+                segment = segments[-1] if segments else 1
+                if os.path.exists(self._segment_path(segment)) and \
+                        os.path.getsize(self._segment_path(segment)) >= SEGMENT_MAX_BYTES:
+                    segment += 1
+                with open(self._segment_path(segment), "ab") as f:
+                    offset = f.seek(0, os.SEEK_END)
+                    f.write(data)
+                    f.flush()
+                    os.fsync(f.fileno())
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO clips (key, voice_id, sha256, segment, offset, length, created, last_used)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (key, voice_id, sha, segment, offset, len(data), now, now),
+                )
+        self.evict()
+        return key
+
+    def get_or_create(self, key, produce, voice_id=None):
+        """
+        Cache-aside helper (same contract as TTSCache.get_or_create, but returns the key):
+        calls produce() -> bytes on a miss; concurrent misses in this process share one call.
+        """
+        if self.has_clip(key):
+            self._count("clip_hits")
+            return key
+        with self._locks_guard:
+            lock = self._key_locks.setdefault(key, threading.Lock())
+        with lock:
+            if not self.has_clip(key):
+                self._count("clip_misses")
+                self.put_clip(key, produce(), voice_id)
+        # Kept after a failed produce(), like TTSCache, so waiters don't race a newcomer
+        with self._locks_guard:
+            self._key_locks.pop(key, None)
+        return key
+
+    # --- space management ---
+    def live_bytes(self):
+        row = self._conn().execute(
+            "SELECT COALESCE(SUM(length), 0) FROM (SELECT DISTINCT segment, offset, length FROM clips)"
+        ).fetchone()
+        return row[0]
+
+    def segment_bytes(self):
+        with self._segment_lock:
+            return self._segment_bytes()
+
+    def _segment_bytes(self):
+        # Callers hold the segment lock, so a compaction can't delete a listed segment
+        return sum(os.path.getsize(self._segment_path(s)) for s in self._segments())
+
+    def evict(self):
+        """Drops least-recently-used clips no lesson refers to until those fit in max_bytes."""
+        conn = self._conn()
+        unpinned = conn.execute(
+            "SELECT COALESCE(SUM(length), 0) FROM clips WHERE key NOT IN (SELECT key FROM lesson_audio)"
+        ).fetchone()[0]
+        if unpinned <= self.max_bytes:
+            return 0
+        dropped = 0
+        rows = conn.execute(
+            "SELECT key, length FROM clips WHERE key NOT IN (SELECT key FROM lesson_audio) ORDER BY last_used"
+        ).fetchall()
+        with conn:
+            for key, length in rows:
+                if unpinned <= self.max_bytes:
+                    break
+                conn.execute("DELETE FROM clips WHERE key = ?", (key,))
+                unpinned -= length
+                dropped += 1
+        self.maybe_compact()
+        return dropped
+
+    def maybe_compact(self):
+        with self._segment_lock:
+            total = self._segment_bytes()
+            dead = total - self.live_bytes()
+            if dead >= COMPACT_MIN_DEAD_BYTES and dead >= total * COMPACT_DEAD_RATIO:
+                return self._compact()
+        return None
+
+    def compact(self):
+        """
+        Copies live clips into a fresh segment and deletes the old ones. Readers holding
+        stale offsets re-resolve on FileNotFoundError (see read_clip).
+        """
+        with self._segment_lock:
+            return self._compact()
+
+    def _compact(self):
+        conn = self._conn()
+        old = self._segments()
+        before = sum(os.path.getsize(self._segment_path(s)) for s in old)
+        target = (old[-1] if old else 0) + 1
+        moves = {}  # (segment, offset) -> new offset
+        ranges = conn.execute("SELECT DISTINCT segment, offset, length FROM clips ORDER BY segment, offset").fetchall()
+        with open(self._segment_path(target), "wb") as out:
+            for segment, offset, length in ranges:
+                with open(self._segment_path(segment), "rb") as f:
+                    data = os.pread(f.fileno(), length, offset)
+                moves[(segment, offset)] = out.tell()
+                out.write(data)
+            out.flush()
+            os.fsync(out.fileno())
+        with conn:
+            for (segment, offset), new_offset in moves.items():
+                conn.execute(
+                    "UPDATE clips SET segment = ?, offset = ? WHERE segment = ? AND offset = ?",
+                    (target, new_offset, segment, offset),
+                )
+        for segment in old:
+            os.remove(self._segment_path(segment))
+        after = os.path.getsize(self._segment_path(target))
+        return {"before_bytes": before, "after_bytes": after, "clips": len(ranges)}
+
+    def stats(self):
+        conn = self._conn()
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats.update(
+            lessons=conn.execute("SELECT COUNT(*) FROM lessons").fetchone()[0],
+            clips=conn.execute("SELECT COUNT(*) FROM clips").fetchone()[0],
+            live_bytes=self.live_bytes(),
+            segment_bytes=self.segment_bytes(),
+        )
+        return stats
+
+
+_default_store = None
+_default_loaded = False
+_default_lock = threading.Lock()
+
+
+def get_default_store():
+    """The store named by POLYVOICE_LESSON_STORE, or None when it isn't set."""
+    global _default_store, _default_loaded
+    with _default_lock:
+        if not _default_loaded:
+            if DEFAULT_STORE_PATH:
+                _default_store = LessonStore(DEFAULT_STORE_PATH)
+            _default_loaded = True
+        return _default_store
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3 or sys.argv[1] not in ("stats", "compact"):
+        sys.exit("usage: python -m agents.lesson_store {stats|compact} STORE_DIR")
+    store = LessonStore(sys.argv[2])
+    print(json.dumps(store.compact() if sys.argv[1] == "compact" else store.stats(), indent=2))
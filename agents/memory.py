@@ -0,0 +1,172 @@
+# In agents/memory.py
+
+import os
+import re
+import zlib
+import threading
+from collections import deque
+
+from .clients import guarded_call
+from .context_builder import estimate_tokens
+
+# Total prompt budget for conversation memory (summary + recent turns)
+DEFAULT_TOKEN_BUDGET = int(os.getenv("POLYVOICE_MEMORY_TOKENS", "1200"))
+RECENT_TURNS = 6
+# The rolling summary never takes more than this share of the budget
+SUMMARY_SHARE = 0.35
+SUMMARY_LINE_WORDS = 28
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s")
+_MARKUP = re.compile(r"[*_#`>|]+")
+
+
+def extractive_summary(summary, role, text):
+    """
+    Default summarizer (no LLM call): appends the first sentence of the folded turn.
+    Both sides of the conversation are kept, so "that" in a follow-up still has a referent.
+    """
+    first = _SENTENCE_END.split(_MARKUP.sub("", text).strip(), maxsplit=1)[0]
+    words = first.split()
+    if len(words) > SUMMARY_LINE_WORDS:
+        first = " ".join(words[:SUMMARY_LINE_WORDS]) + "…"
+    speaker = "Student asked" if role == "user" else "Tutor explained"
+    line = f"- {speaker}: {first}"
+    return f"{summary}\n{line}" if summary else line
+
+
+def llm_summarizer(cb, model="llama3.1-8b"):
+    """Optional summarizer that asks Cerebras to fold a turn into the running summary."""
+    def summarize(summary, role, text):
+        prompt = f"""
+    Update the running summary of a tutoring conversation with the new turn below.
+    Keep it under 120 words, as short bullet points. Keep topics, definitions and open questions.
+
+    [CURRENT SUMMARY]: {summary or '(empty)'}
+    [NEW TURN - {role.upper()}]: {text}
+
+    Output ONLY the updated summary.
+    """
+        completion = guarded_call(
+            "cerebras", cb.chat.completions.create,
+            model=model,
+            messages=[{"role": "user", "content": prompt}],
+            max_tokens=200,
+            temperature=0.0
+        )
+        return completion.choices[0].message.content.strip()
+    return summarize
+
+
+class ConversationMemory:
+    """
+    Bounded conversation memory for the tutor.
+    - The most recent turns stay verbatim (stored zlib-compressed).
+    - Older turns are folded into an incrementally updated summary.
+    - prompt_messages() never exceeds token_budget, however long the session runs.
+    Iterating yields the recent turns as {"role", "content"} dicts, like the old chat_history list.
+    """
+
+    def __init__(self, token_budget=DEFAULT_TOKEN_BUDGET, recent_turns=RECENT_TURNS, summarizer=None):
+        self.token_budget = token_budget
+        self.recent_turns = recent_turns
+        self.summarizer = summarizer or extractive_summary
+        self.summary = ""
+        self.folded_turns = 0
+        self._turns = deque()  # (role, compressed content, tokens)
+        self._lock = threading.Lock()
+
+    # --- writing ---
+    def add(self, role, content):
+        with self._lock:
+            self._turns.append((role, zlib.compress(content.encode("utf-8")), estimate_tokens(content)))
+            self._compact()
+
+    def add_user(self, content):
+        self.add("user", content)
+
+    def add_assistant(self, content):
+        self.add("assistant", content)
+
+    def _recent_budget(self):
+        return self.token_budget - estimate_tokens(self.summary)
+
+    def _compact(self):
+        while self._turns and (
+            len(self._turns) > self.recent_turns
+            or sum(t[2] for t in self._turns) > self._recent_budget()
+        ):
+            if len(self._turns) == 1:
+                break  # the newest turn is always kept (clipped in prompt_messages)
+            role, blob, _ = self._turns.popleft()
+            self.summary = self.summarizer(self.summary, role, zlib.decompress(blob).decode("utf-8"))
+            self.folded_turns += 1
+            self._trim_summary()
+
+    def _trim_summary(self):
+        limit = int(self.token_budget * SUMMARY_SHARE)
+        lines = self.summary.split("\n")
+        while len(lines) > 1 and estimate_tokens("\n".join(lines)) > limit:
+            lines.pop(0)  # oldest facts go first
+        summary = "\n".join(lines)
+        self.summary = summary[: limit * 4]
+
+    # --- reading ---
+    def __iter__(self):
+        with self._lock:
+            turns = list(self._turns)
+        for role, blob, _ in turns:
+            yield {"role": role, "content": zlib.decompress(blob).decode("utf-8")}
+
+    def __len__(self):
+        return len(self._turns)
+
+    def prompt_messages(self):
+        """Summary (as a system note) + recent turns, within token_budget."""
+        messages = []
+        if self.summary:
+            messages.append({"role": "system", "content": f"[CONVERSATION SUMMARY]:\n{self.summary}"})
+        remaining = self.token_budget - estimate_tokens(self.summary)
+        for turn in self:
+            if remaining <= 0:
+                break
+            content = turn["content"]
+            if estimate_tokens(content) > remaining:
+                content = content[: remaining * 4] + "…"
+            messages.append({"role": turn["role"], "content": content})
+            remaining -= estimate_tokens(content)
+        return messages
+
+    # --- serialization (e.g. to send memory to the API server) ---
+    def to_state(self):
+        return {"summary": self.summary, "folded_turns": self.folded_turns, "turns": list(self)}
+
+    @classmethod
+    def from_state(cls, state, **kwargs):
+        memory = cls(**kwargs)
+        memory.summary = state.get("summary", "")
+        memory.folded_turns = state.get("folded_turns", 0)
+        for turn in state.get("turns", []):
+            memory.add(turn["role"], turn["content"])
+        return memory
+
+    def stats(self):
+        return {
+            "recent_turns": len(self._turns),
+            "folded_turns": self.folded_turns,
+            "summary_tokens": estimate_tokens(self.summary),
+            "stored_bytes": sum(len(t[1]) for t in self._turns) + len(self.summary.encode("utf-8")),
+        }
+
+
+def history_messages(chat_history):
+    """
+    Conversation memory as prompt messages, for either a ConversationMemory or the
+    legacy list of chat dicts (last six messages, user turns only).
+    """
+    if isinstance(chat_history, ConversationMemory):
+        return chat_history.prompt_messages()
+    return [
+        {"role": "user", "content": msg["content"]}
+        for msg in chat_history[-6:]
+        if msg["role"] == "user"
+    ]
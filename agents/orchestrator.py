@@ -1,55 +1,337 @@
 import os
-from exa_py import Exa
-from cerebras.cloud.sdk import Cerebras
-from dotenv import load_dotenv
-from elevenlabs.client import ElevenLabs 
+import time
+import logging
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as StageTimeout
 
-from .simplify_agent import run as run_simplifier_agent
-from .quiz_agent import run as run_quiz_agent
+from .simplify_agent import run as run_simplifier_agent, run_stream as stream_simplifier_agent, detect_override
+from .quiz_agent import (
+    run as run_quiz_agent, generate_quiz, generate_flowchart,
+    generate_lesson_extras, extras_from_text, extras_result, QUIZ_MODE,
+)
+from .research_cache import get_default_cache as get_research_cache
+from .answer_cache import get_default_cache as get_answer_cache, history_fingerprint
+from .lesson_store import get_default_store
+from .context_builder import build_context
+from .clients import guarded_call, ProviderUnavailable
+from .tracing import span, annotate
+
+logger = logging.getLogger(__name__)
 
 # NOTE: The global client initialization block below should be REMOVED from this file
 # if you are initializing the clients in app.py (which is the final, working architecture).
 
+# --- CONCURRENT EXECUTION SETTINGS ---
+# Per-stage timeouts (seconds). Optional stages degrade to an empty value on timeout;
+# the simplifier is the answer itself, so its timeout is raised to the caller.
+STAGE_TIMEOUTS = {
+    "research": 10.0,
+    "override": 3.0,
+    "simplify": 45.0,
+    "quiz": 20.0,
+    "flowchart": 20.0,
+    "extras": 25.0,  # combined quiz + flowchart completion (POLYVOICE_QUIZ_MODE=combined)
+}
+
+# One shared pool per process: the SDK clients are blocking, so threads are the right fit.
+# Each question uses at most two workers at a time (research + override, then quiz + flowchart).
+_STAGE_EXECUTOR = ThreadPoolExecutor(
+    max_workers=int(os.getenv("POLYVOICE_STAGE_WORKERS", "16")),
+    thread_name_prefix="polyvoice-stage",
+)
+
+
+def _submit(fn, *args):
+    """Runs a stage on the shared pool inside a copy of the caller's context (keeps trace parents)."""
+    return _STAGE_EXECUTOR.submit(contextvars.copy_context().run, fn, *args)
+
+
 # --- RESEARCH AGENT FUNCTIONALITY (Updated for dependency injection) ---
-def run_research_agent(exa, query, num=5):
+RESEARCH_TEXT_CHARS = 2000
+
+
+def run_research_agent(exa, query, num=5, use_cache=True):
     """
     Step 1: Research Agent - Uses Exa to find web content snippets.
+    Results are shared through the research cache (normalized query + search params),
+    so repeated and concurrent identical questions cost one Exa call.
     """
-    result = exa.search_and_contents(
-        query,
-        type="auto",
-        num_results=num,
-        # Increased RAG size for more context
-        text={"max_characters": 2000} 
-    )
-    return result.results
+    def search():
+        result = guarded_call(
+            "exa", exa.search_and_contents,
+            query,
+            type="auto",
+            num_results=num,
+            # Increased RAG size for more context
+            text={"max_characters": RESEARCH_TEXT_CHARS} 
+        )
+        annotate(cache="miss")
+        return result.results
+
+    with span("research", cache="hit" if use_cache else "bypass") as s:
+        if not use_cache:
+            sources = search()
+        else:
+            params = {"type": "auto", "num_results": num, "max_characters": RESEARCH_TEXT_CHARS}
+            sources = get_research_cache().get_or_fetch(query, params, search)
+        s.set(sources=len(sources))
+        return sources
+
+
+def _build_context(sources, query):
+    """Deduped, query-ranked snippets packed into the prompt token budget."""
+    with span("context") as s:
+        context, stats = build_context(sources, query)
+        s.set(context_tokens=stats["context_tokens"], tokens_saved=stats["tokens_saved"])
+        return context, stats
+
+
+def research_cache_stats():
+    """Hit/miss/coalesced counters for this process."""
+    return get_research_cache().stats()
+
+
+def _await_stage(future, name, started_at, timeouts, default=None, required=False):
+    """
+    Waits for a stage until its deadline (measured from submission, not from this call).
+    Optional stages fall back to `default` on timeout, when their provider is unavailable
+    (circuit open / saturated) or on any other error, e.g. a 5xx that outlasted the
+    retries; required stages re-raise.
+    """
+    remaining = max(0.0, timeouts[name] - (time.monotonic() - started_at))
+    try:
+        return future.result(timeout=remaining)
+    except StageTimeout:
+        future.cancel()
+        if required:
+            raise TimeoutError(f"Pipeline stage '{name}' exceeded {timeouts[name]}s")
+        return default
+    except ProviderUnavailable:
+        if required:
+            raise
+        return default
+    except Exception as e:
+        if required:
+            raise
+        logger.warning("Optional stage '%s' failed, skipping it: %s", name, e)
+        return default
+
+
+# --- ANSWER CACHE ---
+def _is_complete(result):
+    """Results with a timed-out quiz/flowchart aren't worth serving to the next student."""
+    return bool(result["simplified_text"] and result["quiz_text"] and result["flowchart_text"])
+
+
+def _is_standalone(query, chat_history):
+    """No earlier user turns, i.e. the answer doesn't depend on the conversation."""
+    return history_fingerprint(chat_history, query) == history_fingerprint([], query)
+
+
+def _cached_result(query, complexity_level, chat_history):
+    cached, how = get_answer_cache().get(query, complexity_level, chat_history)
+    store = get_default_store()
+    if cached is None and store is not None:
+        # Batch lessons (agents/lesson_batch.py) match on (topic, level) alone; answers saved
+        # from live traffic only stand in for the same standalone question
+        sources = None if _is_standalone(query, chat_history) else ("batch",)
+        cached, how = store.get_result(query, complexity_level, sources), "store"
+    if cached is not None:
+        cached["answer_cache"] = how
+    return cached
+
+
+def _store_result(query, complexity_level, chat_history, result):
+    if _is_complete(result):
+        get_answer_cache().put(query, complexity_level, chat_history, result)
+        store = get_default_store()
+        if store is not None and _is_standalone(query, chat_history):
+            store.put_lesson(query, complexity_level, result)  # survives restarts
+    result["answer_cache"] = "miss"
+    return result
+
+
+def answer_cache_stats():
+    """Exact/similar hit and miss counters for this process."""
+    return get_answer_cache().stats()
+
 
 # --- ORCHESTRATOR FUNCTION (CORRECTED SIGNATURE AND LOGIC) ---
-def run_pipeline(cb, exa, query, complexity_level, chat_history): 
+def run_pipeline(cb, exa, query, complexity_level, chat_history, concurrent=False, timeouts=None, use_cache=True): 
     """
     ORCHESTRATOR: Manages the flow (Research -> Simplify -> Quiz) with memory.
+    Set concurrent=True to schedule independent stages in parallel (same result dict).
+    With use_cache, a repeat of (level, query, recent history) is served from the answer cache.
     """
+    if concurrent:
+        return run_pipeline_concurrent(cb, exa, query, complexity_level, chat_history, timeouts, use_cache)
+
+    with span("pipeline", mode="serial", level=complexity_level) as s:
+        if use_cache:
+            cached = _cached_result(query, complexity_level, chat_history)
+            if cached is not None:
+                s.set(cache=cached["answer_cache"])
+                return cached
+        result = _run_pipeline_serial(cb, exa, query, complexity_level, chat_history)
+        result = _store_result(query, complexity_level, chat_history, result) if use_cache else result
+        s.set(cache=result.get("answer_cache", "bypass"))
+        return result
+
+
+def _run_pipeline_serial(cb, exa, query, complexity_level, chat_history):
     # 1. 🔍 STEP 1: RESEARCH AGENT (Data Retrieval/RAG Context)
     sources = run_research_agent(exa, query, 5) 
 
-    context = ""
-    for i, s in enumerate(sources, 1):
-        # Increased snippet length for better context transfer to the LLM
-        context += f"Source {i}. {s.title}: {s.text[:1800]}...\n" 
-        
+    # Deduped, query-ranked snippets packed into the prompt token budget
+    context, context_stats = _build_context(sources, query)
     references = [{"title": s.title, "url": s.url} for s in sources]
 
     # 2. 📝 STEP 2: SIMPLIFIER AGENT (Cerebras Call 1)
     simplified_text = run_simplifier_agent(cb, context, query, complexity_level, chat_history)
 
-    # 3. ❓ STEP 3: QUIZ AGENT (Cerebras Call 2 - Now returns a dictionary)
-    # FIX 1: The quiz agent now returns {'quiz_text': ..., 'flowchart_text': ...}
-    quiz_results = run_quiz_agent(cb, simplified_text, query, chat_history) 
+    # 3. ❓ STEP 3: QUIZ AGENT (one structured Cerebras call in the default combined mode)
+    # The quiz agent returns {'quiz', 'flowchart', 'quiz_text', 'flowchart_text'}
+    extras = run_quiz_agent(cb, simplified_text, query, chat_history) 
 
     # 4. FINAL RETURN
     return {
         "simplified_text": simplified_text,
-        "quiz_text": quiz_results["quiz_text"],     # FIX 2: Unpack the quiz text
-        "flowchart_text": quiz_results["flowchart_text"], # FIX 3: Unpack the new flowchart text
-        "references": references 
-    }
\ No newline at end of file
+        **extras,
+        "references": references,
+        "context_stats": context_stats
+    }
+
+
+# --- CONCURRENT ORCHESTRATOR ---
+def _research_and_override(cb, exa, query, complexity_level, timeouts):
+    """Wave 1: Exa research and the override classifier only need `query`, so they run together."""
+    started = time.monotonic()
+    research_future = _submit(run_research_agent, exa, query, 5)
+    override_future = _submit(detect_override, cb, query)
+
+    sources = _await_stage(research_future, "research", started, timeouts, default=[])
+    new_level, override_source = _await_stage(
+        override_future, "override", started, timeouts, default=(None, "timeout")
+    )
+    return sources, (new_level or complexity_level), override_source
+
+
+def _quiz_and_flowchart(cb, simplified_text, query, timeouts):
+    """
+    Wave 3: quiz and flowchart only depend on the simplified text. Combined mode asks for
+    both in one structured completion; separate mode runs the two free-text prompts in parallel.
+    Returns the quiz agent's extras dict (structured parts + text renderings).
+    """
+    started = time.monotonic()
+    if QUIZ_MODE == "combined":
+        extras_future = _submit(generate_lesson_extras, cb, simplified_text, query)
+        return _await_stage(extras_future, "extras", started, timeouts, default=extras_result(None, None))
+    quiz_future = _submit(generate_quiz, cb, simplified_text, query)
+    flowchart_future = _submit(generate_flowchart, cb, simplified_text)
+    return extras_from_text(
+        _await_stage(quiz_future, "quiz", started, timeouts, default=""),
+        _await_stage(flowchart_future, "flowchart", started, timeouts, default=""),
+    )
+
+
+def run_pipeline_concurrent(cb, exa, query, complexity_level, chat_history, timeouts=None, use_cache=True):
+    """
+    Same flow and result dict as run_pipeline, but independent stages overlap:
+      Wave 1: Research (Exa) || Override classifier   -- both only need `query`
+      Wave 2: Simplifier                               -- needs context + level
+      Wave 3: Quiz + Flowchart                         -- both only need `simplified_text`
+                                                          (one structured call, or two in parallel)
+    """
+    with span("pipeline", mode="concurrent", level=complexity_level) as s:
+        if use_cache:
+            cached = _cached_result(query, complexity_level, chat_history)
+            if cached is not None:
+                s.set(cache=cached["answer_cache"])
+                return cached
+        result = _run_pipeline_concurrent(cb, exa, query, complexity_level, chat_history, timeouts)
+        result = _store_result(query, complexity_level, chat_history, result) if use_cache else result
+        s.set(cache=result.get("answer_cache", "bypass"), override_source=result["override_source"])
+        return result
+
+
+def _run_pipeline_concurrent(cb, exa, query, complexity_level, chat_history, timeouts):
+    timeouts = {**STAGE_TIMEOUTS, **(timeouts or {})}
+
+    # 🔍 + 🎚️ WAVE 1
+    sources, complexity_level, override_source = _research_and_override(cb, exa, query, complexity_level, timeouts)
+    # Deduped, query-ranked snippets packed into the prompt token budget
+    context, context_stats = _build_context(sources, query)
+    references = [{"title": s.title, "url": s.url} for s in sources]
+
+    # 📝 WAVE 2
+    started = time.monotonic()
+    simplify_future = _submit(
+        run_simplifier_agent, cb, context, query, complexity_level, chat_history, False
+    )
+    simplified_text = _await_stage(simplify_future, "simplify", started, timeouts, required=True)
+
+    # ❓ + 📊 WAVE 3
+    extras = _quiz_and_flowchart(cb, simplified_text, query, timeouts)
+
+    return {
+        "simplified_text": simplified_text,
+        **extras,
+        "references": references,
+        "context_stats": context_stats,
+        # Which classifier path decided the level ("local", "llm", "local-fallback", "timeout")
+        "override_source": override_source
+    }
+
+
+# --- STREAMING ORCHESTRATOR ---
+def run_pipeline_stream(cb, exa, query, complexity_level, chat_history, timeouts=None, use_cache=True):
+    """
+    Streaming flavour of run_pipeline_concurrent. Yields (event, payload) tuples:
+      ("delta", str)   -- simplifier tokens as they arrive
+      ("result", dict) -- the usual result dict, once quiz + flowchart are done
+    A cache hit yields the whole answer as a single delta.
+    """
+    with span("pipeline", mode="stream", level=complexity_level) as s:
+        for event, payload in _run_pipeline_stream(cb, exa, query, complexity_level, chat_history, timeouts, use_cache):
+            if event == "result":
+                s.set(cache=payload.get("answer_cache", "bypass"), override_source=payload.get("override_source"))
+            yield event, payload
+
+
+def _run_pipeline_stream(cb, exa, query, complexity_level, chat_history, timeouts, use_cache):
+    if use_cache:
+        cached = _cached_result(query, complexity_level, chat_history)
+        if cached is not None:
+            yield "delta", cached["simplified_text"]
+            yield "result", cached
+            return
+
+    requested_level = complexity_level
+    timeouts = {**STAGE_TIMEOUTS, **(timeouts or {})}
+
+    sources, complexity_level, override_source = _research_and_override(cb, exa, query, complexity_level, timeouts)
+    # Deduped, query-ranked snippets packed into the prompt token budget
+    context, context_stats = _build_context(sources, query)
+    references = [{"title": s.title, "url": s.url} for s in sources]
+
+    # 📝 The simplifier streams on the caller's thread; the deadline is checked between chunks.
+    started = time.monotonic()
+    parts = []
+    for delta in stream_simplifier_agent(cb, context, query, complexity_level, chat_history, False):
+        parts.append(delta)
+        yield "delta", delta
+        if time.monotonic() - started > timeouts["simplify"]:
+            raise TimeoutError(f"Pipeline stage 'simplify' exceeded {timeouts['simplify']}s")
+    simplified_text = "".join(parts)
+
+    extras = _quiz_and_flowchart(cb, simplified_text, query, timeouts)
+
+    result = {
+        "simplified_text": simplified_text,
+        **extras,
+        "references": references,
+        "context_stats": context_stats,
+        # Which classifier path decided the level ("local", "llm", "local-fallback", "timeout")
+        "override_source": override_source
+    }
+    yield "result", _store_result(query, requested_level, chat_history, result) if use_cache else result
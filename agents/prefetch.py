@@ -0,0 +1,160 @@
+# In agents/prefetch.py
+
+"""
+Speculative prefetch of likely follow-up questions.
+
+While the student reads, listens and takes the quiz, the backend is idle. After an answer,
+a session's Prefetcher derives a few follow-up questions from the flowchart (or the quiz),
+with no LLM call, and runs them through the pipeline in the background. That warms the
+research and answer caches (and optionally the TTS cache) for the current level and
+conversation. A new question cancels whatever hasn't started yet. Prefetch calls run at the
+scheduler's lowest priority (agents/scheduler.py) and are dropped rather than queued when a
+provider is busy.
+
+    POLYVOICE_PREFETCH=1                 enable
+    POLYVOICE_PREFETCH_PER_ANSWER=2      follow-ups prefetched after each answer
+    POLYVOICE_PREFETCH_BUDGET=10         pipeline runs per session, in total
+    POLYVOICE_PREFETCH_TTS=1             also synthesize the prefetched answers
+    POLYVOICE_PREFETCH_WORKERS=2         background threads per process
+"""
+
+import os
+import re
+import logging
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+from .memory import ConversationMemory
+from .clients import ProviderUnavailable
+from .tracing import span
+from .scheduler import request_context
+
+logger = logging.getLogger(__name__)
+
+ENABLED = os.getenv("POLYVOICE_PREFETCH", "").lower() in ("1", "true", "yes")
+PER_ANSWER = int(os.getenv("POLYVOICE_PREFETCH_PER_ANSWER", "2"))
+SESSION_BUDGET = int(os.getenv("POLYVOICE_PREFETCH_BUDGET", "10"))
+PREFETCH_TTS = os.getenv("POLYVOICE_PREFETCH_TTS", "").lower() in ("1", "true", "yes")
+
+# Separate from the orchestrator's stage pool, so speculative work never queues ahead of
+# the stages of a question somebody is actually waiting for.
+_PREFETCH_EXECUTOR = ThreadPoolExecutor(
+    max_workers=int(os.getenv("POLYVOICE_PREFETCH_WORKERS", "2")),
+    thread_name_prefix="polyvoice-prefetch",
+)
+
+# Flowchart boxes that are scaffolding rather than topics
+_GENERIC_LABELS = {"start", "end", "question", "summary", "conclusion", "introduction", "result", "example"}
+
+
+def follow_up_queries(result, query, limit=PER_ANSWER):
+    """
+    Likely next questions, cheapest signal first: flowchart steps (later steps are usually
+    the part a student wants expanded), then the quiz's correct answer.
+    """
+    query_lower = query.lower()
+    candidates = []
+    flowchart = result.get("flowchart") or {}
+    for node in flowchart.get("nodes", [])[1:]:  # the first box restates the question
+        candidates.append(node["label"])
+    quiz = result.get("quiz")
+    if quiz:
+        candidates.append(quiz["options"][quiz["answer_index"]])
+
+    queries, seen = [], set()
+    for label in candidates:
+        topic = re.sub(r"\s+", " ", label).strip(" .?!:;")
+        key = topic.lower()
+        if (len(topic) < 3 or len(topic) > 60 or key in _GENERIC_LABELS
+                or key in seen or key in query_lower):
+            continue
+        seen.add(key)
+        queries.append(f"Tell me more about {topic}")
+        if len(queries) >= limit:
+            break
+    return queries
+
+
+def _snapshot(chat_history):
+    """A private copy of the conversation as it will look when the follow-up is asked."""
+    if isinstance(chat_history, ConversationMemory):
+        return ConversationMemory.from_state(chat_history.to_state())
+    return list(chat_history or [])
+
+
+class Prefetcher:
+    """
+    One per session. schedule() after an answer; cancel() when a new question arrives.
+    Without cb/exa the process-wide clients are used, built on the first prefetch.
+    """
+
+    def __init__(self, cb=None, exa=None, budget=SESSION_BUDGET, per_answer=PER_ANSWER, tts=PREFETCH_TTS):
+        self.cb = cb
+        self.exa = exa
+        self.budget = budget
+        self.per_answer = per_answer
+        self.tts = tts
+        self._generation = 0
+        self._lock = threading.Lock()
+        self.counters = {"scheduled": 0, "completed": 0, "cancelled": 0, "failed": 0, "over_budget": 0}
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def cancel(self):
+        """Queued follow-ups for the previous answer are dropped (a running one finishes)."""
+        with self._lock:
+            self._generation += 1
+
+    def schedule(self, query, complexity_level, chat_history, result, voice_id=None, speed_rate=1.0, tier=None):
+        """
+        Queues follow-ups for `result`. `chat_history` must already include this turn
+        (question + answer), since that is the history the next question is cached under.
+        Returns the follow-up questions (so the UI can suggest them).
+        """
+        queries = follow_up_queries(result, query, self.per_answer)
+        with self._lock:
+            self._generation += 1
+            generation = self._generation
+            allowed = max(0, min(len(queries), self.budget))
+            self.budget -= allowed
+            self.counters["over_budget"] += len(queries) - allowed
+            self.counters["scheduled"] += allowed
+        history = _snapshot(chat_history)
+        for follow_up in queries[:allowed]:
+            # The session's tenant/user come along; the priority is lowered in _prefetch
+            _PREFETCH_EXECUTOR.submit(
+                contextvars.copy_context().run, self._prefetch, generation, follow_up, complexity_level, history, voice_id, speed_rate, tier
+            )
+        return queries
+
+    def _prefetch(self, generation, query, complexity_level, history, voice_id, speed_rate, tier):
+        if generation != self._generation:
+            self._count("cancelled")
+            return
+        from .orchestrator import run_pipeline  # deferred: the orchestrator is the heavier import
+
+        cb, exa = self.cb, self.exa
+        if cb is None:
+            from .clients import get_clients
+            cb, exa, _ = get_clients()
+        try:
+            with request_context(priority="prefetch"), span("prefetch", query=query):
+                result = run_pipeline(cb, exa, query, complexity_level, history, concurrent=True)
+                if self.tts and voice_id and generation == self._generation:
+                    from .voice_agent import ensure_audio
+                    ensure_audio(result["simplified_text"], voice_id, speed_rate, tier)
+        except ProviderUnavailable:
+            self._count("failed")  # a saturated provider is busy with real traffic; don't push
+            return
+        except Exception as e:
+            logger.warning("Prefetch of %r failed: %s", query, e)
+            self._count("failed")
+            return
+        self._count("completed")
+
+    def stats(self):
+        with self._lock:
+            return {**self.counters, "budget_left": self.budget}
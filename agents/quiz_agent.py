@@ -1,12 +1,26 @@
 # In agents/quiz_agent.py
 
+import os
+import re
+import json
+import logging
+
+from .clients import guarded_call, ProviderUnavailable
+from .tracing import span, record_usage
+
+logger = logging.getLogger(__name__)
+
 # NOTE: The Cerebras client (cb) is passed into the run function.
 # The complexity_level is not used here but is accepted for function signature consistency.
 
-# 🎯 FIX: ADD FLOWCHART GENERATION LOGIC
-def run(cb, simplified_text, query, chat_history): 
-    
-    # 1. --- QUIZ GENERATION PROMPT (Task 1) ---
+# "combined": one JSON completion for quiz + flowchart (default); "separate": two free-text calls
+QUIZ_MODE = os.getenv("POLYVOICE_QUIZ_MODE", "combined")
+OPTION_LETTERS = "ABCD"
+MAX_FLOWCHART_NODES = 12
+
+# 1. --- QUIZ GENERATION (Task 1) ---
+def generate_quiz(cb, simplified_text, query):
+    """Creates one multiple-choice comprehension question from the simplified text."""
     quiz_prompt = f"""
     Based ONLY on the following simplified explanation about: {query}, 
     create **one** multiple-choice comprehension question with four options (A, B, C, D) and indicate the answer.
@@ -21,15 +35,21 @@ def run(cb, simplified_text, query, chat_history):
     
     [SIMPLIFIED TEXT]: {simplified_text}
     """
-    quiz_completion = cb.chat.completions.create(
-        model="llama3.1-8b", 
-        messages=[{"role": "user", "content": quiz_prompt}],
-        max_tokens=400,
-        temperature=0.5
-    )
-    quiz_text = quiz_completion.choices[0].message.content
+    with span("quiz"):
+        quiz_completion = guarded_call(
+            "cerebras", cb.chat.completions.create,
+            model="llama3.1-8b", 
+            messages=[{"role": "user", "content": quiz_prompt}],
+            max_tokens=400,
+            temperature=0.5
+        )
+        record_usage(quiz_completion)
+        return quiz_completion.choices[0].message.content
 
-    # 2. --- FLOWCHART GENERATION PROMPT (Task 2: Creative Use of Cerebras) ---
+
+# 2. --- FLOWCHART GENERATION (Task 2: Creative Use of Cerebras) ---
+def generate_flowchart(cb, simplified_text):
+    """Extracts the main sequence of steps as Mermaid flowchart syntax."""
     flowchart_prompt = f"""
     Analyze the following simplified text. Your goal is to extract the main sequence of events, dependencies, or steps.
     
@@ -37,17 +57,294 @@ def run(cb, simplified_text, query, chat_history):
     
     [SIMPLIFIED TEXT]: {simplified_text}
     """
-    flowchart_completion = cb.chat.completions.create(
-        model="llama3.1-8b", 
-        messages=[{"role": "user", "content": flowchart_prompt}],
-        max_tokens=300, # Smaller max_tokens for this structured task
-        temperature=0.0 # Low temperature for precise syntax
+    with span("flowchart"):
+        flowchart_completion = guarded_call(
+            "cerebras", cb.chat.completions.create,
+            model="llama3.1-8b", 
+            messages=[{"role": "user", "content": flowchart_prompt}],
+            max_tokens=300, # Smaller max_tokens for this structured task
+            temperature=0.0 # Low temperature for precise syntax
+        )
+        record_usage(flowchart_completion)
+        return flowchart_completion.choices[0].message.content.strip()
+
+
+# 3. --- STRUCTURED OUTPUT: validation + repair ---
+# quiz:      {"question": str, "options": [4 x str], "answer_index": 0-3}
+# flowchart: {"nodes": [{"id": str, "label": str}], "edges": [{"from": id, "to": id}]}
+def extract_json(text):
+    """The JSON object in a completion, tolerating code fences, chatter around it and trailing commas."""
+    text = re.sub(r"```(?:json)?", "", text or "")
+    start, end = text.find("{"), text.rfind("}")
+    if start < 0 or end <= start:
+        raise ValueError("no JSON object in the response")
+    candidate = text[start:end + 1]
+    try:
+        return json.loads(candidate)
+    except json.JSONDecodeError:
+        return json.loads(re.sub(r",\s*([}\]])", r"\1", candidate))
+
+
+def _strip_option_prefix(option):
+    return re.sub(r"^\s*[A-Da-d][).:-]\s+", "", str(option)).strip()
+
+
+def validate_quiz(data):
+    """Normalized quiz dict, or ValueError. Accepts letter answers and {"A": ...} option maps."""
+    if not isinstance(data, dict):
+        raise ValueError("quiz is not an object")
+    question = str(data.get("question") or "").strip()
+    options = data.get("options")
+    if isinstance(options, dict):
+        options = [options.get(letter) for letter in OPTION_LETTERS]
+    if not question or not isinstance(options, list) or len(options) != 4 or not all(options):
+        raise ValueError("quiz needs a question and exactly four options")
+    options = [_strip_option_prefix(option) for option in options]
+
+    answer = data.get("answer_index", data.get("answer"))
+    if isinstance(answer, str):
+        answer = answer.strip()
+        if answer and answer[0].upper() in OPTION_LETTERS and (len(answer) == 1 or not answer[1].isalnum()):
+            answer = OPTION_LETTERS.index(answer[0].upper())
+        elif answer.isdigit():
+            answer = int(answer)
+        elif answer in options:
+            answer = options.index(answer)
+    if isinstance(answer, bool) or not isinstance(answer, int) or not 0 <= answer < 4:
+        raise ValueError("quiz answer must be an option index 0-3")
+    return {"question": question, "options": options, "answer_index": answer}
+
+
+def validate_flowchart(data):
+    """Normalized flowchart dict, or ValueError. Repairs string nodes, label references and missing edges."""
+    if not isinstance(data, dict):
+        raise ValueError("flowchart is not an object")
+    nodes, by_ref = [], {}
+    for i, node in enumerate(data.get("nodes") or []):
+        if isinstance(node, str):
+            node = {"label": node}
+        if not isinstance(node, dict):
+            continue
+        label = str(node.get("label") or node.get("text") or node.get("id") or "").strip()
+        if not label or len(nodes) >= MAX_FLOWCHART_NODES:
+            continue
+        node_id = re.sub(r"\W", "", str(node.get("id") or "")) or f"N{i + 1}"
+        if node_id in by_ref:
+            node_id = f"N{i + 1}"
+        nodes.append({"id": node_id, "label": label})
+        by_ref[node_id] = by_ref[str(node.get("id", node_id))] = by_ref[label.lower()] = node_id
+    if len(nodes) < 2:
+        raise ValueError("flowchart needs at least two nodes")
+
+    edges, seen = [], set()
+    for edge in data.get("edges") or []:
+        if isinstance(edge, (list, tuple)) and len(edge) >= 2:
+            edge = {"from": edge[0], "to": edge[1]}
+        if not isinstance(edge, dict):
+            continue
+        ends = []
+        for end in (edge.get("from", edge.get("source")), edge.get("to", edge.get("target"))):
+            end = str(end if end is not None else "")
+            ends.append(by_ref.get(end) or by_ref.get(end.lower()))
+        if None in ends or ends[0] == ends[1] or tuple(ends) in seen:
+            continue  # dangling or duplicate edge: drop it rather than fail
+        seen.add(tuple(ends))
+        edges.append({"from": ends[0], "to": ends[1]})
+    if not edges:
+        # Nodes came back in reading order but without links: draw them as a sequence
+        edges = [{"from": a["id"], "to": b["id"]} for a, b in zip(nodes, nodes[1:])]
+    return {"nodes": nodes, "edges": edges}
+
+
+# Legacy free-text formats (separate mode) -> the same structures
+def parse_quiz_text(text):
+    match = re.search(r"QUESTION:\s*(.+?)\s*\n", text or "")
+    options = re.findall(r"^\s*([A-D])[).]\s*(.+?)\s*$", text or "", re.MULTILINE)
+    answer = re.search(r"ANSWER:\s*\**\s*([A-D])", text or "")
+    try:
+        return validate_quiz({
+            "question": match and match.group(1),
+            "options": dict(options),
+            "answer": answer and answer.group(1),
+        })
+    except ValueError:
+        return None
+
+
+_MERMAID_EDGE = re.compile(r"(\w+)(?:\[([^\]]*)\])?\s*-->(?:\|[^|]*\|)?\s*(\w+)(?:\[([^\]]*)\])?")
+
+
+def parse_mermaid(text):
+    nodes, edges = {}, []
+    for source, source_label, target, target_label in _MERMAID_EDGE.findall(text or ""):
+        for node_id, label in ((source, source_label), (target, target_label)):
+            if label or node_id not in nodes:
+                nodes[node_id] = label or nodes.get(node_id) or node_id
+        edges.append({"from": source, "to": target})
+    try:
+        return validate_flowchart({
+            "nodes": [{"id": node_id, "label": label} for node_id, label in nodes.items()],
+            "edges": edges,
+        })
+    except ValueError:
+        return None
+
+
+# Structured -> display formats
+def quiz_to_text(quiz):
+    """The legacy QUESTION/A-D/ANSWER layout (kept in results for older clients)."""
+    if not quiz:
+        return ""
+    lines = [f"QUESTION: {quiz['question']}"]
+    lines += [f"{letter}) {option}" for letter, option in zip(OPTION_LETTERS, quiz["options"])]
+    lines.append(f"ANSWER: {OPTION_LETTERS[quiz['answer_index']]}")
+    return "\n".join(lines)
+
+
+def _mermaid_label(label):
+    return re.sub(r'[\[\]{}()|"<>]', " ", label).strip()
+
+
+def flowchart_to_mermaid(flowchart):
+    if not flowchart:
+        return ""
+    labels = {node["id"]: _mermaid_label(node["label"]) for node in flowchart["nodes"]}
+    parts = ["graph TD"]
+    parts += [f"{e['from']}[{labels[e['from']]}] --> {e['to']}[{labels[e['to']]}]" for e in flowchart["edges"]]
+    return "; ".join(parts)
+
+
+def flowchart_to_dot(flowchart):
+    """Graphviz DOT for st.graphviz_chart."""
+    lines = ["digraph {", "  rankdir=TB;", '  node [shape=box, style="rounded,filled", fillcolor="#1a1a1a", '
+             'fontcolor="white", color="#0078FF", fontname="Helvetica"];', '  edge [color="#0078FF"];',
+             '  bgcolor="transparent";']
+    for node in flowchart["nodes"]:
+        lines.append(f'  "{node["id"]}" [label={json.dumps(node["label"])}];')
+    for edge in flowchart["edges"]:
+        lines.append(f'  "{edge["from"]}" -> "{edge["to"]}";')
+    lines.append("}")
+    return "\n".join(lines)
+
+
+def extras_result(quiz, flowchart):
+    """Result fields for the pipeline: structured data plus the legacy text renderings."""
+    return {
+        "quiz": quiz,
+        "flowchart": flowchart,
+        "quiz_text": quiz_to_text(quiz),
+        "flowchart_text": flowchart_to_mermaid(flowchart),
+    }
+
+
+def extras_from_text(quiz_text, flowchart_text):
+    """Separate mode: parse the free-text answers; unparseable parts keep their raw text."""
+    quiz, flowchart = parse_quiz_text(quiz_text), parse_mermaid(flowchart_text)
+    result = extras_result(quiz, flowchart)
+    result["quiz_text"] = result["quiz_text"] or quiz_text or ""
+    result["flowchart_text"] = result["flowchart_text"] or flowchart_text or ""
+    return result
+
+
+# 4. --- COMBINED GENERATION (one completion for quiz + flowchart) ---
+_SCHEMAS = {
+    "quiz": '"quiz": {"question": "...", "options": ["...", "...", "...", "..."], "answer_index": 0}',
+    "flowchart": ('"flowchart": {"nodes": [{"id": "A", "label": "Step 1"}, {"id": "B", "label": "Step 2"}], '
+                  '"edges": [{"from": "A", "to": "B"}]}'),
+}
+_TASKS = {
+    "quiz": "one multiple-choice comprehension question with exactly four options; "
+            "answer_index is the 0-based index of the correct option",
+    "flowchart": f"the main sequence of events, dependencies or steps as a flowchart of 2-{MAX_FLOWCHART_NODES} "
+                 "nodes with short labels; every edge must reference node ids",
+}
+_VALIDATORS = {"quiz": validate_quiz, "flowchart": validate_flowchart}
+
+
+def _extras_prompt(parts, simplified_text, query):
+    tasks = "\n".join(f"- {part}: {_TASKS[part]}" for part in parts)
+    schema = "{" + ", ".join(_SCHEMAS[part] for part in parts) + "}"
+    return f"""
+    Based ONLY on the following simplified explanation about: {query}, create:
+    {tasks}
+
+    Respond with ONLY a JSON object in exactly this shape (no markdown, no commentary):
+    {schema}
+
+    [SIMPLIFIED TEXT]: {simplified_text}
+    """
+
+
+def _request_parts(cb, parts, simplified_text, query):
+    """One completion for `parts`; returns {part: validated value or None}."""
+    completion = guarded_call(
+        "cerebras", cb.chat.completions.create,
+        model="llama3.1-8b",
+        messages=[{"role": "user", "content": _extras_prompt(parts, simplified_text, query)}],
+        max_tokens=300 + 250 * len(parts),
+        temperature=0.2,
     )
-    flowchart_text = flowchart_completion.choices[0].message.content
+    record_usage(completion)
+    try:
+        data = extract_json(completion.choices[0].message.content)
+    except ValueError:
+        return dict.fromkeys(parts)
+    parsed = {}
+    for part in parts:
+        try:
+            parsed[part] = _VALIDATORS[part](data.get(part))
+        except ValueError:
+            parsed[part] = None
+    return parsed
+
+
+def generate_lesson_extras(cb, simplified_text, query, retries=1):
+    """
+    Quiz + flowchart from a single JSON completion. Each part is validated (and repaired)
+    locally; only a part that is still broken is requested again, on its own.
+    Returns extras_result(...); a part that never validates comes back as None / "".
+    """
+    with span("lesson_extras") as s:
+        parsed = _request_parts(cb, ["quiz", "flowchart"], simplified_text, query)
+        retried = []
+        for _ in range(retries):
+            broken = [part for part, value in parsed.items() if value is None]
+            if not broken:
+                break
+            retried += broken
+            try:
+                parsed.update(_request_parts(cb, broken, simplified_text, query))
+            except Exception as e:
+                # Keep the part that did validate; the broken one stays None
+                logger.warning("Re-requesting %s failed: %s", ", ".join(broken), e)
+                break
+        s.set(retried=retried, quiz_ok=parsed["quiz"] is not None, flowchart_ok=parsed["flowchart"] is not None)
+        return extras_result(parsed["quiz"], parsed["flowchart"])
+
+
+def _optional(fn, *args, default):
+    try:
+        return fn(*args)
+    except ProviderUnavailable:
+        return default
+    except Exception as e:  # e.g. a 5xx that outlasted the retries; the answer itself is done
+        logger.warning("%s failed, skipping it: %s", fn.__name__, e)
+        return default
+
+
+# 🎯 FIX: ADD FLOWCHART GENERATION LOGIC
+def run(cb, simplified_text, query, chat_history): 
+    """
+    Serial entry point. Returns {"quiz", "flowchart"} (structured, or None) plus their
+    text renderings {"quiz_text", "flowchart_text"}.
+    The orchestrator's concurrent mode calls the generators directly.
+    """
+    with span("quiz_agent", mode=QUIZ_MODE):
+        # Like the concurrent path: a failing provider drops that part, not the answer
+        if QUIZ_MODE == "combined":
+            return _optional(generate_lesson_extras, cb, simplified_text, query, default=extras_result(None, None))
+        quiz_text = _optional(generate_quiz, cb, simplified_text, query, default="")
+        flowchart_text = _optional(generate_flowchart, cb, simplified_text, default="")
 
     # 3. --- RETURN BOTH RESULTS ---
-    # The quiz agent now returns a dictionary containing both outputs.
-    return {
-        "quiz_text": quiz_text,
-        "flowchart_text": flowchart_text.strip()
-    }
\ No newline at end of file
+    return extras_from_text(quiz_text, flowchart_text)
@@ -0,0 +1,200 @@
+# In agents/research_cache.py
+
+import os
+import re
+import json
+import time
+import uuid
+import sqlite3
+import hashlib
+import tempfile
+import threading
+from types import SimpleNamespace
+
+# One SQLite file shared by every session and every Streamlit/worker process on the box.
+DEFAULT_DB_PATH = os.getenv(
+    "POLYVOICE_RESEARCH_CACHE", os.path.join(tempfile.gettempdir(), "polyvoice", "research.sqlite3")
+)
+DEFAULT_TTL = float(os.getenv("POLYVOICE_RESEARCH_TTL_S", str(6 * 3600)))
+# How long another process may hold the "I'm fetching this" lease before we fetch ourselves
+LEASE_SECONDS = 20.0
+
+_PUNCTUATION = re.compile(r"[^\w\s'-]+")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_query(query):
+    """Case, punctuation and spacing don't change what Exa returns: 'What is DNA?' == 'what is dna'."""
+    return _WHITESPACE.sub(" ", _PUNCTUATION.sub(" ", query.lower())).strip()
+
+
+def research_key(query, params):
+    payload = json.dumps({"q": normalize_query(query), "params": params}, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class _Flight:
+    """An in-progress fetch that other threads with the same key wait on."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class ResearchCache:
+    """
+    TTL cache for research results in SQLite (WAL mode, safe across processes).
+    Identical concurrent lookups are coalesced: one thread per process fetches (single-flight),
+    and a short lease row keeps other processes from fetching the same key at the same time.
+    """
+
+    def __init__(self, path=None, ttl=None):
+        self.path = path or DEFAULT_DB_PATH
+        self.ttl = DEFAULT_TTL if ttl is None else ttl
+        self._local = threading.local()
+        self._flights = {}
+        self._flights_lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "coalesced": 0, "errors": 0}
+        self._stats_lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with self._conn() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS research ("
+                " key TEXT PRIMARY KEY, query TEXT, results TEXT, created REAL, expires REAL)"
+            )
+            conn.execute("CREATE TABLE IF NOT EXISTS inflight (key TEXT PRIMARY KEY, owner TEXT, expires REAL)")
+
+    def _conn(self):
+        # sqlite3 connections can't be shared between threads; keep one per thread
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10.0)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _count(self, name):
+        with self._stats_lock:
+            self._stats[name] += 1
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 3) if lookups else 0.0
+        return stats
+
+    # --- storage ---
+    def get(self, key):
+        row = self._conn().execute(
+            "SELECT results FROM research WHERE key = ? AND expires > ?", (key, time.time())
+        ).fetchone()
+        if row is None:
+            return None
+        return [SimpleNamespace(**item) for item in json.loads(row[0])]
+
+    def put(self, key, query, results):
+        now = time.time()
+        payload = json.dumps(
+            [{"title": r.title, "url": r.url, "text": r.text} for r in results], ensure_ascii=False
+        )
+        with self._conn() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO research (key, query, results, created, expires) VALUES (?, ?, ?, ?, ?)",
+                (key, normalize_query(query), payload, now, now + self.ttl),
+            )
+
+    def purge_expired(self):
+        with self._conn() as conn:
+            return conn.execute("DELETE FROM research WHERE expires <= ?", (time.time(),)).rowcount
+
+    # --- cross-process lease ---
+    def _acquire_lease(self, key, owner):
+        now = time.time()
+        with self._conn() as conn:
+            conn.execute("DELETE FROM inflight WHERE key = ? AND expires <= ?", (key, now))
+            inserted = conn.execute(
+                "INSERT OR IGNORE INTO inflight (key, owner, expires) VALUES (?, ?, ?)",
+                (key, owner, now + LEASE_SECONDS),
+            ).rowcount
+        return inserted == 1
+
+    def _release_lease(self, key, owner):
+        with self._conn() as conn:
+            conn.execute("DELETE FROM inflight WHERE key = ? AND owner = ?", (key, owner))
+
+    def _wait_for_other_process(self, key):
+        deadline = time.monotonic() + LEASE_SECONDS
+        while time.monotonic() < deadline:
+            time.sleep(0.1)
+            cached = self.get(key)
+            if cached is not None:
+                return cached
+            if self._conn().execute("SELECT 1 FROM inflight WHERE key = ?", (key,)).fetchone() is None:
+                return None  # the other fetch failed or gave up
+        return None
+
+    def _fetch(self, key, query, fetch):
+        owner = uuid.uuid4().hex
+        if not self._acquire_lease(key, owner):
+            cached = self._wait_for_other_process(key)
+            if cached is not None:
+                self._count("coalesced")
+                return cached
+        try:
+            results = fetch()
+            if results:
+                self.put(key, query, results)
+            return results
+        finally:
+            self._release_lease(key, owner)
+
+    # --- public entry point ---
+    def get_or_fetch(self, query, params, fetch):
+        """Returns cached results for (query, params), or calls fetch() once for all concurrent callers."""
+        key = research_key(query, params)
+        cached = self.get(key)
+        if cached is not None:
+            self._count("hits")
+            return cached
+
+        with self._flights_lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+
+        if not leader:
+            self._count("coalesced")
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        self._count("misses")
+        try:
+            flight.result = self._fetch(key, query, fetch)
+            return flight.result
+        except Exception as e:
+            self._count("errors")
+            flight.error = e
+            raise
+        finally:
+            flight.done.set()
+            with self._flights_lock:
+                self._flights.pop(key, None)
+
+
+_default_cache = None
+_default_lock = threading.Lock()
+
+
+def get_default_cache():
+    """Process-wide research cache configured from the environment."""
+    global _default_cache
+    with _default_lock:
+        if _default_cache is None:
+            _default_cache = ResearchCache()
+        return _default_cache
@@ -0,0 +1,256 @@
+# In agents/scheduler.py
+
+"""
+Fair sharing of the provider keys between everyone on a server.
+
+Every provider call goes through guarded_call (agents/clients.py), which takes its slot from
+that provider's FairScheduler instead of a plain semaphore:
+
+- Priorities: interactive calls are granted before batch, batch before prefetch, and background
+  work never holds more than BACKGROUND_SHARE of a provider's slots.
+- Weighted fair queuing: when the slots are taken, waiting calls of the same priority are
+  granted in virtual-finish-time order per tenant (a class via ?tenant=..., otherwise one
+  session), so a tenant that floods the queue mostly delays itself.
+      POLYVOICE_TENANT_WEIGHTS="lab-a=2,demo=0.5"    (default weight 1)
+- Per-user token buckets on provider calls (interactive only; prefetch and batch have their
+  own budgets). An interactive call waits up to MAX_THROTTLE_WAIT_S for a token.
+      POLYVOICE_USER_CALLS_PER_MINUTE=120  POLYVOICE_USER_BURST=60
+- Admission control: a full queue (POLYVOICE_SCHEDULER_QUEUE waiters per provider), an empty
+  bucket or, for prefetch, any wait at all is rejected at once instead of queuing.
+
+Who is calling lives in a context variable (set_request / request_context). The orchestrator's
+stage executor, the TTS streamer and the prefetcher copy it into their threads.
+"""
+
+import os
+import time
+import heapq
+import itertools
+import threading
+import contextlib
+from collections import namedtuple
+from contextvars import ContextVar
+
+PRIORITIES = ("interactive", "batch", "prefetch")
+INTERACTIVE, BATCH, PREFETCH = range(len(PRIORITIES))
+MAX_QUEUE = int(os.getenv("POLYVOICE_SCHEDULER_QUEUE", "64"))
+BACKGROUND_SHARE = 0.75         # of a provider's slots that batch + prefetch may hold at once
+# A spoken answer is ~15 calls (search, 4-5 completions, one TTS call per sentence chunk)
+USER_CALLS_PER_MINUTE = float(os.getenv("POLYVOICE_USER_CALLS_PER_MINUTE", "120"))
+USER_BURST = float(os.getenv("POLYVOICE_USER_BURST", "60"))
+ADMIT_CALLS = 5                 # tokens a user needs left to start an answer (its text part)
+MAX_THROTTLE_WAIT_S = 1.0
+BUSY_RETRY_AFTER_S = 2.0
+MAX_TRACKED = 10_000            # idle users / tenants remembered before pruning
+
+
+def _parse_weights(spec):
+    """'lab-a=2,demo=0.5' -> {"lab-a": 2.0, "demo": 0.5}"""
+    weights = {}
+    for part in (spec or "").split(","):
+        if "=" in part:
+            name, value = part.split("=", 1)
+            weights[name.strip()] = float(value)
+    return weights
+
+
+TENANT_WEIGHTS = _parse_weights(os.getenv("POLYVOICE_TENANT_WEIGHTS"))
+
+
+class Rejected(Exception):
+    """The call was shed instead of queued; the caller may retry after `retry_after` seconds."""
+
+    def __init__(self, reason, retry_after=BUSY_RETRY_AFTER_S):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+# --- REQUEST CONTEXT ---
+Request = namedtuple("Request", "tenant user priority")
+_current = ContextVar("polyvoice_request", default=Request("default", None, "interactive"))
+
+
+def current_request():
+    return _current.get()
+
+
+def set_request(tenant=None, user=None, priority="interactive"):
+    """Tags this context's provider calls; returns the token for ContextVar.reset()."""
+    if priority not in PRIORITIES:
+        raise ValueError(f"unknown priority '{priority}'")
+    return _current.set(Request(tenant or user or "default", user, priority))
+
+
+@contextlib.contextmanager
+def request_context(tenant=None, user=None, priority=None):
+    """set_request() for a block; unspecified fields are inherited from the enclosing request."""
+    outer = _current.get()
+    token = set_request(tenant or outer.tenant, user if user is not None else outer.user,
+                        priority or outer.priority)
+    try:
+        yield _current.get()
+    finally:
+        _current.reset(token)
+
+
+# --- PER-USER TOKEN BUCKETS ---
+class TokenBucket:
+    def __init__(self, per_minute, burst):
+        self.rate = per_minute / 60.0
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, n=1.0):
+        """Takes n tokens and returns 0.0, or returns the seconds until they'd be there (taking none)."""
+        with self._lock:
+            self._refill()
+            if self.tokens >= n:
+                self.tokens -= n
+                return 0.0
+            return (n - self.tokens) / self.rate if self.rate else float("inf")
+
+    def available(self):
+        with self._lock:
+            self._refill()
+            return self.tokens
+
+
+_buckets = {}
+_buckets_lock = threading.Lock()
+
+
+def _bucket(user):
+    with _buckets_lock:
+        bucket = _buckets.get(user)
+        if bucket is None:
+            if len(_buckets) >= MAX_TRACKED:
+                # Full buckets carry no state worth keeping
+                for name in [u for u, b in _buckets.items() if b.available() >= b.burst]:
+                    del _buckets[name]
+            bucket = _buckets[user] = TokenBucket(USER_CALLS_PER_MINUTE, USER_BURST)
+        return bucket
+
+
+def throttle(request):
+    """Charges one provider call to the user; raises Rejected when they're over their rate."""
+    if request.user is None or request.priority != "interactive" or not USER_CALLS_PER_MINUTE:
+        return
+    bucket = _bucket(request.user)
+    wait = bucket.take()
+    if wait and wait <= MAX_THROTTLE_WAIT_S:
+        time.sleep(wait)
+        wait = bucket.take()
+    if wait:
+        raise Rejected("rate limited", retry_after=wait)
+
+
+# --- WEIGHTED FAIR SLOTS ---
+class FairScheduler:
+    """One provider's concurrency slots, granted by priority, then weighted-fair across tenants."""
+
+    def __init__(self, name, capacity, max_queue=MAX_QUEUE):
+        self.name = name
+        self.capacity = capacity
+        self.max_queue = max_queue
+        self.background_slots = max(1, int(capacity * BACKGROUND_SHARE))
+        self._in_use = 0
+        self._background_in_use = 0
+        self._waiters = []          # heap of [rank, finish tag, seq, start tag, event, granted]
+        self._virtual_time = 0.0
+        self._finish = {}           # tenant -> virtual finish tag of its latest call
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self._stats = {"granted": 0, "queued": 0, "shed": 0, "timeouts": 0}
+
+    def _can_grant(self, rank):
+        if self._in_use >= self.capacity:
+            return False
+        return rank == INTERACTIVE or self._background_in_use < self.background_slots
+
+    def _grant(self, rank, start):
+        self._in_use += 1
+        if rank != INTERACTIVE:
+            self._background_in_use += 1
+        self._virtual_time = max(self._virtual_time, start)
+        self._stats["granted"] += 1
+
+    def _tags(self, tenant):
+        """Start-time fair queuing: each call advances its tenant's clock by 1 / weight."""
+        start = max(self._virtual_time, self._finish.get(tenant, 0.0))
+        finish = start + 1.0 / TENANT_WEIGHTS.get(tenant, 1.0)
+        if len(self._finish) >= MAX_TRACKED:
+            self._finish = {t: f for t, f in self._finish.items() if f > self._virtual_time}
+        self._finish[tenant] = finish
+        return start, finish
+
+    def acquire(self, request, timeout):
+        """Blocks for a slot (at most `timeout` s); returns the ticket for release()."""
+        rank = PRIORITIES.index(request.priority)
+        with self._lock:
+            ahead = any(waiter[0] <= rank for waiter in self._waiters)
+            if not ahead and self._can_grant(rank):
+                start, _ = self._tags(request.tenant)
+                self._grant(rank, start)
+                return rank
+            if rank == PREFETCH or len(self._waiters) >= self.max_queue:
+                self._stats["shed"] += 1
+                raise Rejected("busy")
+            start, finish = self._tags(request.tenant)
+            waiter = [rank, finish, next(self._seq), start, threading.Event(), False]
+            heapq.heappush(self._waiters, waiter)
+            self._stats["queued"] += 1
+
+        if waiter[4].wait(timeout):
+            return rank
+        with self._lock:
+            if waiter[5]:
+                return rank  # granted just as the wait timed out
+            self._waiters.remove(waiter)
+            heapq.heapify(self._waiters)
+            self._stats["timeouts"] += 1
+        raise Rejected("too many concurrent requests")
+
+    def release(self, rank):
+        with self._lock:
+            self._in_use -= 1
+            if rank != INTERACTIVE:
+                self._background_in_use -= 1
+            # The heap head is the most urgent waiter; if it can't run, nothing behind it can
+            while self._waiters and self._can_grant(self._waiters[0][0]):
+                waiter = heapq.heappop(self._waiters)
+                self._grant(waiter[0], waiter[3])
+                waiter[5] = True
+                waiter[4].set()
+
+    def check_admission(self, request):
+        """Raises Rejected if a call from `request` would be shed right now."""
+        rank = PRIORITIES.index(request.priority)
+        with self._lock:
+            if len(self._waiters) >= self.max_queue and not self._can_grant(rank):
+                raise Rejected("busy")
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, in_use=self._in_use, waiting=len(self._waiters), capacity=self.capacity)
+
+
+def admit(fair_scheduler, request=None):
+    """
+    Fast check before starting a pipeline run: raises Rejected when the user is out of calls
+    or the provider's queue is full, so the UI can say "busy" instead of stalling.
+    """
+    request = request or current_request()
+    if request.user is not None and request.priority == "interactive" and USER_CALLS_PER_MINUTE:
+        bucket = _bucket(request.user)
+        available = bucket.available()
+        if available < ADMIT_CALLS:
+            raise Rejected("rate limited", retry_after=(ADMIT_CALLS - available) / bucket.rate)
+    fair_scheduler.check_admission(request)
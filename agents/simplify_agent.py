@@ -1,5 +1,13 @@
 import os
-from cerebras.cloud.sdk import Cerebras
+import re
+import time
+import logging
+
+from .memory import history_messages
+from .clients import guarded_call, guarded_stream
+from .tracing import span, record_usage
+
+logger = logging.getLogger(__name__)
 
 # NOTE: The Cerebras client (cb) is passed into the run function from orchestrator.py
 
@@ -26,7 +34,94 @@ def build_simplification_instruction(complexity_level):
     
     return "Provide a detailed, comprehensive explanation."
 
+# --- LOCAL OVERRIDE CLASSIFIER ---
+# Same keyword families as the LLM prompt below. "Strong" cues are unambiguous requests for a
+# level change; "weak" cues are words that also show up inside topics ("simple machines",
+# "advanced placement", "what do kids eat", "technical analysis"), so on their own they defer
+# to the LLM classifier. Kid/child/technical only count as strong in request phrasings.
+_OVERRIDE_CUES = {
+    "elementary-dyslexia": {
+        "strong": re.compile(
+            r"\b(dyslexi[ac]|easier|simpler|eli5|like (?:i'?m|i am) (?:five|5|a (?:kid|child))"
+            r"|for (?:a |my )?(?:kids?|child(?:ren)?)|(?:to|at the level of) (?:a |my )?(?:kid|child)"
+            r"|(?:kid|child)[- ]friendly|in simple (?:terms|words)|simply put|dumb it down)\b", re.IGNORECASE),
+        "weak": re.compile(r"\b(simple|easy|basic|kids?|child(?:ren)?)\b", re.IGNORECASE),
+    },
+    "plain-language-clarity": {
+        "strong": re.compile(
+            r"\b(experts?|in[- ]depth|more advanced|more detail(?:ed)?"
+            r"|(?:more )?technical (?:answer|explanation|version|details?|terms|level))\b", re.IGNORECASE),
+        "weak": re.compile(r"\b(standard|advanced|profound|technical(?:ly)?)\b", re.IGNORECASE),
+    },
+}
+_NEGATION = re.compile(r"\b(not|no|don'?t|never|less|without)\W+(?:\w+\W+){0,2}$", re.IGNORECASE)
+
+
+def _cue_hits(pattern, query):
+    """Returns (plain_hits, negated_hits) for a cue pattern."""
+    plain, negated = 0, 0
+    for match in pattern.finditer(query):
+        if _NEGATION.search(query[:match.start()]):
+            negated += 1
+        else:
+            plain += 1
+    return plain, negated
+
+
+def classify_override_local(query):
+    """
+    Compiled-regex override detector; no network call.
+    Returns: (level or None, ambiguous). `ambiguous` means the keywords don't settle it
+    (weak cue only, negation, or cues for both levels) and a smarter check should decide.
+    """
+    strong_levels, weak_levels, negated = [], [], False
+    for level, cues in _OVERRIDE_CUES.items():
+        strong, strong_negated = _cue_hits(cues["strong"], query)
+        weak, weak_negated = _cue_hits(cues["weak"], query)
+        negated = negated or bool(strong_negated or weak_negated)
+        if strong:
+            strong_levels.append(level)
+        elif weak:
+            weak_levels.append(level)
+
+    if len(strong_levels) == 1 and not weak_levels and not negated:
+        return strong_levels[0], False
+    if not strong_levels and not weak_levels and not negated:
+        return None, False
+    # Conflicting, negated or weak-only cues: best guess plus an ambiguity flag
+    candidates = strong_levels or weak_levels
+    return (candidates[0] if len(candidates) == 1 and not negated else None), True
+
+
+def detect_override(cb, query, llm_fallback=True):
+    """
+    Local classifier first; the LLM only sees queries the local pass calls ambiguous.
+    Returns: (level or None, source) where source is "local", "llm" or "local-fallback"
+    (ambiguous, but the LLM was disabled or failed, so the local best guess is used).
+    """
+    with span("override") as s:
+        level, ambiguous = classify_override_local(query)
+        source = "local"
+        if ambiguous:
+            source = "local-fallback"
+            if llm_fallback and cb is not None:
+                try:
+                    level, source = check_for_override_llm(cb, query, raise_errors=True), "llm"
+                except Exception as e:
+                    logger.warning("Override classifier LLM call failed, using local result: %s", e)
+        s.set(source=source, level=level)
+        return level, source
+
+
 def check_for_override(cb, query):
+    """
+    Returns: The new complexity level string, or None if no override is detected.
+    Decided locally unless the query is ambiguous (see detect_override).
+    """
+    return detect_override(cb, query)[0]
+
+
+def check_for_override_llm(cb, query, raise_errors=False):
     """
     Uses a fast, low-token LLM call to classify if the user is asking for a specific level change.
     Returns: The new complexity level string, or None if no override is detected.
@@ -44,12 +139,14 @@ def check_for_override(cb, query):
     """
     
     try:
-        chat_completion = cb.chat.completions.create(
+        chat_completion = guarded_call(
+            "cerebras", cb.chat.completions.create,
             model="llama3.1-8b", # Use a fast model for classification
             messages=[{"role": "user", "content": classification_prompt}],
             max_tokens=20, # Keep this extremely small for speed
             temperature=0.0
         )
+        record_usage(chat_completion)
         result = chat_completion.choices[0].message.content.strip().lower()
         
         if result in ["elementary-dyslexia", "plain-language-clarity"]:
@@ -58,17 +155,14 @@ def check_for_override(cb, query):
         
     except Exception as e:
         # Fallback if the classification API fails
+        if raise_errors:
+            raise
+        logger.warning("Override classifier LLM call failed: %s", e)
         return None
 
 
-# 🎯 RUN FUNCTION WITH OVERRIDE LOGIC
-def run(cb, context, query, complexity_level, chat_history): 
-    
-    # 1. Check for verbal override
-    new_level = check_for_override(cb, query)
-    if new_level:
-        complexity_level = new_level # Temporarily switch the level
-    
+def build_messages(context, query, complexity_level, chat_history):
+    """Builds the simplifier's system prompt and message list (memory)."""
     # 2. Build instructions based on the (potentially overridden) level
     instruction = build_simplification_instruction(complexity_level)
     
@@ -85,9 +179,8 @@ def run(cb, context, query, complexity_level, chat_history):
     messages = []
     messages.append({"role": "system", "content": system_prompt})
 
-    for msg in chat_history[-6:]: 
-        if msg["role"] == "user":
-            messages.append({"role": "user", "content": msg["content"]})
+    # Memory: bounded summary + recent turns (ConversationMemory) or the legacy list
+    messages.extend(history_messages(chat_history))
         
     final_user_content = f"""
     Based on the conversation history and the following context, please provide the next response:
@@ -98,12 +191,72 @@ def run(cb, context, query, complexity_level, chat_history):
     Provide ONLY the simplified explanation text. Do NOT include any introductory or concluding phrases.
     """
     messages.append({"role": "user", "content": final_user_content})
+    return messages
+
+
+# 🎯 RUN FUNCTION WITH OVERRIDE LOGIC
+def run(cb, context, query, complexity_level, chat_history, check_override=True): 
+    """
+    Simplifier Agent. Pass check_override=False when the caller has already
+    resolved the override (the orchestrator's concurrent mode does this in parallel with research).
+    """
+    
+    # 1. Check for verbal override
+    if check_override:
+        new_level = check_for_override(cb, query)
+        if new_level:
+            complexity_level = new_level # Temporarily switch the level
+    
+    messages = build_messages(context, query, complexity_level, chat_history)
     
     # 4. Execute the main LLM call
-    chat_completion = cb.chat.completions.create(
-        model="llama3.1-8b", 
-        messages=messages, 
-        max_tokens=800,
-        temperature=0.2
-    )
-    return chat_completion.choices[0].message.content
\ No newline at end of file
+    with span("simplify", level=complexity_level, stream=False) as s:
+        chat_completion = guarded_call(
+            "cerebras", cb.chat.completions.create,
+            model="llama3.1-8b", 
+            messages=messages, 
+            max_tokens=800,
+            temperature=0.2
+        )
+        record_usage(chat_completion)
+        text = chat_completion.choices[0].message.content
+        s.set(chars=len(text))
+        return text
+
+
+# 🌊 STREAMING VARIANT (same prompt, tokens yielded as they arrive)
+def run_stream(cb, context, query, complexity_level, chat_history, check_override=True):
+    """
+    Generator version of run(): yields text deltas from the streaming completion API
+    so the UI and TTS can start before the full answer exists.
+    """
+    if check_override:
+        new_level = check_for_override(cb, query)
+        if new_level:
+            complexity_level = new_level
+
+    messages = build_messages(context, query, complexity_level, chat_history)
+
+    with span("simplify", level=complexity_level, stream=True) as s:
+        # The slot stays taken while tokens arrive, and is freed even if the reader stops early
+        with guarded_stream(
+            "cerebras", cb.chat.completions.create,
+            model="llama3.1-8b", 
+            messages=messages, 
+            max_tokens=800,
+            temperature=0.2,
+            stream=True
+        ) as stream:
+            started, chars = time.perf_counter(), 0
+            for chunk in stream:
+                if getattr(chunk, "usage", None) is not None:
+                    record_usage(chunk)  # the final chunk carries the token counts
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    if not chars:
+                        s.set(first_token_ms=round((time.perf_counter() - started) * 1000, 1))
+                    chars += len(delta)
+                    yield delta
+        s.set(chars=chars)
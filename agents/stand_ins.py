@@ -0,0 +1,194 @@
+# In agents/stand_ins.py
+
+"""
+Local stand-ins for the Cerebras, Exa, ElevenLabs and Whisper clients.
+They answer with deterministic canned content (optionally after an injected delay), so the
+whole pipeline -- caches included -- runs offline: POLYVOICE_OFFLINE=1 streamlit run app.py
+Delays come from POLYVOICE_OFFLINE_LATENCY; benchmarks/pipeline_benchmark.py drives them.
+"""
+
+import os
+import re
+import json
+import time
+import hashlib
+import threading
+from types import SimpleNamespace
+
+_REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# A real MP3 from the repo, so the audio player has something playable
+DEFAULT_AUDIO_FIXTURE = os.path.join(_REPO_ROOT, "output.mp3")
+
+
+def _topic(prompt):
+    match = re.search(r"USER'S NEW QUERY:\s*(.+)", prompt) or re.search(r"about:\s*(.+?),", prompt)
+    return match.group(1).strip() if match else "this topic"
+
+
+class _Counter:
+    def __init__(self):
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def _tick(self):
+        with self._lock:
+            self.calls += 1
+
+
+class StandInCompletions(_Counter):
+    """Mimics cb.chat.completions.create, including stream=True and usage counts."""
+
+    def __init__(self, latency=0.0, token_latency=0.0):
+        super().__init__()
+        self.latency = latency
+        self.token_latency = token_latency
+
+    def _answer(self, prompt):
+        if "Analyze the user's request" in prompt:
+            return "NONE"
+        if "Respond with ONLY a JSON object" in prompt:
+            parts = {}
+            if '"quiz":' in prompt:
+                parts["quiz"] = {
+                    "question": "What is the key idea of this lesson?",
+                    "options": ["The main concept", "An unrelated fact", "A historical date", "None of these"],
+                    "answer_index": 0,
+                }
+            if '"flowchart":' in prompt:
+                parts["flowchart"] = {
+                    "nodes": [{"id": "A", "label": "Question"}, {"id": "B", "label": "Key idea"},
+                              {"id": "C", "label": "Example"}, {"id": "D", "label": "Summary"}],
+                    "edges": [{"from": "A", "to": "B"}, {"from": "B", "to": "C"}, {"from": "C", "to": "D"}],
+                }
+            return json.dumps(parts)
+        if "Mermaid" in prompt:
+            return "graph TD; A[Question] --> B[Key idea]; B --> C[Example]; C --> D[Summary]"
+        if "multiple-choice" in prompt:
+            return (
+                "QUESTION: What is the key idea of this lesson?\n"
+                "A) The main concept\nB) An unrelated fact\nC) A historical date\nD) None of these\n"
+                "ANSWER: A"
+            )
+        topic = _topic(prompt)
+        return (
+            f"{topic} is easier to understand in small steps. "
+            f"First, we look at what {topic} means. Then we see why it matters.\n\n"
+            f"Here is the key idea: {topic} connects causes to effects. "
+            "Remember the main idea and one example."
+        )
+
+    def create(self, model, messages, max_tokens=None, temperature=None, stream=False, **kwargs):
+        self._tick()
+        time.sleep(self.latency)
+        prompt = messages[-1]["content"]
+        text = self._answer(prompt)
+        usage = SimpleNamespace(
+            prompt_tokens=sum(len(m["content"]) for m in messages) // 4,
+            completion_tokens=len(text) // 4,
+        )
+        if stream:
+            return self._stream(text, usage)
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=text))], usage=usage
+        )
+
+    def _stream(self, text, usage):
+        for word in re.findall(r"\S+\s*", text):
+            time.sleep(self.token_latency)
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=word))], usage=None)
+        # Like the real API, token counts arrive on a final chunk without choices
+        yield SimpleNamespace(choices=[], usage=usage)
+
+
+class StandInCerebras:
+    def __init__(self, latency=0.0, token_latency=0.0):
+        self.chat = SimpleNamespace(completions=StandInCompletions(latency, token_latency))
+
+
+class StandInExa(_Counter):
+    """Mimics exa.search_and_contents with five synthetic sources."""
+
+    def __init__(self, latency=0.0):
+        super().__init__()
+        self.latency = latency
+
+    def search_and_contents(self, query, type="auto", num_results=5, text=None, **kwargs):
+        self._tick()
+        time.sleep(self.latency)
+        max_chars = (text or {}).get("max_characters", 2000)
+        slug = hashlib.sha1(query.encode("utf-8")).hexdigest()[:8]
+        results = [
+            SimpleNamespace(
+                title=f"{query} - source {i}",
+                url=f"https://example.org/{slug}/{i}",
+                text=(f"Source {i} explains {query}. " * 80)[:max_chars],
+            )
+            for i in range(1, num_results + 1)
+        ]
+        return SimpleNamespace(results=results)
+
+
+class _StandInTextToSpeech(_Counter):
+    def __init__(self, latency, audio_path):
+        super().__init__()
+        self.latency = latency
+        self.audio_path = audio_path
+        self._audio = None
+
+    def convert(self, voice_id, text, **kwargs):
+        self._tick()
+        time.sleep(self.latency)
+        if self._audio is None:
+            with open(self.audio_path, "rb") as f:
+                self._audio = f.read()
+        for start in range(0, len(self._audio), 64 * 1024):
+            yield self._audio[start:start + 64 * 1024]
+
+
+class StandInElevenLabs:
+    """Mimics eleven_client.text_to_speech.convert; always streams the same fixture MP3."""
+
+    def __init__(self, latency=0.0, audio_path=DEFAULT_AUDIO_FIXTURE):
+        self.text_to_speech = _StandInTextToSpeech(latency, audio_path)
+
+
+class StandInWhisper(_Counter):
+    """Mimics a Whisper model's transcribe(); cost scales with the audio length."""
+
+    def __init__(self, latency=0.0, realtime_factor=0.0):
+        super().__init__()
+        self.latency = latency
+        self.realtime_factor = realtime_factor
+
+    def transcribe(self, audio, **kwargs):
+        self._tick()
+        seconds = len(audio) / 16000
+        time.sleep(self.latency + seconds * self.realtime_factor)
+        return {"text": f"stand-in transcript of {seconds:.1f} seconds of speech"}
+
+
+def offline_mode():
+    return os.getenv("POLYVOICE_OFFLINE", "").lower() in ("1", "true", "yes")
+
+
+def offline_latency():
+    """
+    Injected delays (seconds) from POLYVOICE_OFFLINE_LATENCY, e.g.
+    "cerebras=0.3,token=0.01,exa=0.8,tts=0.5,whisper=0.2". Unlisted providers answer instantly.
+    """
+    latency = {}
+    for item in os.getenv("POLYVOICE_OFFLINE_LATENCY", "").split(","):
+        name, _, value = item.partition("=")
+        if value:
+            latency[name.strip()] = float(value)
+    return latency
+
+
+def stand_in_clients():
+    """(cb, exa, eleven_client) stand-ins with the configured injected latency."""
+    latency = offline_latency()
+    return (
+        StandInCerebras(latency.get("cerebras", 0.0), latency.get("token", 0.0)),
+        StandInExa(latency.get("exa", 0.0)),
+        StandInElevenLabs(latency.get("tts", 0.0)),
+    )
@@ -1,47 +1,261 @@
 # In agents/stt_agent.py
 
-import io
-import wave
+import os
+import queue
+import threading
+import time
+
 import streamlit as st
 import numpy as np
-import whisper
+
+from .tracing import span
+
+# Whisper works on 16 kHz mono float32
+SAMPLE_RATE = 16000
+VAD_FRAME = SAMPLE_RATE * 30 // 1000  # 30 ms analysis frames
+PREROLL_SAMPLES = SAMPLE_RATE * 200 // 1000
+
+
+# Set to use the shared transcription worker (agents/whisper_server.py) instead of an in-process model
+WHISPER_ADDRESS = os.getenv("POLYVOICE_WHISPER_ADDRESS")
+WHISPER_MODEL = os.getenv("POLYVOICE_WHISPER_MODEL", "base")
+
 
 # Load the base Whisper model once and cache it for performance
 @st.cache_resource
 def load_whisper_model(model_name="base"):
     # Using a smaller model like 'base.en' or 'tiny.en' is better for speed in a hackathon
+    import whisper  # imported here: pulls in torch, only needed when a model is actually loaded
     return whisper.load_model(model_name)
 
+
+@st.cache_resource
+def _remote_whisper_model():
+    from .whisper_server import RemoteWhisperModel
+    return RemoteWhisperModel(WHISPER_ADDRESS)
+
+
+def load_transcription_model():
+    """The shared Whisper worker when POLYVOICE_WHISPER_ADDRESS is set, else the in-process model."""
+    from .stand_ins import offline_mode, offline_latency, StandInWhisper
+
+    if offline_mode():
+        return StandInWhisper(offline_latency().get("whisper", 0.0))
+    if WHISPER_ADDRESS:
+        return _remote_whisper_model()
+    return load_whisper_model(WHISPER_MODEL)
+
+
+def frame_to_float32(audio_data):
+    """WebRTC audio frame (s16/flt, planar or packed, any rate) -> 16 kHz mono float32."""
+    samples = audio_data.to_ndarray()
+    channels = len(audio_data.layout.channels)
+    if audio_data.format.is_planar:
+        mono = samples.reshape(channels, -1).mean(axis=0)
+    else:
+        mono = samples.reshape(-1, channels).mean(axis=1)
+    if np.issubdtype(samples.dtype, np.integer):
+        mono = mono / 32768.0
+    mono = mono.astype(np.float32)
+    if audio_data.sample_rate != SAMPLE_RATE:
+        n_out = int(round(len(mono) * SAMPLE_RATE / audio_data.sample_rate))
+        positions = np.linspace(0, len(mono) - 1, n_out) if n_out > 1 else np.zeros(n_out)
+        mono = np.interp(positions, np.arange(len(mono)), mono).astype(np.float32)
+    return mono
+
+
+class RingBuffer:
+    """Fixed-size float32 buffer for the current utterance; the oldest audio is overwritten."""
+
+    def __init__(self, seconds):
+        self.data = np.zeros(int(seconds * SAMPLE_RATE), dtype=np.float32)
+        self.start = 0  # absolute sample index of data[0]'s logical start
+        self.end = 0    # absolute sample index one past the newest sample
+
+    def write(self, samples):
+        capacity = len(self.data)
+        if len(samples) >= capacity:
+            samples = samples[-capacity:]
+        pos = self.end % capacity
+        first = min(len(samples), capacity - pos)
+        self.data[pos:pos + first] = samples[:first]
+        self.data[:len(samples) - first] = samples[first:]
+        self.end += len(samples)
+        self.start = max(self.start, self.end - capacity)
+
+    def read(self, start=None):
+        """Copy of the samples from absolute index `start` (default: oldest) to the newest."""
+        start = self.start if start is None else max(start, self.start)
+        capacity = len(self.data)
+        idx = np.arange(start, self.end) % capacity
+        return self.data[idx]
+
+
+class StreamingTranscriber:
+    """
+    Incremental Whisper transcription for one microphone stream.
+
+    The WebRTC callback only appends PCM to a ring buffer and runs a cheap energy VAD,
+    so audio ingestion never waits on inference. A single worker thread transcribes
+    (numpy arrays straight into Whisper, no WAV round-trip) and publishes events on a
+    thread-safe queue: {"kind": "partial" | "final", "text": ...}.
+    """
+
+    def __init__(self, model_loader=None, silence_ms=500, min_speech_ms=250, max_segment_s=20.0,
+                 partial_interval_s=1.0, energy_ratio=3.0, min_rms=0.008):
+        self.model_loader = model_loader or load_transcription_model
+        self.silence_frames = silence_ms * SAMPLE_RATE // 1000 // VAD_FRAME
+        self.min_speech_samples = min_speech_ms * SAMPLE_RATE // 1000
+        self.max_segment_samples = int(max_segment_s * SAMPLE_RATE)
+        self.partial_interval_s = partial_interval_s
+        self.energy_ratio = energy_ratio
+        self.min_rms = min_rms
+
+        self.buffer = RingBuffer(max_segment_s + 1.0)
+        self.events = queue.Queue()
+        self._lock = threading.Lock()
+        self._pending = bytearray()       # samples not yet analysed by the VAD (float32 bytes)
+        self._noise_floor = min_rms
+        self._in_speech = False
+        self._speech_start = 0
+        self._silent_frames = 0
+        self._last_partial = 0.0
+        self._context = ""                # last final transcript, used as Whisper's prompt
+
+        self._jobs = queue.Queue()
+        self._partial_job = None          # only the newest partial is worth transcribing
+        self._partial_lock = threading.Lock()
+        self._worker = threading.Thread(target=self._run, name="polyvoice-stt", daemon=True)
+        self._worker.start()
+
+    # --- ingestion (WebRTC thread) ---
+    def feed_samples(self, samples):
+        with self._lock:
+            self._pending.extend(samples.astype(np.float32).tobytes())
+            frame_bytes = VAD_FRAME * 4
+            while len(self._pending) >= frame_bytes:
+                frame = np.frombuffer(bytes(self._pending[:frame_bytes]), dtype=np.float32)
+                del self._pending[:frame_bytes]
+                self._vad_step(frame)
+
+    def feed(self, audio_data):
+        self.feed_samples(frame_to_float32(audio_data))
+
+    def _vad_step(self, frame):
+        rms = float(np.sqrt(np.mean(frame * frame)))
+        speech = rms > max(self.min_rms, self._noise_floor * self.energy_ratio)
+        if not speech:
+            # Track background noise slowly so a noisy room doesn't look like speech
+            self._noise_floor = 0.95 * self._noise_floor + 0.05 * max(rms, 1e-4)
+
+        self.buffer.write(frame)
+        if not self._in_speech:
+            if speech:
+                self._in_speech = True
+                self._silent_frames = 0
+                # Keep a little audio from before the onset so the first syllable isn't clipped
+                self._speech_start = max(self.buffer.start, self.buffer.end - len(frame) - PREROLL_SAMPLES)
+            return
+
+        self._silent_frames = 0 if speech else self._silent_frames + 1
+        length = self.buffer.end - self._speech_start
+        if self._silent_frames >= self.silence_frames or length >= self.max_segment_samples:
+            self._in_speech = False
+            if length >= self.min_speech_samples:
+                self._jobs.put(("final", self.buffer.read(self._speech_start)))
+        elif time.monotonic() - self._last_partial >= self.partial_interval_s and length >= self.min_speech_samples:
+            self._last_partial = time.monotonic()
+            with self._partial_lock:
+                first = self._partial_job is None
+                self._partial_job = self.buffer.read(self._speech_start)
+            if first:
+                self._jobs.put(("partial", None))
+
+    # --- inference (worker thread) ---
+    def _transcribe(self, model, audio, kind="final"):
+        with span("stt.transcribe", kind=kind, audio_s=round(len(audio) / SAMPLE_RATE, 2)):
+            result = model.transcribe(
+                audio,
+                fp16=False,
+                language="en",
+                initial_prompt=self._context or None,  # carries context across utterances
+                condition_on_previous_text=False,
+            )
+            return result["text"].strip()
+
+    def _run(self):
+        model = None
+        while True:
+            kind, audio = self._jobs.get()
+            if kind == "stop":
+                return
+            if kind == "partial":
+                with self._partial_lock:
+                    audio, self._partial_job = self._partial_job, None
+                if audio is None:
+                    continue
+            try:
+                model = model or self.model_loader()
+                text = self._transcribe(model, audio, kind)
+            except Exception as e:
+                self.events.put({"kind": "error", "text": f"Transcription Error: {e}"})
+                continue
+            if kind == "final":
+                if text:
+                    self._context = text[-200:]
+                    self.events.put({"kind": "final", "text": text})
+            elif text:
+                self.events.put({"kind": "partial", "text": text})
+
+    # --- consumer side (Streamlit script thread) ---
+    def poll(self):
+        """Non-blocking: every event published since the last call."""
+        events = []
+        while True:
+            try:
+                events.append(self.events.get_nowait())
+            except queue.Empty:
+                return events
+
+    def close(self):
+        self._jobs.put(("stop", None))
+
+
+def make_audio_callback(transcriber):
+    """audio_frame_callback for streamlit-webrtc: feeds the transcriber and passes the frame through."""
+    def callback(audio_data):
+        with span("stt.callback", record=False):  # ~50 frames/s: metrics only, no trace lines
+            transcriber.feed(audio_data)
+        return audio_data
+    return callback
+
+
+def get_session_transcriber():
+    """One StreamingTranscriber per browser session (call from the script thread)."""
+    if "stt_transcriber" not in st.session_state:
+        st.session_state["stt_transcriber"] = StreamingTranscriber()
+    return st.session_state["stt_transcriber"]
+
+
+_default_transcriber = None
+_default_lock = threading.Lock()
+
+
 def process_audio_callback(audio_data):
     """
     Callback function that receives audio data chunks and processes them.
     This function is run in a background thread by streamlit-webrtc.
+    Feeds a process-wide StreamingTranscriber; prefer make_audio_callback(get_session_transcriber())
+    so each session gets its own stream. Read results with default_transcriber().poll().
     """
-    # 1. Load the model
-    model = load_whisper_model("base") 
-    
-    # 2. Get the raw audio array (Mono, 16000Hz expected by Whisper)
-    audio_buffer = audio_data.to_ndarray(format="s16", channels=1)
-    
-    # 3. Save the audio to a temporary in-memory WAV file (easier for Whisper)
-    # Note: Using an in-memory stream is better than writing to disk in Docker
-    wav_io = io.BytesIO()
-    with wave.open(wav_io, 'wb') as wf:
-        wf.setnchannels(1)
-        wf.setsampwidth(2) # 16-bit audio
-        wf.setframerate(audio_data.sample_rate)
-        wf.writeframes(audio_buffer.tobytes())
-    wav_io.seek(0)
-    
-    # 4. Whisper Transcription
-    try:
-        # Whisper requires a file path or file-like object
-        result = model.transcribe(wav_io)
-        transcribed_text = result["text"]
-    except Exception as e:
-        # Fallback if transcription fails
-        transcribed_text = f"Transcription Error: {e}" 
-
-    # 5. Update the Streamlit state for the main thread to read
-    st.session_state.stt_result = transcribed_text
-    st.session_state.transcription_completed = True
\ No newline at end of file
+    with span("stt.callback", record=False):
+        default_transcriber().feed(audio_data)
+    return audio_data
+
+
+def default_transcriber():
+    global _default_transcriber
+    with _default_lock:
+        if _default_transcriber is None:
+            _default_transcriber = StreamingTranscriber()
+        return _default_transcriber
@@ -0,0 +1,269 @@
+# In agents/tracing.py
+
+"""
+Lightweight per-stage tracing and metrics.
+
+    with span("simplify", level=level) as s:
+        ...
+        s.set(prompt_tokens=120, completion_tokens=310)
+
+Every finished span feeds in-process Prometheus metrics (duration histogram, error,
+token, audio-byte and cache counters keyed by span name) and, when POLYVOICE_TRACE_FILE
+is set, one JSON line with its trace/parent ids and attributes.
+
+    POLYVOICE_TRACE_FILE=traces.jsonl    append spans as JSON lines
+    POLYVOICE_METRICS_PORT=9464          serve GET /metrics (Prometheus text format)
+    POLYVOICE_TRACING=1                  metrics only (e.g. scraped via the API's /metrics)
+
+With none of these set, span() hands back a shared no-op object: one global check per call.
+"""
+
+import os
+import json
+import time
+import uuid
+import logging
+import threading
+import contextvars
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+logger = logging.getLogger(__name__)
+
+TRACE_FILE = os.getenv("POLYVOICE_TRACE_FILE")
+METRICS_PORT = os.getenv("POLYVOICE_METRICS_PORT")
+ENABLED = bool(TRACE_FILE or METRICS_PORT or os.getenv("POLYVOICE_TRACING", "").lower() in ("1", "true", "yes"))
+
+# Seconds; stages range from a ~1 ms cache hit to a 30 s slow completion
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# Numeric span attributes that become counters: attribute -> (metric, label value or None)
+_COUNTED = {
+    "prompt_tokens": ("polyvoice_tokens_total", "prompt"),
+    "completion_tokens": ("polyvoice_tokens_total", "completion"),
+    "audio_bytes": ("polyvoice_audio_bytes_total", None),
+}
+
+_current = contextvars.ContextVar("polyvoice_span", default=None)
+
+
+class _NoopSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **attrs):
+        pass
+
+
+_NOOP = _NoopSpan()
+
+
+class Span:
+    __slots__ = ("name", "attrs", "record", "trace_id", "span_id", "parent_id", "start", "_t0", "_token")
+
+    def __init__(self, name, attrs, record=True):
+        self.name = name
+        self.attrs = attrs
+        self.record = record  # False: metrics only, no trace line (per-frame callbacks)
+        self._token = None
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def __enter__(self):
+        parent = _current.get()
+        self.trace_id = parent.trace_id if parent else uuid.uuid4().hex
+        self.parent_id = parent.span_id if parent else None
+        self.span_id = uuid.uuid4().hex[:16]
+        self.start = time.time()
+        self._t0 = time.perf_counter()
+        self._token = _current.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration = time.perf_counter() - self._t0
+        try:
+            _current.reset(self._token)
+        except ValueError:
+            # A generator span resumed from another context (e.g. an SSE worker thread)
+            _current.set(None)
+        _registry.observe(self, duration, exc)
+        if self.record and _trace_writer:
+            _trace_writer.write(self, duration, exc)
+        return False
+
+
+def span(name, record=True, **attrs):
+    """Times a block as a child of the current span. A no-op when tracing is disabled."""
+    if not ENABLED:
+        return _NOOP
+    _ensure_exporters()
+    return Span(name, attrs, record)
+
+
+def annotate(**attrs):
+    """Adds attributes to the innermost open span (e.g. cache="miss" from deep inside a stage)."""
+    if not ENABLED:
+        return
+    current = _current.get()
+    if current is not None:
+        current.attrs.update(attrs)
+
+
+def record_usage(completion):
+    """Copies prompt/completion token counts from a chat completion (or final stream chunk)."""
+    if not ENABLED:
+        return
+    usage = getattr(completion, "usage", None)
+    if usage is not None:
+        annotate(prompt_tokens=getattr(usage, "prompt_tokens", 0) or 0,
+                 completion_tokens=getattr(usage, "completion_tokens", 0) or 0)
+
+
+# --- METRICS ---
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", " ")
+
+
+class MetricsRegistry:
+    """Histogram + counters keyed by span name, rendered in the Prometheus text format."""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._histograms = {}  # span -> [bucket counts..., +Inf count, sum]
+        self._counters = {}    # (metric, labels tuple) -> value
+
+    def _inc(self, metric, labels, amount=1):
+        key = (metric, labels)
+        self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, span, duration, exc=None):
+        with self._lock:
+            hist = self._histograms.get(span.name)
+            if hist is None:
+                hist = self._histograms[span.name] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if duration <= bound:
+                    hist[i] += 1
+            hist[-2] += 1
+            hist[-1] += duration
+            if exc is not None:
+                self._inc("polyvoice_span_errors_total", (("span", span.name), ("error", type(exc).__name__)))
+            for attr, (metric, kind) in _COUNTED.items():
+                value = span.attrs.get(attr)
+                if value:
+                    labels = (("span", span.name),) + ((("kind", kind),) if kind else ())
+                    self._inc(metric, labels, value)
+            if "cache" in span.attrs:
+                self._inc("polyvoice_cache_events_total", (("span", span.name), ("result", span.attrs["cache"])))
+
+    def render(self):
+        lines = [
+            "# HELP polyvoice_span_seconds Duration of traced pipeline stages.",
+            "# TYPE polyvoice_span_seconds histogram",
+        ]
+        with self._lock:
+            histograms = {name: list(values) for name, values in self._histograms.items()}
+            counters = dict(self._counters)
+        for name, hist in sorted(histograms.items()):
+            label = _label(name)
+            for bound, count in zip(self.buckets, hist):
+                lines.append(f'polyvoice_span_seconds_bucket{{span="{label}",le="{bound}"}} {count}')
+            lines.append(f'polyvoice_span_seconds_bucket{{span="{label}",le="+Inf"}} {hist[-2]}')
+            lines.append(f'polyvoice_span_seconds_count{{span="{label}"}} {hist[-2]}')
+            lines.append(f'polyvoice_span_seconds_sum{{span="{label}"}} {hist[-1]:.6f}')
+        typed = set()
+        for (metric, labels), value in sorted(counters.items()):
+            if metric not in typed:
+                lines.append(f"# TYPE {metric} counter")
+                typed.add(metric)
+            rendered = ",".join(f'{k}="{_label(v)}"' for k, v in labels)
+            lines.append(f"{metric}{{{rendered}}} {value}")
+        return "\n".join(lines) + "\n"
+
+
+_registry = MetricsRegistry()
+
+
+def render_metrics():
+    """This process's metrics in the Prometheus text exposition format."""
+    return _registry.render()
+
+
+# --- EXPORTERS ---
+class TraceWriter:
+    """Appends finished spans to a JSON-lines file (one line per span, flushed per line)."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open(path, "a", buffering=1, encoding="utf-8")
+
+    def write(self, span, duration, exc=None):
+        record = {
+            "trace_id": span.trace_id,
+            "span_id": span.span_id,
+            "parent_id": span.parent_id,
+            "name": span.name,
+            "start": round(span.start, 6),
+            "duration_ms": round(duration * 1000, 3),
+            "status": "error" if exc is not None else "ok",
+            "pid": os.getpid(),
+            "thread": threading.current_thread().name,
+            "attrs": span.attrs,
+        }
+        if exc is not None:
+            record["error"] = f"{type(exc).__name__}: {exc}"
+        line = json.dumps(record, default=str, ensure_ascii=False)
+        with self._lock:
+            self._file.write(line + "\n")
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render_metrics().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def start_metrics_server(port, host="0.0.0.0"):
+    """Serves GET /metrics on a daemon thread; returns the server object."""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="polyvoice-metrics", daemon=True).start()
+    return server
+
+
+_trace_writer = None
+_exporters_started = False
+_exporters_lock = threading.Lock()
+
+
+def _ensure_exporters():
+    """Opens the trace file and starts the metrics server once per process, on first use."""
+    global _trace_writer, _exporters_started
+    if _exporters_started:
+        return
+    with _exporters_lock:
+        if _exporters_started:
+            return
+        if TRACE_FILE:
+            _trace_writer = TraceWriter(TRACE_FILE)
+        if METRICS_PORT:
+            try:
+                start_metrics_server(int(METRICS_PORT))
+            except OSError as e:
+                # Another worker of the same deployment already owns the port
+                logger.warning("Metrics server not started on port %s: %s", METRICS_PORT, e)
+        _exporters_started = True
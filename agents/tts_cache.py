@@ -0,0 +1,160 @@
+# In agents/tts_cache.py
+
+import os
+import json
+import time
+import hashlib
+import tempfile
+import threading
+
+# Cache location/size are configurable so the audio never has to live inside the
+# (bind-mounted) source tree. Defaults: <tmp>/polyvoice/tts, 512 MB.
+DEFAULT_CACHE_DIR = os.getenv(
+    "POLYVOICE_TTS_CACHE_DIR", os.path.join(tempfile.gettempdir(), "polyvoice", "tts")
+)
+DEFAULT_MAX_BYTES = int(float(os.getenv("POLYVOICE_TTS_CACHE_MAX_MB", "512")) * 1024 * 1024)
+# Other processes (and other caches sharing the directory) also write; rescan at least this often
+RESCAN_INTERVAL_S = 300.0
+EVICT_TO = 0.9  # share of max_bytes eviction frees down to, so the next writes don't walk again
+
+
+def cache_key(text, voice_id, model_id, voice_settings, speed):
+    """Content address for a clip: everything that changes the synthesized audio."""
+    payload = json.dumps(
+        {
+            "text": text,
+            "voice_id": voice_id,
+            "model_id": model_id,
+            "voice_settings": voice_settings,
+            "speed": round(float(speed), 3),
+        },
+        sort_keys=True,
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class TTSCache:
+    """
+    Content-addressed audio cache on disk.
+    - Writes are atomic (temp file + os.replace), so concurrent sessions/processes never see half a file.
+    - Recency is the file mtime (touched on every hit); eviction drops least-recently-used
+      files until the directory is under max_bytes.
+    - Writes add to a running size total; the directory is only walked when that total
+      passes max_bytes, or RESCAN_INTERVAL_S after the last walk.
+    """
+
+    def __init__(self, directory=None, max_bytes=None, extension=".mp3"):
+        self.directory = directory or DEFAULT_CACHE_DIR
+        self.max_bytes = DEFAULT_MAX_BYTES if max_bytes is None else max_bytes
+        self.extension = extension
+        self._key_locks = {}
+        self._locks_guard = threading.Lock()
+        self._total = None  # bytes on disk as of the last walk plus our writes since; None = unknown
+        self._scanned_at = 0.0
+        self._size_lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+
+    def path_for(self, key):
+        # Two-character fan-out keeps directories small
+        return os.path.join(self.directory, key[:2], key + self.extension)
+
+    def get(self, key):
+        """Returns the cached file path (and marks it recently used), or None."""
+        path = self.path_for(key)
+        try:
+            os.utime(path, None)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def put(self, key, data):
+        """Atomically stores `data` under `key`; returns the final path."""
+        path = self.path_for(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-", suffix=self.extension)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        with self._size_lock:
+            if self._total is not None:
+                self._total += len(data)
+            due = self._total is None or self._total > self.max_bytes or \
+                time.monotonic() - self._scanned_at > RESCAN_INTERVAL_S
+        if due:
+            self.evict(keep=path)
+        return path
+
+    def get_or_create(self, key, produce):
+        """
+        Cache-aside helper: returns the path for `key`, calling produce() -> bytes on a miss.
+        Concurrent misses for the same key in this process wait for one producer.
+        """
+        path = self.get(key)
+        if path:
+            return path
+        with self._locks_guard:
+            lock = self._key_locks.setdefault(key, threading.Lock())
+        with lock:
+            path = self.get(key)
+            if path:
+                return path
+            path = self.put(key, produce())
+        # Only once the clip exists: after a failed produce() the waiters must keep sharing this
+        # lock, or a newcomer with a fresh lock would produce the same key alongside them
+        with self._locks_guard:
+            self._key_locks.pop(key, None)
+        return path
+
+    def _entries(self):
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.startswith(".tmp-"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue  # evicted by another process
+                yield stat.st_mtime, stat.st_size, path
+
+    def total_bytes(self):
+        return sum(size for _, size, _ in self._entries())
+
+    def evict(self, keep=None):
+        """Deletes least-recently-used clips until the cache fits in max_bytes (with EVICT_TO headroom)."""
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        limit = self.max_bytes * EVICT_TO if total > self.max_bytes else self.max_bytes
+        for _, size, path in entries:
+            if total <= limit:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+        with self._size_lock:
+            self._total = total
+            self._scanned_at = time.monotonic()
+        return total
+
+
+_default_cache = None
+_default_lock = threading.Lock()
+
+
+def get_default_cache():
+    """Process-wide cache configured from the environment."""
+    global _default_cache
+    with _default_lock:
+        if _default_cache is None:
+            _default_cache = TTSCache()
+        return _default_cache
@@ -1,57 +1,488 @@
 # In agents/voice_agent.py
 
 import os
+import re
+import time
+import queue
+import shutil
+import hashlib
+import subprocess
+import contextvars
+import threading
+from collections import deque, OrderedDict
+
 import streamlit as st
-from elevenlabs.client import ElevenLabs
-from dotenv import load_dotenv
 
+from .tts_cache import TTSCache, cache_key, get_default_cache
+from .lesson_store import get_default_store
+from .audio_server import start_audio_server
+from .clients import get_eleven_client, guarded_call, ProviderUnavailable
+from .tracing import span, annotate
+from . import api_client
+
+# NOTE: The ElevenLabs client comes from agents/clients.py (one pooled client per process).
+
+TTS_MODEL_ID = "eleven_multilingual_v2"
+# Voice styles offered in the app (and accepted by name in the batch CLI)
+VOICES = {
+    "Teacher-Like": "c1uwEpPUcC16tq1udqxk",
+    "Calm": "z2sgjL6ER8zZEFccuQMN",
+    "Energetic": "NVp9wQor3NDIWcxYoZiW"
+}
+VOICE_SETTINGS = {
+    "stability": 0.5,
+    "similarity_boost": 0.8,
+}
+# Optional: serve cached clips over HTTP so the browser fetches them directly and
+# Streamlit never copies audio bytes. POLYVOICE_AUDIO_PORT starts the built-in server;
+# POLYVOICE_AUDIO_BASE_URL is the address the browser should use (e.g. behind a proxy).
+AUDIO_PORT = os.getenv("POLYVOICE_AUDIO_PORT")
+AUDIO_BASE_URL = os.getenv("POLYVOICE_AUDIO_BASE_URL") or (f"http://localhost:{AUDIO_PORT}" if AUDIO_PORT else None)
+# Without a URL, at most this many clips are held in memory per session
+SESSION_AUDIO_SLOTS = 4
+
+# --- AUDIO TIERS ---
+# Every clip is synthesized once, at 1.0x in BASE_TIER. Other paces and bitrates are
+# re-encoded locally from that clip with ffmpeg (atempo keeps the pitch), so switching
+# either costs no TTS call. Without ffmpeg, ElevenLabs renders them natively instead.
+AUDIO_TIERS = {
+    "high": {
+        "label": "High (MP3 128 kbps)", "output_format": "mp3_44100_128", "ext": "mp3", "mime": "audio/mpeg",
+        "bytes_per_second": 16_000, "encode": ["-c:a", "libmp3lame", "-b:a", "128k", "-f", "mp3"],
+    },
+    "standard": {
+        "label": "Standard (MP3 64 kbps)", "output_format": "mp3_44100_64", "ext": "mp3", "mime": "audio/mpeg",
+        "bytes_per_second": 8_000, "encode": ["-c:a", "libmp3lame", "-b:a", "64k", "-ac", "1", "-f", "mp3"],
+    },
+    "low": {
+        "label": "Data saver (MP3 32 kbps)", "output_format": "mp3_22050_32", "ext": "mp3", "mime": "audio/mpeg",
+        "bytes_per_second": 4_000,
+        "encode": ["-c:a", "libmp3lame", "-b:a", "32k", "-ac", "1", "-ar", "22050", "-f", "mp3"],
+    },
+    "opus": {
+        "label": "Slow connection (Opus 24 kbps)", "output_format": "opus_48000_32", "ext": "ogg",
+        "mime": "audio/ogg", "bytes_per_second": 3_000,
+        # compression_level 5 encodes ~3x faster than the default 10 at no audible cost for speech
+        "encode": ["-c:a", "libopus", "-b:a", "24k", "-ac", "1", "-application", "voip",
+                   "-compression_level", "5", "-f", "ogg"],
+    },
+}
+BASE_TIER = "high"
+DEFAULT_TIER = os.getenv("POLYVOICE_AUDIO_TIER", BASE_TIER)
+FFMPEG = os.getenv("POLYVOICE_FFMPEG") or shutil.which("ffmpeg")
+
+
+def is_base(speed_rate=1.0, tier=BASE_TIER):
+    """True for the clip that is actually synthesized (the others are derived from it)."""
+    return float(speed_rate) == 1.0 and tier == BASE_TIER
 
-# Load environment variables
-load_dotenv()
-ELEVEN_API_KEY = os.getenv("ELEVEN_API_KEY")
 
-# Initialize ElevenLabs client
-try:
-    eleven_client = ElevenLabs(api_key=ELEVEN_API_KEY)
-except Exception as e:
-    st.error(f"Failed to initialize ElevenLabs client: {e}")
-    eleven_client = None
+def voice_settings_for(speed_rate=1.0):
+    """Voice settings for a request; `speed` is only sent when ElevenLabs renders the pace natively."""
+    settings = dict(VOICE_SETTINGS)
+    if speed_rate != 1.0:
+        settings["speed"] = speed_rate
+    return settings
 
 
-def generate_and_play(text, voice_id, msg_id, speed_rate=1.0):
+def audio_cache_key(text, voice_id, speed_rate=1.0, tier=BASE_TIER):
+    """
+    TTS cache key for a full answer. The 1.0x base clip keeps its content address;
+    a pace/tier variant is keyed off the base clip it is derived from.
+    """
+    key = cache_key(text, voice_id, TTS_MODEL_ID, VOICE_SETTINGS, 1.0)
+    if is_base(speed_rate, tier):
+        return key
+    return hashlib.sha256(f"{key}:{round(float(speed_rate), 3)}:{tier}".encode()).hexdigest()
+
+
+def synthesize(text, voice_id, previous_text=None, speed_rate=1.0, tier=BASE_TIER):
+    """One ElevenLabs text_to_speech call; returns the audio bytes in `tier`'s format."""
+    with span("tts.synthesize", voice_id=voice_id, chars=len(text)) as s:
+        audio = _synthesize(text, voice_id, previous_text, speed_rate, tier)
+        s.set(audio_bytes=len(audio))
+        return audio
+
+
+def _synthesize(text, voice_id, previous_text, speed_rate, tier):
+    if api_client.remote_enabled():
+        return api_client.synthesize(text, voice_id, previous_text, speed_rate, tier)
+    kwargs = {}
+    if previous_text:
+        # Lets ElevenLabs keep prosody consistent across streamed sentence chunks
+        kwargs["previous_text"] = previous_text
+
+    def convert():
+        # The SDK streams lazily, so the whole download happens inside the guard
+        response = get_eleven_client().text_to_speech.convert(
+            voice_id=voice_id,
+            model_id=TTS_MODEL_ID,
+            text=text,
+            voice_settings=voice_settings_for(speed_rate),
+            output_format=AUDIO_TIERS[tier]["output_format"],
+            **kwargs,
+        )
+        return b"".join(chunk for chunk in response if chunk)
+
+    return guarded_call("elevenlabs", convert)
+
+
+def transcode(audio, speed_rate=1.0, tier=BASE_TIER):
+    """Re-encodes a clip with ffmpeg: time-stretched to `speed_rate`, in `tier`'s format."""
+    cmd = [FFMPEG, "-hide_banner", "-loglevel", "error", "-i", "pipe:0"]
+    if speed_rate != 1.0:
+        cmd += ["-filter:a", f"atempo={min(max(float(speed_rate), 0.5), 2.0)}"]
+    cmd += AUDIO_TIERS[tier]["encode"] + ["pipe:1"]
+    with span("tts.transcode", tier=tier, speed=speed_rate, input_bytes=len(audio)) as s:
+        result = subprocess.run(cmd, input=audio, capture_output=True, timeout=120)
+        if result.returncode != 0 or not result.stdout:
+            raise RuntimeError(f"ffmpeg failed: {result.stderr.decode(errors='replace').strip()[-300:]}")
+        s.set(audio_bytes=len(result.stdout))
+        return result.stdout
+
+
+def estimate_duration(audio_bytes, tier=BASE_TIER):
+    """Rough playback length (seconds) of a clip at the tier's (roughly constant) bitrate."""
+    return len(audio_bytes) / AUDIO_TIERS[tier]["bytes_per_second"]
+
+
+# --- SENTENCE CHUNKING FOR STREAMED TEXT ---
+_SENTENCE_END = re.compile(r"""[.!?]["')\]]*\s+""")
+_MARKDOWN_NOISE = re.compile(r"[*_#`>|]+")
+
+
+def speakable(text):
+    """Strips markdown markup (bold, headings, code ticks) that TTS would otherwise read aloud."""
+    return re.sub(r"\s+", " ", _MARKDOWN_NOISE.sub("", text)).strip()
+
+
+class SentenceChunker:
+    """
+    Cuts a token stream into sentence/paragraph chunks for TTS.
+    The first chunk is kept short so audio starts early; later chunks are longer
+    so we make fewer ElevenLabs calls and the voice sounds less choppy.
+    """
+
+    def __init__(self, first_min_chars=40, min_chars=160):
+        self.first_min_chars = first_min_chars
+        self.min_chars = min_chars
+        self.buffer = ""
+        self.emitted = 0
+
+    def _min_chars(self):
+        return self.first_min_chars if self.emitted == 0 else self.min_chars
+
+    def feed(self, delta):
+        """Adds streamed text; returns the list of chunks that are now complete."""
+        self.buffer += delta
+        chunks = []
+        while True:
+            cut = None
+            paragraph = self.buffer.find("\n\n")
+            if paragraph != -1 and self.buffer[:paragraph].strip():
+                cut = paragraph + 2
+            else:
+                for match in _SENTENCE_END.finditer(self.buffer):
+                    if match.end() >= self._min_chars():
+                        cut = match.end()
+                        break
+            if cut is None:
+                return chunks
+            chunk, self.buffer = self.buffer[:cut], self.buffer[cut:]
+            if speakable(chunk):
+                chunks.append(chunk)
+                self.emitted += 1
+
+    def flush(self):
+        """Returns whatever is left once the stream has ended."""
+        chunk, self.buffer = self.buffer, ""
+        return chunk if speakable(chunk) else None
+
+
+class SpeechStreamer:
+    """
+    Synthesizes chunks on a background thread while the LLM is still streaming.
+    Clips come out in the same order the text went in, at the requested pace and tier;
+    the 1.0x base-tier chunks are kept so the whole answer can be cached (see save_streamed_audio).
+    """
+
+    def __init__(self, voice_id, speed_rate=1.0, tier=None):
+        self.voice_id = voice_id
+        self.speed_rate = speed_rate
+        self.tier = tier or DEFAULT_TIER
+        self.chunker = SentenceChunker()
+        self.clips = []
+        self.base_clips = []
+        self.error = None
+        self._pending = queue.Queue()
+        self._ready = queue.Queue()
+        # The session's request context, so its TTS calls are scheduled as its own
+        self._worker = threading.Thread(target=contextvars.copy_context().run, args=(self._run,),
+                                        name="polyvoice-tts", daemon=True)
+        self._worker.start()
+
+    def _run(self):
+        previous = None
+        while True:
+            chunk = self._pending.get()
+            if chunk is None:
+                self._ready.put(None)
+                return
+            if self.error is not None:
+                continue
+            text = speakable(chunk)
+            try:
+                clip = self._synthesize(text, previous)
+            except Exception as e:
+                self.error = e
+                continue
+            previous = text
+            self._ready.put(clip)
+
+    def _synthesize(self, text, previous):
+        if FFMPEG is None and not is_base(self.speed_rate, self.tier):
+            # Rendered natively: nothing base-tier to cache for this answer
+            return synthesize(text, self.voice_id, previous, self.speed_rate, self.tier)
+        base = synthesize(text, self.voice_id, previous_text=previous)
+        self.base_clips.append(base)
+        if is_base(self.speed_rate, self.tier):
+            return base
+        return transcode(base, self.speed_rate, self.tier)
+
+    def feed(self, delta):
+        for chunk in self.chunker.feed(delta):
+            self._pending.put(chunk)
+
+    def close(self):
+        tail = self.chunker.flush()
+        if tail:
+            self._pending.put(tail)
+        self._pending.put(None)
+
+    def ready_clips(self):
+        """Non-blocking: clips synthesized since the last call."""
+        clips = []
+        while True:
+            try:
+                clip = self._ready.get_nowait()
+            except queue.Empty:
+                return clips
+            if clip is None:
+                self._ready.put(None)  # keep the end marker for remaining_clips()
+                return clips
+            self.clips.append(clip)
+            clips.append(clip)
+
+    def remaining_clips(self):
+        """Blocking: yields clips until the worker has finished (call after close())."""
+        while True:
+            clip = self._ready.get()
+            if clip is None:
+                return
+            self.clips.append(clip)
+            yield clip
+
+    def audio_bytes(self):
+        """The base-tier chunks as one clip (MP3 frames are self-delimiting, so they concatenate)."""
+        return b"".join(self.base_clips)
+
+
+class ClipPlayer:
+    """
+    Plays clips back-to-back in the browser. Streamlit can't tell us when an <audio>
+    element ends, so each new autoplay element waits for the previous clip's estimated length.
+    """
+
+    def __init__(self, container, tier=None):
+        self.container = container
+        self.tier = tier or DEFAULT_TIER
+        self.queue = deque()
+        self.busy_until = 0.0
+        self.played = 0
+
+    def add(self, clips):
+        self.queue.extend(clips)
+
+    def pump(self, block=False):
+        while self.queue:
+            wait = self.busy_until - time.monotonic()
+            if wait > 0:
+                if not block:
+                    return
+                time.sleep(wait)
+            clip = self.queue.popleft()
+            self.played += 1
+            with self.container:
+                # Distinct alt text: two identical clips (a repeated sentence) would otherwise
+                # get the same element ID and Streamlit rejects the duplicate
+                st.audio(clip, format=AUDIO_TIERS[self.tier]["mime"], autoplay=True,
+                         alt=f"Answer audio, part {self.played}")
+            self.busy_until = time.monotonic() + estimate_duration(clip, self.tier)
+
+
+def save_streamed_audio(streamer, text):
+    """
+    Puts the streamed answer's base clip into the audio cache, so generate_and_play replays it
+    (or derives its pace/tier variant) without a new TTS call.
+    """
+    audio = streamer.audio_bytes()
+    if audio and streamer.error is None:
+        key = audio_cache_key(text, streamer.voice_id)
+        store = get_default_store()
+        if store is not None:
+            store.put_clip(key, audio, streamer.voice_id)
+        else:
+            get_default_cache().put(key, audio)
+
+
+@st.cache_resource
+def _ensure_audio_server():
+    """One audio file server per process (only when POLYVOICE_AUDIO_PORT is set)."""
+    if AUDIO_PORT:
+        return start_audio_server(get_default_cache().directory, int(AUDIO_PORT), store=get_default_store())
+    return None
+
+
+# --- AUDIO CACHE ---
+# Clips live in the lesson store's segments when POLYVOICE_LESSON_STORE is set,
+# otherwise one <key>.<ext> file per clip in the TTS cache directory. Either way they're addressed by key.
+_file_caches = {}
+
+
+def _file_cache(ext):
+    """The TTS cache directory, naming files with `ext` (all formats share one size budget)."""
+    base = get_default_cache()
+    if base.extension == "." + ext:
+        return base
+    if ext not in _file_caches:
+        _file_caches[ext] = TTSCache(base.directory, base.max_bytes, extension="." + ext)
+    return _file_caches[ext]
+
+
+def _get_or_create(key, produce, voice_id, ext):
+    store = get_default_store()
+    if store is not None:
+        return store.get_or_create(key, produce, voice_id)
+    _file_cache(ext).get_or_create(key, produce)
+    return key
+
+
+def ensure_audio(text, voice_id, speed_rate=1.0, tier=None):
+    """Cache key of the clip for this text/voice/pace/tier, producing it on a miss."""
+    tier = tier or DEFAULT_TIER
+    base_key = audio_cache_key(text, voice_id)
+
+    def produce_base():
+        annotate(cache="miss")
+        return synthesize(text, voice_id)
+
+    if is_base(speed_rate, tier):
+        return _get_or_create(base_key, produce_base, voice_id, AUDIO_TIERS[BASE_TIER]["ext"])
+
+    def produce_variant():
+        if FFMPEG is None:
+            annotate(cache="miss")
+            return synthesize(text, voice_id, speed_rate=speed_rate, tier=tier)
+        # A new pace or bitrate is a local re-encode of the cached base clip, not a TTS call
+        _get_or_create(base_key, produce_base, voice_id, AUDIO_TIERS[BASE_TIER]["ext"])
+        base = read_audio(base_key)
+        if base is None:  # evicted in between
+            base = produce_base()
+        annotate(cache="transcode")
+        return transcode(base, speed_rate, tier)
+
+    key = audio_cache_key(text, voice_id, speed_rate, tier)
+    return _get_or_create(key, produce_variant, voice_id, AUDIO_TIERS[tier]["ext"])
+
+
+def has_audio(key, ext="mp3"):
+    store = get_default_store()
+    if store is not None:
+        return store.has_clip(key)
+    return os.path.exists(_file_cache(ext).path_for(key))
+
+
+def read_audio(key, ext="mp3"):
+    """The clip's bytes, or None if it isn't cached (any more)."""
+    store = get_default_store()
+    if store is not None:
+        return store.read_clip(key)
+    path = _file_cache(ext).get(key)
+    if path is None:
+        return None
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def get_audio_handle(text, voice_id, speed_rate=1.0, tier=None):
+    """
+    Lightweight per-session handle for a clip: {"key", "ext", "mime", "url"}.
+    Memoized in session state, so reruns don't synthesize or read audio again.
+    """
+    tier = tier or DEFAULT_TIER
+    ext = AUDIO_TIERS[tier]["ext"]
+    handles = st.session_state.setdefault("audio_handles", {})
+    key = audio_cache_key(text, voice_id, speed_rate, tier)
+    handle = handles.get(key)
+    if handle is not None:
+        annotate(cache="session")
+    if handle is None or not has_audio(key, ext):  # evicted since last time
+        key = ensure_audio(text, voice_id, speed_rate, tier)
+        url = None
+        if AUDIO_BASE_URL:
+            _ensure_audio_server()
+            # Same <2 hex>/<key>.<ext> layout for the TTS cache directory and the lesson store
+            url = f"{AUDIO_BASE_URL.rstrip('/')}/{key[:2]}/{key}.{ext}"
+        handle = {"key": key, "ext": ext, "mime": AUDIO_TIERS[tier]["mime"], "url": url}
+        handles[key] = handle
+    return handle
+
+
+def _session_audio_bytes(handle):
+    """Reads a clip once per session and keeps the last few in a small LRU."""
+    slots = st.session_state.setdefault("audio_bytes", OrderedDict())
+    if handle["key"] in slots:
+        slots.move_to_end(handle["key"])
+    else:
+        slots[handle["key"]] = read_audio(handle["key"], handle["ext"])
+        while len(slots) > SESSION_AUDIO_SLOTS:
+            slots.popitem(last=False)
+    return slots[handle["key"]]
+
+
+def render_audio(handle, autoplay=False, alt=None):
+    """By URL when the audio server is configured, otherwise from session-held bytes."""
+    if handle["url"]:
+        st.audio(handle["url"], format=handle["mime"], autoplay=autoplay, alt=alt)
+    else:
+        st.audio(_session_audio_bytes(handle), format=handle["mime"], autoplay=autoplay, alt=alt)
+
+
+def generate_and_play(text, voice_id, msg_id=None, speed_rate=1.0, lightweight=False, tier=None):
     """
     Generate and play audio using ElevenLabs old SDK structure.
     Compatible with v0.x versions (no .audio.generate).
+    Audio is content-addressed in the TTS cache, so `msg_id` only keys the widget;
+    identical text/voice is synthesized once across all sessions, and other paces/tiers
+    are re-encoded from that clip.
+    With lightweight=True (past turns) and no audio URL, a play toggle stands in for the
+    player, so nothing is loaded or sent until the user asks for it.
     """
-    if not eleven_client:
-        st.error("ElevenLabs client not initialized.")
-        return
-
-    audio_file = f"tts_output_{msg_id}_{voice_id}.mp3"
+    if lightweight and not AUDIO_BASE_URL:
+        if not st.toggle("🔊 Play answer", key=f"play_{msg_id}_{voice_id}_{speed_rate}_{tier}"):
+            return
 
-    if not os.path.exists(audio_file):
+    with span("tts", voice_id=voice_id, chars=len(text), cache="hit") as s:
         try:
-            # OLD SDK endpoint expects arguments like this:
-            response = eleven_client.text_to_speech.convert(
-                voice_id=voice_id,
-                model_id="eleven_multilingual_v2",
-                text=text,
-                voice_settings={
-                    "stability": 0.5,
-                    "similarity_boost": 0.8,
-                },
-            )
-
-            # Save audio stream
-            with open(audio_file, "wb") as f:
-                for chunk in response:
-                    if chunk:
-                        f.write(chunk)
-
+            handle = get_audio_handle(text, voice_id, speed_rate, tier)
+        except ProviderUnavailable:
+            s.set(cache="unavailable")
+            st.caption("🔇 Voice is temporarily unavailable; the text answer is complete.")
+            return
         except Exception as e:
+            s.set(cache="error", error=str(e))
             st.error(f"Error generating voice. Check your API key or plan. Details: {e}")
             return
 
-    # Play the audio file
-    with open(audio_file, "rb") as f:
-        st.audio(f.read(), format="audio/mp3")
+        # Per-message alt text keeps two turns with the same answer from colliding on element ID
+        render_audio(handle, alt=f"Answer audio, message {msg_id}" if msg_id is not None else None)
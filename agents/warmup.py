@@ -0,0 +1,109 @@
+# In agents/warmup.py
+
+"""
+Warm start: pay the import, client and connection costs before the first question.
+
+    POLYVOICE_WARMUP=1        app.py / api_server.py warm up on a background thread as soon as
+                              the process starts serving (the first page render isn't blocked)
+    POLYVOICE_WARMUP_STT=1    ...and load the Whisper model too (otherwise: on first mic use)
+
+    python -m agents.warmup [--stt] [--no-connect]
+
+The CLI runs the same steps in the foreground and prints their timings, e.g. as a container
+start hook. In its own process it can only leave behind what outlives it (downloaded Whisper
+weights, bytecode and the OS page cache, cache database files), and it fails loudly on a
+missing key or an unreachable provider before any student does.
+"""
+
+import os
+import sys
+import json
+import time
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+ENABLED = os.getenv("POLYVOICE_WARMUP", "").lower() in ("1", "true", "yes")
+WARMUP_STT = os.getenv("POLYVOICE_WARMUP_STT", "").lower() in ("1", "true", "yes")
+
+last_report = None  # step -> seconds (or "failed: ..."), from the most recent warm_up()
+
+
+def _import_agents():
+    from . import orchestrator, voice_agent, quiz_agent  # noqa: F401
+
+
+def _build_clients():
+    from .clients import get_clients
+    get_clients()
+
+
+def _connect():
+    from .clients import warm_connections
+    warm_connections()
+
+
+def _open_caches():
+    from .research_cache import get_default_cache as research_cache
+    from .tts_cache import get_default_cache as tts_cache
+    from .lesson_store import get_default_store
+
+    research_cache()
+    tts_cache()
+    get_default_store()
+
+
+def _load_stt():
+    from .stt_agent import load_transcription_model
+    load_transcription_model()
+
+
+def warm_up(stt=WARMUP_STT, connect=True, extra_steps=()):
+    """Runs every step (a failing step is logged, not raised); returns step -> seconds."""
+    global last_report
+    steps = [("agents", _import_agents), ("clients", _build_clients)]
+    if connect:
+        steps.append(("connections", _connect))
+    steps.append(("caches", _open_caches))
+    if stt:
+        steps.append(("stt", _load_stt))
+    steps.extend(extra_steps)
+
+    report = {}
+    for name, step in steps:
+        started = time.perf_counter()
+        try:
+            step()
+            report[name] = round(time.perf_counter() - started, 3)
+        except Exception as e:
+            logger.warning("Warm-up step %s failed: %s", name, e)
+            report[name] = f"failed: {type(e).__name__}: {e}"
+    last_report = report
+    return report
+
+
+def start_background(**kwargs):
+    """warm_up() on a daemon thread; returns the thread."""
+    thread = threading.Thread(target=warm_up, kwargs=kwargs, name="polyvoice-warmup", daemon=True)
+    thread.start()
+    return thread
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Preload models, clients and connections")
+    parser.add_argument("--stt", action="store_true", default=WARMUP_STT, help="also load the Whisper model")
+    parser.add_argument("--no-connect", action="store_true", help="skip opening provider connections")
+    args = parser.parse_args()
+
+    if args.stt:
+        # stt_agent caches the model with st.cache_resource; keep bare-mode warnings out of the log
+        from streamlit import config
+        from streamlit.logger import set_log_level
+        config.get_config_options()
+        set_log_level("error")
+    report = warm_up(stt=args.stt, connect=not args.no_connect)
+    print(json.dumps(report, indent=2))
+    sys.exit(1 if any(isinstance(v, str) for v in report.values()) else 0)
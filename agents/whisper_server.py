@@ -0,0 +1,303 @@
+# In agents/whisper_server.py
+
+"""
+Shared Whisper transcription worker.
+
+One process loads the model once and serves every Streamlit process/session on the box,
+micro-batching pending segments (up to --max-batch, waiting at most --max-wait-ms):
+
+    python -m agents.whisper_server --model base --threads 4 --quantize int8
+    POLYVOICE_WHISPER_ADDRESS=unix:/tmp/polyvoice-whisper.sock streamlit run app.py
+
+Addresses are "unix:/path/to.sock" or "host:port". multiprocessing.connection unpickles what
+it receives, so a host:port worker needs a shared secret in POLYVOICE_WHISPER_AUTHKEY (at least
+16 bytes, same value for the worker and its clients) and won't start without one. Prefer a
+unix socket on one host: it is created owner-only (0600) and the key is optional there.
+"""
+
+import os
+import time
+import queue
+import argparse
+import threading
+from collections import deque
+from multiprocessing.connection import Listener, Client
+
+import numpy as np
+
+DEFAULT_ADDRESS = os.getenv("POLYVOICE_WHISPER_ADDRESS", "unix:/tmp/polyvoice-whisper.sock")
+AUTHKEY = os.getenv("POLYVOICE_WHISPER_AUTHKEY", "").encode("utf-8") or None
+MIN_AUTHKEY_BYTES = 16
+SAMPLE_RATE = 16000
+# Whisper decodes fixed 30 s windows; longer segments go through transcribe() individually
+MAX_BATCH_SECONDS = 30
+
+
+def parse_address(address):
+    if address.startswith("unix:"):
+        return address[len("unix:"):], "AF_UNIX"
+    host, port = address.rsplit(":", 1)
+    return (host, int(port)), "AF_INET"
+
+
+def authkey_for(family):
+    """The connection key; refuses TCP without a real shared secret."""
+    if family == "AF_INET" and (AUTHKEY is None or len(AUTHKEY) < MIN_AUTHKEY_BYTES):
+        raise RuntimeError(
+            f"POLYVOICE_WHISPER_AUTHKEY (at least {MIN_AUTHKEY_BYTES} bytes) is required for a host:port "
+            "Whisper address; or use unix:/path/to.sock"
+        )
+    return AUTHKEY
+
+
+# --- SERVER ---
+class _Request:
+    __slots__ = ("audio", "language", "prompt", "reply", "enqueued")
+
+    def __init__(self, audio, language, prompt, reply):
+        self.audio = audio
+        self.language = language
+        self.prompt = prompt
+        self.reply = reply
+        self.enqueued = time.monotonic()
+
+
+class WhisperServer:
+    def __init__(self, model_name="base", threads=None, quantize=None, max_batch=8, max_wait_ms=40):
+        import torch
+        import whisper
+
+        if threads:
+            torch.set_num_threads(threads)
+        self.whisper = whisper
+        self.model = whisper.load_model(model_name, device="cpu")
+        if quantize == "int8":
+            # Dynamic int8 quantization of the Linear layers: smaller and faster on CPU
+            self.model = torch.quantization.quantize_dynamic(self.model, {torch.nn.Linear}, dtype=torch.qint8)
+        self.model_name = model_name
+        self.quantize = quantize
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self.pending = queue.Queue()
+        self.latencies = deque(maxlen=1000)
+        self.batch_sizes = deque(maxlen=1000)
+        self.served = 0
+        self.errors = 0
+
+    # Batching loop: take the first request, then whatever else arrives before the deadline
+    def batch_loop(self):
+        while True:
+            batch = [self.pending.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.pending.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._run_batch(batch)
+
+    def _run_batch(self, batch):
+        short = [r for r in batch if len(r.audio) <= MAX_BATCH_SECONDS * SAMPLE_RATE]
+        long = [r for r in batch if r not in short]
+        self.batch_sizes.append(len(batch))
+
+        # Group short segments by language; each group is one batched decode
+        groups = {}
+        for r in short:
+            groups.setdefault(r.language, []).append(r)
+        for language, group in groups.items():
+            try:
+                texts = self._decode_batch(group, language)
+            except Exception as e:
+                self._fail(group, e)
+                continue
+            for r, text in zip(group, texts):
+                self._reply(r, {"text": text})
+
+        for r in long:
+            try:
+                result = self.model.transcribe(
+                    r.audio, fp16=False, language=r.language, initial_prompt=r.prompt or None
+                )
+            except Exception as e:
+                self._fail([r], e)
+                continue
+            self._reply(r, {"text": result["text"].strip()})
+
+    def _decode_batch(self, group, language):
+        import torch
+
+        w = self.whisper
+        mels = torch.stack([
+            w.log_mel_spectrogram(w.pad_or_trim(torch.from_numpy(r.audio)), n_mels=self.model.dims.n_mels)
+            for r in group
+        ])
+        # A prompt applies to the whole batch, so it is only used for a batch of one
+        prompt = group[0].prompt if len(group) == 1 and group[0].prompt else None
+        options = w.DecodingOptions(language=language, fp16=False, without_timestamps=True, prompt=prompt)
+        with torch.no_grad():
+            results = w.decode(self.model, mels, options)
+        return [res.text.strip() for res in results]
+
+    def _reply(self, request, payload):
+        self.served += 1
+        self.latencies.append(time.monotonic() - request.enqueued)
+        request.reply(payload)
+
+    def _fail(self, requests, error):
+        for r in requests:
+            self.errors += 1
+            r.reply({"error": str(error)})
+
+    def stats(self):
+        latencies = sorted(self.latencies)
+        pick = lambda q: round(latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000, 1) if latencies else None
+        return {
+            "model": self.model_name,
+            "quantize": self.quantize,
+            "queue_depth": self.pending.qsize(),
+            "served": self.served,
+            "errors": self.errors,
+            "mean_batch_size": round(sum(self.batch_sizes) / len(self.batch_sizes), 2) if self.batch_sizes else 0,
+            "latency_p50_ms": pick(0.50),
+            "latency_p95_ms": pick(0.95),
+        }
+
+    # One thread per client connection; replies may come back out of order, matched by id
+    def serve_connection(self, conn):
+        send_lock = threading.Lock()
+
+        def send(message):
+            with send_lock:
+                try:
+                    conn.send(message)
+                except (OSError, EOFError):
+                    pass  # client went away
+
+        try:
+            while True:
+                message = conn.recv()
+                request_id = message.get("id")
+                if message.get("op") == "stats":
+                    send({"id": request_id, **self.stats()})
+                    continue
+                audio = np.frombuffer(message["audio"], dtype=np.float32)
+                self.pending.put(_Request(
+                    audio, message.get("language", "en"), message.get("prompt"),
+                    lambda payload, request_id=request_id: send({"id": request_id, **payload}),
+                ))
+        except (EOFError, OSError):
+            pass
+        finally:
+            conn.close()
+
+    def serve_forever(self, address):
+        bind, family = parse_address(address)
+        authkey = authkey_for(family)
+        if family == "AF_UNIX" and os.path.exists(bind):
+            os.remove(bind)
+        old_umask = os.umask(0o177)  # the socket file is created owner-only
+        try:
+            listener = Listener(bind, family=family, authkey=authkey)
+        finally:
+            os.umask(old_umask)
+        threading.Thread(target=self.batch_loop, name="whisper-batcher", daemon=True).start()
+        print(f"Whisper server ({self.model_name}, quantize={self.quantize}) listening on {address}", flush=True)
+        while True:
+            conn = listener.accept()
+            threading.Thread(target=self.serve_connection, args=(conn,), daemon=True).start()
+
+
+# --- CLIENT ---
+class RemoteWhisperModel:
+    """
+    Drop-in for a local whisper model in StreamingTranscriber: .transcribe(audio, **kw) -> {"text": ...}.
+    One connection per process, shared by all sessions; replies are matched to callers by id.
+    """
+
+    def __init__(self, address=DEFAULT_ADDRESS, timeout=30.0):
+        self.address = address
+        self.timeout = timeout
+        self._conn = None
+        self._send_lock = threading.Lock()
+        self._waiters = {}
+        self._waiters_lock = threading.Lock()
+        self._next_id = 0
+
+    def _connection(self):
+        if self._conn is None:
+            bind, family = parse_address(self.address)
+            self._conn = Client(bind, family=family, authkey=authkey_for(family))
+            threading.Thread(target=self._receive_loop, args=(self._conn,), daemon=True).start()
+        return self._conn
+
+    def _receive_loop(self, conn):
+        try:
+            while True:
+                message = conn.recv()
+                with self._waiters_lock:
+                    waiter = self._waiters.pop(message.get("id"), None)
+                if waiter:
+                    waiter[1].update(message)
+                    waiter[0].set()
+        except (EOFError, OSError):
+            with self._send_lock:
+                if self._conn is conn:
+                    self._conn = None
+            with self._waiters_lock:
+                waiters, self._waiters = self._waiters, {}
+            for event, reply in waiters.values():
+                reply["error"] = "Whisper server connection lost"
+                event.set()
+
+    def _call(self, message):
+        event, reply = threading.Event(), {}
+        with self._send_lock:
+            self._next_id += 1
+            message["id"] = self._next_id
+            with self._waiters_lock:
+                self._waiters[message["id"]] = (event, reply)
+            self._connection().send(message)
+        if not event.wait(self.timeout):
+            with self._waiters_lock:
+                self._waiters.pop(message["id"], None)
+            raise TimeoutError(f"Whisper server did not answer within {self.timeout}s")
+        if "error" in reply:
+            raise RuntimeError(reply["error"])
+        return reply
+
+    def transcribe(self, audio, language="en", initial_prompt=None, **kwargs):
+        audio = np.ascontiguousarray(audio, dtype=np.float32)
+        reply = self._call({"op": "transcribe", "audio": audio.tobytes(), "language": language, "prompt": initial_prompt})
+        return {"text": reply["text"]}
+
+    def stats(self):
+        reply = self._call({"op": "stats"})
+        reply.pop("id", None)
+        return reply
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default=os.getenv("POLYVOICE_WHISPER_MODEL", "base"),
+                        help="tiny, base, small, ... (or the .en variants)")
+    parser.add_argument("--quantize", choices=["int8"], default=None, help="dynamic int8 quantization")
+    parser.add_argument("--threads", type=int, default=os.cpu_count(), help="torch CPU threads")
+    parser.add_argument("--max-batch", type=int, default=8)
+    parser.add_argument("--max-wait-ms", type=float, default=40.0)
+    parser.add_argument("--address", default=DEFAULT_ADDRESS)
+    args = parser.parse_args()
+    try:
+        authkey_for(parse_address(args.address)[1])  # fail before spending time on the model
+    except RuntimeError as e:
+        parser.error(str(e))
+
+    server = WhisperServer(args.model, args.threads, args.quantize, args.max_batch, args.max_wait_ms)
+    server.serve_forever(args.address)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,385 @@
+"""
+Headless PolyVoice API (ASGI), so the pipeline can be load-tested and scaled beside Streamlit.
+
+    uvicorn api_server:app --host 0.0.0.0 --port 8000 --workers 4
+
+Endpoints:
+    POST /v1/answer          {"query", "level", "memory"?}   -> pipeline result (JSON)
+    POST /v1/answer/stream   same body                        -> server-sent events: delta*, result | error
+    POST /v1/tts             {"text", "voice_id", "speed"?, "tier"?, "previous_text"?} -> audio (mpeg/ogg)
+    POST /v1/stt             raw float32 PCM (16 kHz mono) or a WAV file       -> {"text"}
+    GET  /v1/stats           cache / provider / queue counters
+    GET  /metrics            per-stage timings, tokens, audio bytes (Prometheus; needs tracing enabled)
+    GET  /healthz
+
+Each worker admits at most POLYVOICE_API_CONCURRENCY pipeline runs and queues at most
+POLYVOICE_API_QUEUE more; beyond that it answers 503 + Retry-After right away.
+
+Provider calls are shared per tenant and rate-limited per user (agents/scheduler.py), from the
+X-PolyVoice-Tenant / X-PolyVoice-User / X-PolyVoice-Priority headers (user defaults to the
+client address). A user over their rate gets 429 + Retry-After.
+"""
+
+import io
+import os
+import json
+import math
+import wave
+import asyncio
+import contextlib
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+from agents.clients import get_clients, provider_stats, admit, ProviderUnavailable, ProviderBusy
+from agents.scheduler import PRIORITIES, set_request
+from agents.memory import ConversationMemory
+from agents.orchestrator import (
+    run_pipeline_concurrent,
+    run_pipeline_stream,
+    research_cache_stats,
+    answer_cache_stats,
+)
+from agents.voice_agent import AUDIO_TIERS, BASE_TIER, ensure_audio, read_audio, synthesize
+from agents.tracing import render_metrics
+from agents import warmup
+
+MAX_ACTIVE = int(os.getenv("POLYVOICE_API_CONCURRENCY", "8"))
+MAX_QUEUED = int(os.getenv("POLYVOICE_API_QUEUE", "32"))
+RETRY_AFTER_S = 2
+SPEED_RANGE = (0.7, 1.2)  # ElevenLabs' voice speed range (the app offers 0.85x-1.15x)
+VALID_LEVELS = {"elementary-dyslexia", "adhd", "plain", "standard-research",
+                "high-school-adhd", "plain-language-clarity"}
+
+# Blocking pipeline work runs here, never on the event loop
+_executor = ThreadPoolExecutor(max_workers=MAX_ACTIVE * 2, thread_name_prefix="polyvoice-api")
+
+
+class Busy(Exception):
+    pass
+
+
+class AdmissionGate:
+    """Bounded concurrency with a bounded wait queue; overflow is rejected instead of queued."""
+
+    def __init__(self, max_active, max_queued):
+        self.max_active = max_active
+        self.max_queued = max_queued
+        self.active = 0
+        self.waiting = 0
+        self.rejected = 0
+        self._semaphore = None
+
+    async def acquire(self):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_active)
+        if self.active + self.waiting >= self.max_active + self.max_queued:
+            self.rejected += 1
+            raise Busy()
+        self.waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        self.active += 1
+
+    def release(self):
+        self.active -= 1
+        self._semaphore.release()
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, *exc):
+        self.release()
+
+    def stats(self):
+        return {"active": self.active, "queued": self.waiting, "rejected": self.rejected,
+                "max_active": self.max_active, "max_queued": self.max_queued}
+
+
+gate = AdmissionGate(MAX_ACTIVE, MAX_QUEUED)
+
+
+def _busy():
+    return JSONResponse({"error": "busy", "retry_after": RETRY_AFTER_S}, status_code=503,
+                        headers={"Retry-After": str(RETRY_AFTER_S)})
+
+
+def _unavailable(e):
+    if isinstance(e, ProviderBusy):
+        status = 429 if e.reason == "rate limited" else 503
+        return JSONResponse({"error": str(e), "retry_after": e.retry_after}, status_code=status,
+                            headers={"Retry-After": str(max(1, math.ceil(e.retry_after)))})
+    return JSONResponse({"error": str(e)}, status_code=503, headers={"Retry-After": str(RETRY_AFTER_S)})
+
+
+def _set_request_context(request):
+    """Tags this request's provider calls with the caller's tenant, user and priority."""
+    headers = request.headers
+    priority = headers.get("x-polyvoice-priority", "interactive")
+    set_request(
+        tenant=headers.get("x-polyvoice-tenant"),
+        user=headers.get("x-polyvoice-user") or (request.client.host if request.client else None),
+        priority=priority if priority in PRIORITIES else "interactive",
+    )
+
+
+async def _json_body(request):
+    """The request body as a dict; ValueError (-> 400) for bad JSON or any other JSON type."""
+    body = await request.json()  # json.JSONDecodeError is a ValueError
+    if not isinstance(body, dict):
+        raise ValueError("the request body must be a JSON object")
+    return body
+
+
+def _memory_from_state(state):
+    """ConversationMemory from the client's memory state; ValueError if it is malformed."""
+    if not isinstance(state, dict):
+        raise ValueError("'memory' must be an object")
+    turns = state.get("turns", [])
+    if not isinstance(turns, list) or not all(
+        isinstance(turn, dict) and turn.get("role") in ("user", "assistant") and isinstance(turn.get("content"), str)
+        for turn in turns
+    ):
+        raise ValueError("'memory.turns' must be a list of {\"role\": \"user\" | \"assistant\", \"content\": string}")
+    if not isinstance(state.get("summary", ""), str) or not isinstance(state.get("folded_turns", 0), int):
+        raise ValueError("'memory.summary' must be a string and 'memory.folded_turns' an integer")
+    return ConversationMemory.from_state(state)
+
+
+async def _answer_request(request):
+    body = await _json_body(request)
+    query = body.get("query") or ""
+    level = body.get("level", "plain")
+    if not isinstance(query, str) or not query.strip():
+        raise ValueError("'query' is required")
+    if not isinstance(level, str) or level not in VALID_LEVELS:
+        raise ValueError(f"unknown level '{level}'")
+    # The client owns the conversation memory, so any worker can serve any request
+    memory = _memory_from_state(body.get("memory") or {})
+    return query.strip(), level, memory
+
+
+async def _tts_request(request):
+    body = await _json_body(request)
+    text, voice_id, previous_text = body.get("text"), body.get("voice_id"), body.get("previous_text")
+    if not text or not voice_id or not isinstance(text, str) or not isinstance(voice_id, str):
+        raise ValueError("'text' and 'voice_id' are required")
+    if previous_text is not None and not isinstance(previous_text, str):
+        raise ValueError("'previous_text' must be a string")
+    try:
+        speed = float(body.get("speed", 1.0))
+    except (TypeError, ValueError):
+        speed = None
+    if speed is None or not SPEED_RANGE[0] <= speed <= SPEED_RANGE[1]:
+        raise ValueError(f"'speed' must be a number from {SPEED_RANGE[0]} to {SPEED_RANGE[1]}")
+    tier = body.get("tier", BASE_TIER)
+    if not isinstance(tier, str) or tier not in AUDIO_TIERS:
+        raise ValueError(f"'tier' must be one of {sorted(AUDIO_TIERS)}")
+    return text, voice_id, previous_text, speed, tier
+
+
+async def _run_blocking(fn, *args):
+    # Executor threads don't inherit context variables; the request context must come along
+    return await asyncio.get_running_loop().run_in_executor(_executor, contextvars.copy_context().run, fn, *args)
+
+
+# --- endpoints ---
+async def answer(request):
+    try:
+        query, level, memory = await _answer_request(request)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    _set_request_context(request)
+    cb, exa, _ = get_clients()
+    try:
+        admit()
+        async with gate:
+            result = await _run_blocking(run_pipeline_concurrent, cb, exa, query, level, memory)
+    except Busy:
+        return _busy()
+    except ProviderUnavailable as e:
+        return _unavailable(e)
+    return JSONResponse(result)
+
+
+class _GatedStreamingResponse(StreamingResponse):
+    """Holds a gate slot taken before the headers went out; frees it however the response ends."""
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            gate.release()
+
+
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+async def answer_stream(request):
+    try:
+        query, level, memory = await _answer_request(request)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    _set_request_context(request)
+    # Before the slot is taken: nothing may fail between acquire() and the response owning it
+    cb, exa, _ = get_clients()
+    try:
+        admit()
+        # The slot is taken before the 200 goes out, so "busy" is still a plain 503
+        await gate.acquire()
+    except Busy:
+        return _busy()
+    except ProviderBusy as e:
+        return _unavailable(e)
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+
+    async def events():
+        queue = asyncio.Queue()
+        cancelled = threading.Event()
+
+        def produce():
+            # Runs the sync generator on a worker thread and hands events to the loop
+            try:
+                for event, payload in run_pipeline_stream(cb, exa, query, level, memory):
+                    if cancelled.is_set():
+                        return
+                    loop.call_soon_threadsafe(queue.put_nowait, (event, payload))
+            except Exception as e:
+                loop.call_soon_threadsafe(queue.put_nowait, ("error", {"error": str(e)}))
+            finally:
+                loop.call_soon_threadsafe(queue.put_nowait, None)
+
+        loop.run_in_executor(_executor, context.run, produce)
+        try:
+            while True:
+                item = await queue.get()
+                if item is None:
+                    return
+                yield _sse(*item)
+        finally:
+            cancelled.set()  # client disconnected: stop after the current chunk
+
+    return _GatedStreamingResponse(events(), media_type="text/event-stream",
+                                   headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+async def tts(request):
+    try:
+        text, voice_id, previous_text, speed, tier = await _tts_request(request)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    _set_request_context(request)
+    try:
+        admit()
+        async with gate:
+            if previous_text:
+                # Sentence chunk from a streaming client: continuity matters more than caching
+                audio = await _run_blocking(lambda: synthesize(text, voice_id, previous_text, speed, tier))
+            else:
+                key = await _run_blocking(ensure_audio, text, voice_id, speed, tier)
+                audio = await _run_blocking(read_audio, key, AUDIO_TIERS[tier]["ext"])
+    except Busy:
+        return _busy()
+    except ProviderUnavailable as e:
+        return _unavailable(e)
+    if not audio:
+        # Evicted between synthesis and the read; a retry synthesizes (or finds) it again
+        return JSONResponse({"error": "audio not available, retry"}, status_code=503,
+                            headers={"Retry-After": str(RETRY_AFTER_S)})
+    return Response(audio, media_type=AUDIO_TIERS[tier]["mime"])
+
+
+_stt_model = None
+_stt_lock = threading.Lock()
+
+
+def _get_stt_model():
+    """Loaded on the first /v1/stt request (or by the warm-up): whisper pulls in torch."""
+    global _stt_model
+    with _stt_lock:
+        if _stt_model is None:
+            address = os.getenv("POLYVOICE_WHISPER_ADDRESS")
+            if address:
+                from agents.whisper_server import RemoteWhisperModel
+                _stt_model = RemoteWhisperModel(address)
+            else:
+                import whisper
+                _stt_model = whisper.load_model(os.getenv("POLYVOICE_WHISPER_MODEL", "base"))
+        return _stt_model
+
+
+def _transcribe(audio):
+    return _get_stt_model().transcribe(audio, fp16=False, language="en")["text"].strip()
+
+
+def _decode_audio(raw, content_type):
+    if content_type.startswith("audio/wav") or raw[:4] == b"RIFF":
+        with wave.open(io.BytesIO(raw)) as wf:
+            if wf.getsampwidth() != 2 or wf.getframerate() != 16000:
+                raise ValueError("WAV must be 16-bit PCM at 16 kHz")
+            pcm = np.frombuffer(wf.readframes(wf.getnframes()), dtype=np.int16)
+            pcm = pcm.reshape(-1, wf.getnchannels()).mean(axis=1)
+            return (pcm / 32768.0).astype(np.float32)
+    return np.frombuffer(raw, dtype=np.float32)
+
+
+async def stt(request):
+    raw = await request.body()
+    try:
+        audio = _decode_audio(raw, request.headers.get("content-type", ""))
+    except (ValueError, wave.Error) as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    try:
+        async with gate:
+            text = await _run_blocking(_transcribe, audio)
+    except Busy:
+        return _busy()
+    return JSONResponse({"text": text})
+
+
+async def stats(request):
+    return JSONResponse({
+        "queue": gate.stats(),
+        "research_cache": research_cache_stats(),
+        "answer_cache": answer_cache_stats(),
+        "providers": provider_stats(),
+    })
+
+
+async def metrics(request):
+    # Per worker process: scrape each worker (or run one) for exact totals
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+
+async def healthz(request):
+    return JSONResponse({"ok": True, "warmup": warmup.last_report})
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    # Each worker warms itself when it starts; /v1/stt uses this module's Whisper model
+    if warmup.ENABLED:
+        extra = [("stt", _get_stt_model)] if warmup.WARMUP_STT else []
+        warmup.start_background(stt=False, extra_steps=extra)
+    yield
+
+
+app = Starlette(lifespan=lifespan, routes=[
+    Route("/v1/answer", answer, methods=["POST"]),
+    Route("/v1/answer/stream", answer_stream, methods=["POST"]),
+    Route("/v1/tts", tts, methods=["POST"]),
+    Route("/v1/stt", stt, methods=["POST"]),
+    Route("/v1/stats", stats, methods=["GET"]),
+    Route("/metrics", metrics, methods=["GET"]),
+    Route("/healthz", healthz, methods=["GET"]),
+])
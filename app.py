@@ -1,27 +1,54 @@
 import streamlit as st
 import os
+import math
+import time
+import uuid
 from dotenv import load_dotenv
 import urllib.parse
+import html
 
-from cerebras.cloud.sdk import Cerebras
-from exa_py import Exa
-from elevenlabs.client import ElevenLabs
+from agents.orchestrator import run_pipeline_stream, research_cache_stats, answer_cache_stats
+from agents.quiz_agent import flowchart_to_dot, OPTION_LETTERS
+from agents.voice_agent import (
+    generate_and_play, SpeechStreamer, ClipPlayer, save_streamed_audio, VOICES, AUDIO_TIERS, DEFAULT_TIER,
+)
+from agents.memory import ConversationMemory
+from agents.lesson_store import get_default_store
+from agents.clients import get_clients, provider_stats, admit, ProviderUnavailable, ProviderBusy
+from agents.scheduler import set_request
+from agents import prefetch
+from agents import api_client
+from agents import warmup
 
+# --- Load environment variables ---
+load_dotenv()
 
+if api_client.remote_enabled():
+    # Thin-client mode: the API service (api_server.py) runs the pipeline and TTS
+    pipeline_stream = api_client.run_pipeline_stream
+else:
+    pipeline_stream = run_pipeline_stream
 
-from agents.orchestrator import run_pipeline
-from agents.voice_agent import generate_and_play
 
-# --- Load environment variables ---
-load_dotenv()
+def pipeline_clients():
+    """
+    (cb, exa): pooled, retrying clients built once per process on first use (stand-ins when
+    POLYVOICE_OFFLINE=1), so the first page render doesn't wait for the provider SDK imports.
+    """
+    if api_client.remote_enabled():
+        return None, None
+    cb, exa, _ = get_clients()
+    return cb, exa
+
 
-CEREBRAS_API_KEY = os.getenv("CEREBRAS_API_KEY")
-EXA_API_KEY = os.getenv("EXA_API_KEY")
-ELEVEN_API_KEY = os.getenv("ELEVEN_API_KEY")
+@st.cache_resource
+def _warm_start():
+    # Imports, clients, connections (and Whisper with POLYVOICE_WARMUP_STT=1) in the background
+    return warmup.start_background()
 
-cb = Cerebras(api_key=CEREBRAS_API_KEY)
-exa = Exa(api_key=EXA_API_KEY)
-eleven_client = ElevenLabs(api_key=ELEVEN_API_KEY)
+
+if warmup.ENABLED:
+    _warm_start()
 
 # --- Streamlit page setup ---
 st.set_page_config(page_title="PolyVoice", layout="wide")
@@ -115,10 +142,48 @@ st.markdown("<h1>🎙️ PolyVoice</h1>", unsafe_allow_html=True)
 st.markdown("<p style='color:gray;'>Accessible AI explanations with voice and trusted sources.</p>", unsafe_allow_html=True)
 
 # --- Session State ---
+# Only the latest messages are kept for display; the tutor's memory of older turns
+# lives in a bounded, summarized ConversationMemory.
+MAX_DISPLAY_MESSAGES = 20
+
 if "messages" not in st.session_state:
     st.session_state["messages"] = []
+if "memory" not in st.session_state:
+    st.session_state["memory"] = ConversationMemory()
+if "next_msg_id" not in st.session_state:
+    st.session_state["next_msg_id"] = 0
 if "widget_key" not in st.session_state:
     st.session_state["widget_key"] = 0
+# Warms the caches with likely follow-ups while the student reads (POLYVOICE_PREFETCH=1)
+if "prefetcher" not in st.session_state:
+    st.session_state["prefetcher"] = (
+        prefetch.Prefetcher() if prefetch.ENABLED and not api_client.remote_enabled() else None
+    )
+# Provider capacity is shared fairly per tenant (a class: ?tenant=..., else this session)
+# and rate-limited per session; see agents/scheduler.py
+if "user_id" not in st.session_state:
+    st.session_state["user_id"] = uuid.uuid4().hex
+set_request(tenant=st.query_params.get("tenant"), user=st.session_state["user_id"])
+
+
+def busy_message(e):
+    """The "busy" note for a ProviderBusy, from local admission or the API service (429/503)."""
+    wait = max(1, math.ceil(e.retry_after))
+    if e.reason == "rate limited":
+        return f"⏳ That's a lot of questions in a row. Try again in {wait} s."
+    return f"⏳ PolyVoice is busy with other students right now. Try again in {wait} s."
+
+
+def admitted():
+    """Says "busy" right away instead of starting an answer the providers can't serve now."""
+    if api_client.remote_enabled():
+        return True  # the API service admits; its 429/503 is handled around the answer stream
+    try:
+        admit()
+    except ProviderBusy as e:
+        st.warning(busy_message(e))
+        return False
+    return True
 
 # --- Sidebar ---
 st.sidebar.header("Personalize Learning")
@@ -140,11 +205,7 @@ level_choice_label = st.sidebar.selectbox(
 selected_level = level_map[level_choice_label]
 
 
-voice_map = {
-    "Teacher-Like": "c1uwEpPUcC16tq1udqxk",
-    "Calm": "z2sgjL6ER8zZEFccuQMN",
-    "Energetic": "NVp9wQor3NDIWcxYoZiW"
-}
+voice_map = VOICES
 
 voice_choice = st.sidebar.selectbox("2. Voice Style:", list(voice_map.keys()))
 selected_voice_id = voice_map[voice_choice]
@@ -155,47 +216,115 @@ pace_choice = st.sidebar.select_slider(
     value="1.0x"
 )
 
+voice_input = st.sidebar.checkbox("4. 🎤 Voice input", value=False)
+
+# Lower tiers are re-encoded from the cached clip: less to download, no extra TTS call
+audio_tier = st.sidebar.selectbox(
+    "5. 📶 Audio quality:",
+    list(AUDIO_TIERS.keys()),
+    index=list(AUDIO_TIERS.keys()).index(DEFAULT_TIER),
+    format_func=lambda tier: AUDIO_TIERS[tier]["label"],
+)
+
+with st.sidebar.expander("⚙️ Cache stats"):
+    st.caption("Research (Exa)")
+    st.json(research_cache_stats())
+    st.caption("Answers")
+    st.json(answer_cache_stats())
+    st.caption("Providers")
+    st.json(provider_stats())
+    if get_default_store() is not None:
+        st.caption("Lesson store")
+        st.json(get_default_store().stats())
+    if st.session_state["prefetcher"] is not None:
+        st.caption("Prefetch (this session)")
+        st.json(st.session_state["prefetcher"].stats())
+
 # --- Chat Display ---
+def ask_follow_up(question):
+    # Lands in the question box on the rerun, like a spoken question
+    st.session_state["pending_transcript"] = question
+
+
+def render_assistant_extras(msg):
+    """Source links, quiz and flowchart under an assistant bubble."""
+    # --- Source links ---
+    if "references" in msg and msg["references"]:
+        source_links = []
+        for ref in msg["references"]:
+            try:
+                site = urllib.parse.urlparse(ref['url']).netloc.replace("www.", "")
+                if len(site) > 15:
+                    site = site.split(".")[0]
+            except:
+                site = "source"
+            link_html = f"<a href='{ref['url']}' target='_blank' style='margin-right:8px; color:#0078FF; text-decoration:none;'>{site}</a>"
+            source_links.append(link_html)
+        joined_links = " • ".join(source_links)
+        st.markdown(f"<p style='font-size:0.9em; margin:5px 0 0 10px;'>{joined_links}</p>", unsafe_allow_html=True)
+
+    # --- Quiz ---
+    quiz = msg.get("quiz_data")
+    if quiz:
+        options = "".join(
+            f"<br>{letter}) {html.escape(option)}" for letter, option in zip(OPTION_LETTERS, quiz["options"])
+        )
+        st.markdown(
+            f"<div class='quiz-box'><b>🧠 Quick Check:</b> {html.escape(quiz['question'])}{options}</div>",
+            unsafe_allow_html=True,
+        )
+        with st.expander("✅ Show answer"):
+            answer = quiz["answer_index"]
+            st.markdown(f"**{OPTION_LETTERS[answer]}) {quiz['options'][answer]}**")
+    elif "quiz" in msg and msg["quiz"]:
+        st.markdown(f"<div class='quiz-box'><b>🧠 Quick Check:</b> {msg['quiz']}</div>", unsafe_allow_html=True)
+
+    if msg.get("flowchart_data"):
+        st.subheader("📊 Lesson Flowchart")
+        st.graphviz_chart(flowchart_to_dot(msg["flowchart_data"]))
+    elif "flowchart" in msg and msg["flowchart"]:
+        st.subheader("📊 Lesson Flowchart")
+        
+        st.code(msg["flowchart"], language='mermaid') 
+
+
 if st.session_state["messages"]:  
     st.markdown("---")
 chat_container = st.container()
 
 
+# Only the latest answer gets a full player; earlier turns keep a lightweight handle.
+last_assistant_id = next(
+    (m["id"] for m in reversed(st.session_state["messages"]) if m["role"] == "assistant"), None
+)
+
 with chat_container:
+    memory = st.session_state["memory"]
+    if memory.folded_turns:
+        with st.expander(f"📝 Earlier in this lesson ({memory.folded_turns} turns summarized)"):
+            st.markdown(memory.summary)
     for msg in st.session_state["messages"]:
         if msg["role"] == "user":
             st.markdown(f"<div class='user-bubble'><b>🧑‍🎓 You:</b> {msg['content']}</div>", unsafe_allow_html=True)
         else:
             st.markdown(f"<div class='assistant-bubble'><b>Assistant:</b> {msg['content']}</div>", unsafe_allow_html=True)
-
-            # --- Source links ---
-            if "references" in msg and msg["references"]:
-                source_links = []
-                for ref in msg["references"]:
-                    try:
-                        site = urllib.parse.urlparse(ref['url']).netloc.replace("www.", "")
-                        if len(site) > 15:
-                            site = site.split(".")[0]
-                    except:
-                        site = "source"
-                    link_html = f"<a href='{ref['url']}' target='_blank' style='margin-right:8px; color:#0078FF; text-decoration:none;'>{site}</a>"
-                    source_links.append(link_html)
-                joined_links = " • ".join(source_links)
-                st.markdown(f"<p style='font-size:0.9em; margin:5px 0 0 10px;'>{joined_links}</p>", unsafe_allow_html=True)
-
-            # --- Quiz ---
-            if "quiz" in msg and msg["quiz"]:
-                st.markdown(f"<div class='quiz-box'><b>🧠 Quick Check:</b> {msg['quiz']}</div>", unsafe_allow_html=True)
-
-            if "flowchart" in msg and msg["flowchart"]:
-                st.subheader("📊 Lesson Flowchart")
-                
-                st.code(msg["flowchart"], language='mermaid') 
+            render_assistant_extras(msg)
             # --- Voice ---
-            generate_and_play(msg["content"], selected_voice_id, msg["id"], float(pace_choice.replace("x", "")))
+            generate_and_play(
+                msg["content"], selected_voice_id, msg["id"], float(pace_choice.replace("x", "")),
+                lightweight=msg["id"] != last_assistant_id, tier=audio_tier,
+            )
+            if msg["id"] == last_assistant_id:
+                for i, follow_up in enumerate(msg.get("follow_ups", [])):
+                    st.button(f"💡 {follow_up}", key=f"follow_up_{msg['id']}_{i}",
+                              on_click=ask_follow_up, args=(follow_up,))
 
 # --- Input box ---
 st.markdown("---")
+# A finished spoken question lands in the input box (set before the widget is created)
+if st.session_state.get("pending_transcript"):
+    st.session_state[f"input_{st.session_state.widget_key}"] = st.session_state.pop("pending_transcript")
+
 with st.form(key="chat_form"):
     cols = st.columns([10, 1])
     with cols[0]:
@@ -207,35 +336,154 @@ with st.form(key="chat_form"):
     with cols[1]:
         submitted = st.form_submit_button("➤")
 
-    if submitted and user_input.strip():
+    if submitted and user_input.strip() and admitted():
         # Define user_query here BEFORE using it
         user_query = user_input.strip()
 
         # Append user message
         st.session_state["messages"].append({"role": "user", "content": user_query})
 
-        # Keep current history reference
-        current_history = st.session_state["messages"]
-
-        with st.spinner("Thinking..."):
-            result = run_pipeline(
+        # Memory of the earlier turns (bounded summary + recent turns)
+        memory = st.session_state["memory"]
+
+        msg_id = st.session_state["next_msg_id"]
+        st.session_state["next_msg_id"] += 1
+
+        # --- Stream the answer: text into the bubble, sentence chunks into TTS ---
+        with chat_container:
+            st.markdown(f"<div class='user-bubble'><b>🧑‍🎓 You:</b> {user_query}</div>", unsafe_allow_html=True)
+            bubble = st.empty()
+            audio_area = st.container()
+            extras_area = st.container()
+        bubble.markdown("<div class='assistant-bubble'><b>Assistant:</b> <i>Thinking...</i></div>", unsafe_allow_html=True)
+
+        # A new question makes the follow-ups prefetched for the last answer moot
+        prefetcher = st.session_state["prefetcher"]
+        if prefetcher is not None:
+            prefetcher.cancel()
+
+        speed_rate = float(pace_choice.replace("x", ""))
+        streamer = SpeechStreamer(selected_voice_id, speed_rate, audio_tier)
+        player = ClipPlayer(audio_area, audio_tier)
+        partial_text = ""
+        # TTS runs one delta behind: a cached answer arrives as a single delta plus the result,
+        # and is then played from the TTS cache as a whole instead of re-synthesized per sentence
+        held_delta = None
+        result = None
+        cache_hit = False
+
+        cb, exa = pipeline_clients()
+        failure = None
+        try:
+            for event, payload in pipeline_stream(
                 cb,                 # Cerebras Client
                 exa,                # Exa Client
                 user_query,         # Query string
                 selected_level,     # Complexity Level
-                current_history     # Chat history
-            )
-
-        msg_id = len(st.session_state["messages"])
-        st.session_state["messages"].append({
-            "role": "assistant",
-            "content": result["simplified_text"],
-            "references": result.get("references", []),
-            "quiz": result.get("quiz_text", ""),
-            "flowchart": result.get("flowchart_text", ""),
-            "id": msg_id
-        })
-
-        # Increment key to clear input
-        st.session_state.widget_key += 1
-        st.rerun()
+                memory              # Chat history
+            ):
+                if event == "delta":
+                    partial_text += payload
+                    bubble.markdown(f"<div class='assistant-bubble'><b>Assistant:</b> {partial_text}</div>", unsafe_allow_html=True)
+                    if held_delta is not None:
+                        streamer.feed(held_delta)
+                    held_delta = payload
+                    player.add(streamer.ready_clips())
+                    player.pump()
+                elif event == "result":
+                    result = payload
+                    cache_hit = result.get("answer_cache") in ("exact", "similar", "store")
+                    if held_delta is not None and not cache_hit:
+                        streamer.feed(held_delta)
+                    with extras_area:
+                        render_assistant_extras({
+                            "references": result.get("references", []),
+                            "quiz": result.get("quiz_text", ""),
+                            "flowchart": result.get("flowchart_text", ""),
+                            "quiz_data": result.get("quiz"),
+                            "flowchart_data": result.get("flowchart"),
+                        })
+        except ProviderBusy as e:
+            failure = busy_message(e)
+        except ProviderUnavailable as e:
+            failure = f"⏳ PolyVoice can't reach its providers right now ({e}). Please try again in a moment."
+        except Exception as e:  # a stage timeout, a provider error that outlasted its retries, an API error event
+            failure = f"Something went wrong while answering: {e}"
+        finally:
+            if result is None:
+                # Nothing to keep (also when a rerun interrupts the stream): stop the TTS
+                # thread and drop the unanswered turn so the history stays consistent
+                streamer.close()
+                st.session_state["messages"].pop()
+                bubble.empty()
+        if result is None:
+            st.warning(failure or "⏳ The answer was cut off. Please try again.")
+        else:
+            # Record the answer before draining the audio queue, so an interaction
+            # that interrupts playback doesn't lose the message.
+            st.session_state["messages"].append({
+                "role": "assistant",
+                "content": result["simplified_text"],
+                "references": result.get("references", []),
+                "quiz": result.get("quiz_text", ""),
+                "flowchart": result.get("flowchart_text", ""),
+                "quiz_data": result.get("quiz"),
+                "flowchart_data": result.get("flowchart"),
+                "id": msg_id
+            })
+            memory.add_user(user_query)
+            memory.add_assistant(result["simplified_text"])
+            # Suggested next questions; with prefetch on, they are answered in the background now
+            if prefetcher is not None:
+                follow_ups = prefetcher.schedule(
+                    user_query, selected_level, memory, result, selected_voice_id, speed_rate, audio_tier
+                )
+            else:
+                follow_ups = prefetch.follow_up_queries(result, user_query)
+            st.session_state["messages"][-1]["follow_ups"] = follow_ups
+            del st.session_state["messages"][:-MAX_DISPLAY_MESSAGES]
+
+            # Increment key to clear input on the next interaction.
+            # No st.rerun() here: it would cut off the answer audio that is still playing.
+            st.session_state.widget_key += 1
+
+            streamer.close()
+            if cache_hit:
+                with audio_area:
+                    generate_and_play(result["simplified_text"], selected_voice_id, msg_id, speed_rate, tier=audio_tier)
+            else:
+                for clip in streamer.remaining_clips():
+                    player.add([clip])
+                    player.pump(block=True)
+                if isinstance(streamer.error, ProviderUnavailable):
+                    st.caption("🔇 Voice is temporarily unavailable; the text answer is complete.")
+                elif streamer.error is not None:
+                    st.error(f"Error generating voice. Check your API key or plan. Details: {streamer.error}")
+                save_streamed_audio(streamer, result["simplified_text"])
+
+# --- Voice input (streaming Whisper) ---
+if voice_input:
+    # Imported lazily: Whisper pulls in torch, which only voice users should pay for
+    from streamlit_webrtc import webrtc_streamer, WebRtcMode
+    from agents.stt_agent import get_session_transcriber, make_audio_callback
+
+    transcriber = get_session_transcriber()
+    ctx = webrtc_streamer(
+        key="stt",
+        mode=WebRtcMode.SENDONLY,
+        audio_frame_callback=make_audio_callback(transcriber),
+        media_stream_constraints={"audio": True, "video": False},
+    )
+    live_caption = st.empty()
+    # Poll the transcriber while the mic is on; a final transcript reruns the
+    # script so it can be placed in the question box.
+    while ctx.state.playing:
+        for event in transcriber.poll():
+            if event["kind"] == "partial":
+                live_caption.caption(f"🎙️ {event['text']}")
+            elif event["kind"] == "error":
+                live_caption.error(event["text"])
+            else:
+                st.session_state["pending_transcript"] = event["text"]
+                st.rerun()
+        time.sleep(0.1)
@@ -0,0 +1,154 @@
+"""
+Override classifier benchmark: local regex classifier vs the LLM-based check.
+
+    python -m benchmarks.override_benchmark            # simulated LLM (no API key needed)
+    python -m benchmarks.override_benchmark --live     # real Cerebras calls (CEREBRAS_API_KEY)
+    python -m benchmarks.override_benchmark --json out.json
+
+The simulated LLM answers with the labelled level after an injected delay, so offline runs
+measure latency and agreement with the labels; --live measures agreement with the real model.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import time
+from types import SimpleNamespace
+
+from agents.simplify_agent import (
+    classify_override_local,
+    detect_override,
+    check_for_override_llm,
+)
+
+# (query, expected level or None) -- mirrors the keyword families in the LLM prompt
+LABELLED_QUERIES = [
+    ("Explain photosynthesis like I'm 5", "elementary-dyslexia"),
+    ("Can you explain black holes for a kid?", "elementary-dyslexia"),
+    ("Make that easier please", "elementary-dyslexia"),
+    ("Explain it simpler, I have dyslexia", "elementary-dyslexia"),
+    ("Tell my child how volcanoes work", "elementary-dyslexia"),
+    ("ELI5 the stock market", "elementary-dyslexia"),
+    ("Explain gravity in simple terms", "elementary-dyslexia"),
+    ("Give me the expert explanation of CRISPR", "plain-language-clarity"),
+    ("Go more in-depth on mitochondria", "plain-language-clarity"),
+    ("I want a technical answer about TCP congestion control", "plain-language-clarity"),
+    ("Explain quantum entanglement at a more advanced level", "plain-language-clarity"),
+    ("What is photosynthesis?", None),
+    ("How do vaccines work?", None),
+    ("Why is the sky blue?", None),
+    ("What are the three types of that?", None),
+    ("Summarize the causes of World War I", None),
+    ("How does the water cycle work?", None),
+    ("What is the difference between DNA and RNA?", None),
+    ("Who invented the printing press?", None),
+    ("What are simple machines?", None),
+    ("Explain simple harmonic motion", None),
+    ("What is the standard model of particle physics?", None),
+    ("How hard is advanced placement chemistry?", None),
+    ("Don't make it simpler, keep the details", None),
+    # Topic words, not level requests: kid/child/technical alone must defer to the LLM
+    ("What do kids eat in Japan?", None),
+    ("How do children learn languages?", None),
+    ("Is technical analysis of stocks reliable?", None),
+    ("What are the rights of the child under the UN convention?", None),
+]
+
+
+class SimulatedLLM:
+    """Stand-in Cerebras client: answers with the labelled level after `latency` seconds."""
+
+    def __init__(self, labels, latency):
+        self.labels = labels
+        self.latency = latency
+        self.chat = SimpleNamespace(completions=self)
+
+    def create(self, model, messages, max_tokens, temperature, **kwargs):
+        time.sleep(self.latency)
+        prompt = messages[-1]["content"]
+        answer = "NONE"
+        for query, level in self.labels.items():
+            if f"'{query}'" in prompt:
+                answer = level or "NONE"
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=answer))])
+
+
+def _percentiles(samples):
+    ordered = sorted(samples)
+    pick = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+    return {
+        "p50_ms": round(pick(0.50) * 1000, 3),
+        "p95_ms": round(pick(0.95) * 1000, 3),
+        "mean_ms": round(statistics.fmean(ordered) * 1000, 3),
+    }
+
+
+def _timed(fn, *args):
+    start = time.perf_counter()
+    value = fn(*args)
+    return value, time.perf_counter() - start
+
+
+def run_benchmark(cb, repeats=1):
+    rows = []
+    for _ in range(repeats):
+        for query, expected in LABELLED_QUERIES:
+            llm_level, llm_s = _timed(check_for_override_llm, cb, query)
+            (local_level, ambiguous), local_s = _timed(classify_override_local, query)
+            (hybrid_level, source), hybrid_s = _timed(detect_override, cb, query)
+            rows.append({
+                "query": query, "expected": expected,
+                "llm": llm_level, "local": local_level, "hybrid": hybrid_level,
+                "ambiguous": ambiguous, "source": source,
+                "llm_s": llm_s, "local_s": local_s, "hybrid_s": hybrid_s,
+            })
+
+    def agreement(a, b):
+        return round(sum(r[a] == r[b] for r in rows) / len(rows), 3)
+
+    return {
+        "queries": len(rows),
+        "latency": {
+            "llm": _percentiles([r["llm_s"] for r in rows]),
+            "local": _percentiles([r["local_s"] for r in rows]),
+            "hybrid": _percentiles([r["hybrid_s"] for r in rows]),
+        },
+        "agreement": {
+            "local_vs_llm": agreement("local", "llm"),
+            "hybrid_vs_llm": agreement("hybrid", "llm"),
+            "local_vs_labels": agreement("local", "expected"),
+            "hybrid_vs_labels": agreement("hybrid", "expected"),
+            "llm_vs_labels": agreement("llm", "expected"),
+        },
+        "llm_fallback_rate": round(sum(r["source"] == "llm" for r in rows) / len(rows), 3),
+        "disagreements": sorted({
+            (r["query"], r["hybrid"], r["llm"]) for r in rows if r["hybrid"] != r["llm"]
+        }),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--live", action="store_true", help="use the real Cerebras API")
+    parser.add_argument("--latency", type=float, default=0.25, help="simulated LLM latency (s)")
+    parser.add_argument("--repeats", type=int, default=1)
+    parser.add_argument("--json", help="write the report to this file")
+    args = parser.parse_args()
+
+    if args.live:
+        from cerebras.cloud.sdk import Cerebras
+        cb = Cerebras(api_key=os.getenv("CEREBRAS_API_KEY"))
+    else:
+        cb = SimulatedLLM(dict(LABELLED_QUERIES), args.latency)
+
+    report = run_benchmark(cb, args.repeats)
+    report["mode"] = "live" if args.live else f"simulated({args.latency}s)"
+    print(json.dumps(report, indent=2))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,446 @@
+"""
+Offline pipeline benchmark: the whole app against local provider stand-ins.
+
+    python -m benchmarks.pipeline_benchmark                              # defaults
+    python -m benchmarks.pipeline_benchmark --concurrency 8 --requests 32 --json run.json
+    python -m benchmarks.pipeline_benchmark --compare baseline.json      # deltas vs an older run
+
+Cerebras, Exa, ElevenLabs and Whisper are replaced by agents/stand_ins.py (POLYVOICE_OFFLINE=1)
+with injected latencies, and every cache lives in a fresh temp directory, so numbers are
+comparable across commits and machines. Drives:
+
+  * run_pipeline in serial / concurrent / stream mode (per-stage timings via wrapped stages)
+  * generate_and_play, cold (synthesis) and warm (cached), in Streamlit bare mode
+  * process_audio_callback with WebRTC-like frames decoded from output.mp3 / tts_*.mp3
+    (needs ffmpeg; without it a synthetic speech-like signal is used and marked as such)
+
+The report is JSON: per-stage p50/p95/p99, per-scenario throughput, provider call counts,
+cache stats and peak RSS.
+"""
+
+import argparse
+import glob
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TOPICS = [
+    "photosynthesis", "black holes", "volcanoes", "the water cycle", "vaccines",
+    "plate tectonics", "the stock market", "DNA replication", "gravity", "electric circuits",
+]
+LEVELS = ["elementary-dyslexia", "adhd", "plain", "standard-research"]
+WEBRTC_RATE = 48000
+WEBRTC_FRAME = WEBRTC_RATE * 20 // 1000  # 20 ms frames, as aiortc delivers them
+
+
+# --- MEASUREMENT ---
+class Recorder:
+    """Thread-safe duration samples per stage name."""
+
+    def __init__(self):
+        self.samples = {}
+        self._lock = threading.Lock()
+
+    def add(self, name, seconds):
+        with self._lock:
+            self.samples.setdefault(name, []).append(seconds)
+
+    def timed(self, name, fn):
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.add(name, time.perf_counter() - start)
+        return wrapper
+
+    def timed_stream(self, name, fn):
+        """For generators: time to first item and time to exhaustion."""
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            first = True
+            try:
+                for item in fn(*args, **kwargs):
+                    if first:
+                        self.add(f"{name}.first", time.perf_counter() - start)
+                        first = False
+                    yield item
+            finally:
+                self.add(name, time.perf_counter() - start)
+        return wrapper
+
+    def summary(self):
+        return {name: percentiles(values) for name, values in sorted(self.samples.items())}
+
+
+def percentiles(samples):
+    ordered = sorted(samples)
+    pick = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+    return {
+        "count": len(ordered),
+        "p50_ms": round(pick(0.50) * 1000, 3),
+        "p95_ms": round(pick(0.95) * 1000, 3),
+        "p99_ms": round(pick(0.99) * 1000, 3),
+        "mean_ms": round(sum(ordered) / len(ordered) * 1000, 3),
+        "max_ms": round(ordered[-1] * 1000, 3),
+    }
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def git_commit():
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT,
+                             capture_output=True, text=True, timeout=5)
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=REPO_ROOT,
+                               capture_output=True, text=True, timeout=5)
+        return out.stdout.strip() + ("-dirty" if dirty.stdout.strip() else "") or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def _run_many(jobs, concurrency):
+    """Runs callables on `concurrency` threads; returns (wall seconds, errors)."""
+    errors = []
+
+    def guarded(job):
+        try:
+            job()
+        except Exception as e:
+            errors.append(repr(e))
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(guarded, jobs))
+    return time.perf_counter() - start, errors
+
+
+def _scenario(requests, wall, errors):
+    return {
+        "requests": requests,
+        "wall_s": round(wall, 3),
+        "throughput_rps": round(requests / wall, 3) if wall else None,
+        "errors": len(errors),
+        "first_error": errors[0] if errors else None,
+    }
+
+
+def _queries(count, repeat, run_id):
+    """Distinct questions per request unless repeat=True (then the caches get to help)."""
+    queries = []
+    for i in range(count):
+        topic = TOPICS[i % len(TOPICS)]
+        suffix = "" if repeat else f" (case {run_id}-{i})"
+        queries.append((f"How does {topic} work?{suffix}", LEVELS[i % len(LEVELS)]))
+    return queries
+
+
+# --- SCENARIOS ---
+def bench_pipeline(recorder, cb, exa, modes, requests, concurrency, repeat):
+    from agents import orchestrator
+
+    scenarios = {}
+    for mode in modes:
+        run_id = uuid.uuid4().hex[:6]
+
+        def job(query, level, mode=mode):
+            start = time.perf_counter()
+            if mode == "stream":
+                first = None
+                for kind, value in orchestrator.run_pipeline_stream(cb, exa, query, level, []):
+                    if kind == "delta" and first is None:
+                        first = time.perf_counter() - start
+                if first is not None:
+                    recorder.add("pipeline.stream.first_delta", first)
+            else:
+                orchestrator.run_pipeline(cb, exa, query, level, [], concurrent=(mode == "concurrent"))
+            recorder.add(f"pipeline.{mode}", time.perf_counter() - start)
+
+        jobs = [lambda q=q, l=l: job(q, l) for q, l in _queries(requests, repeat, run_id)]
+        wall, errors = _run_many(jobs, concurrency)
+        scenarios[f"pipeline.{mode}"] = _scenario(requests, wall, errors)
+    return scenarios
+
+
+def bench_tts(recorder, requests, concurrency, voice_id):
+    from agents.voice_agent import generate_and_play
+
+    run_id = uuid.uuid4().hex[:6]
+    texts = [
+        f"Here is answer {run_id}-{i}. {TOPICS[i % len(TOPICS)].capitalize()} is easier in small steps."
+        for i in range(requests)
+    ]
+    scenarios = {}
+    for phase in ("cold", "warm"):
+        if phase == "warm":
+            import streamlit as st
+            st.session_state.pop("audio_handles", None)  # warm = TTS cache hit, not a session memo
+        jobs = [
+            lambda t=t, i=i: recorder.timed(f"tts.generate_and_play.{phase}", generate_and_play)(t, voice_id, msg_id=i)
+            for i, t in enumerate(texts)
+        ]
+        wall, errors = _run_many(jobs, concurrency)
+        scenarios[f"tts.{phase}"] = _scenario(requests, wall, errors)
+    return scenarios
+
+
+def _decode_fixture(path, seconds):
+    """First `seconds` of an MP3 as 48 kHz mono s16 via ffmpeg, or None without ffmpeg."""
+    if not shutil.which("ffmpeg"):
+        return None
+    import numpy as np
+
+    out = subprocess.run(
+        ["ffmpeg", "-v", "error", "-i", path, "-t", str(seconds),
+         "-f", "s16le", "-ac", "1", "-ar", str(WEBRTC_RATE), "-"],
+        capture_output=True, check=True,
+    )
+    return np.frombuffer(out.stdout, dtype=np.int16)
+
+
+def _synthetic_speech(seconds, seed):
+    """Syllable-like bursts of harmonics separated by short gaps, at speech loudness."""
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * WEBRTC_RATE)) / WEBRTC_RATE
+    pitch = 120 + 40 * rng.random()
+    voice = sum(np.sin(2 * np.pi * pitch * k * t) / k for k in range(1, 6))
+    envelope = (np.sin(2 * np.pi * 4 * t) > -0.3).astype(np.float64)  # ~4 syllables per second
+    signal = 0.25 * voice * envelope + 0.01 * rng.standard_normal(len(t))
+    return (np.clip(signal, -1, 1) * 32767).astype(np.int16)
+
+
+class FakeAudioFrame:
+    """The parts of av.AudioFrame that stt_agent.frame_to_float32 reads (packed s16 mono)."""
+
+    layout = SimpleNamespace(channels=("mono",))
+    format = SimpleNamespace(is_planar=False, name="s16")
+    sample_rate = WEBRTC_RATE
+
+    def __init__(self, samples):
+        self._samples = samples
+
+    def to_ndarray(self):
+        return self._samples.reshape(1, -1)
+
+
+def load_stt_fixtures(seconds):
+    paths = sorted(glob.glob(os.path.join(REPO_ROOT, "tts_*.mp3")))
+    paths.insert(0, os.path.join(REPO_ROOT, "output.mp3"))
+    fixtures = []
+    for i, path in enumerate(p for p in paths if os.path.exists(p)):
+        try:
+            samples = _decode_fixture(path, seconds)
+        except subprocess.CalledProcessError:
+            samples = None
+        if samples is not None and len(samples):
+            fixtures.append((os.path.basename(path), samples))
+    if not fixtures:
+        fixtures = [(f"synthetic-{i}", _synthetic_speech(seconds, i)) for i in range(3)]
+    return fixtures
+
+
+def bench_stt(recorder, fixtures, repeats, timeout_s=15.0):
+    """
+    Feeds each fixture through process_audio_callback as fast as the callback allows,
+    then real-time silence until the utterance is finalised. Reports the callback cost per
+    frame and endpoint latency: end of speech -> final transcript (includes the VAD hangover).
+    """
+    import numpy as np
+    from agents.stt_agent import process_audio_callback, default_transcriber
+
+    transcriber = default_transcriber()
+    callback = recorder.timed("stt.callback", process_audio_callback)
+    silence = FakeAudioFrame(np.zeros(WEBRTC_FRAME, dtype=np.int16))
+    finals, errors = 0, []
+    start = time.perf_counter()
+    for _ in range(repeats):
+        for name, samples in fixtures:
+            transcriber.poll()  # drop anything left over from the previous utterance
+            for offset in range(0, len(samples) - WEBRTC_FRAME + 1, WEBRTC_FRAME):
+                callback(FakeAudioFrame(samples[offset:offset + WEBRTC_FRAME]))
+            speech_end = time.perf_counter()
+            final = None
+            while final is None and time.perf_counter() - speech_end < timeout_s:
+                callback(silence)
+                time.sleep(WEBRTC_FRAME / WEBRTC_RATE)
+                for event in transcriber.poll():
+                    if event["kind"] == "error":
+                        errors.append(event["text"])
+                    elif event["kind"] == "final":
+                        final = event
+            if final is None:
+                errors.append(f"{name}: no final transcript within {timeout_s}s")
+                continue
+            finals += 1
+            recorder.add("stt.endpoint_to_final", time.perf_counter() - speech_end)
+    wall = time.perf_counter() - start
+    scenario = _scenario(repeats * len(fixtures), wall, errors)
+    scenario["finals"] = finals
+    scenario["fixtures"] = [name for name, _ in fixtures]
+    return {"stt": scenario}
+
+
+def instrument_stages(recorder):
+    """Wraps the orchestrator's stage functions (module attributes) with timers."""
+    from agents import orchestrator
+
+    for attr, stage in [
+        ("run_research_agent", "stage.research"),
+        ("detect_override", "stage.override"),
+        ("build_context", "stage.context"),
+        ("run_simplifier_agent", "stage.simplify"),
+        ("generate_quiz", "stage.quiz"),
+        ("generate_flowchart", "stage.flowchart"),
+        ("generate_lesson_extras", "stage.extras"),
+    ]:
+        setattr(orchestrator, attr, recorder.timed(stage, getattr(orchestrator, attr)))
+    orchestrator.stream_simplifier_agent = recorder.timed_stream(
+        "stage.simplify_stream", orchestrator.stream_simplifier_agent
+    )
+
+
+# --- REPORTING ---
+def compare(old, new):
+    """Human-readable deltas between two reports (positive = slower / bigger)."""
+    lines = [f"baseline {old.get('commit')} -> current {new.get('commit')}"]
+    for name, stats in new["stages"].items():
+        before = old.get("stages", {}).get(name)
+        if not before:
+            lines.append(f"  {name:<36} new")
+            continue
+        deltas = []
+        for key in ("p50_ms", "p95_ms", "p99_ms"):
+            change = (stats[key] - before[key]) / before[key] * 100 if before[key] else 0.0
+            deltas.append(f"{key[:-3]} {before[key]:.1f}->{stats[key]:.1f}ms ({change:+.0f}%)")
+        lines.append(f"  {name:<36} " + "  ".join(deltas))
+    for name, scenario in new["scenarios"].items():
+        before = old.get("scenarios", {}).get(name)
+        if before and before.get("throughput_rps") and scenario.get("throughput_rps"):
+            change = (scenario["throughput_rps"] - before["throughput_rps"]) / before["throughput_rps"] * 100
+            lines.append(f"  {name:<36} throughput {before['throughput_rps']:.2f}->"
+                         f"{scenario['throughput_rps']:.2f} req/s ({change:+.0f}%)")
+    if old.get("peak_rss_mb"):
+        lines.append(f"  {'peak RSS':<36} {old['peak_rss_mb']} -> {new['peak_rss_mb']} MB")
+    return "\n".join(lines)
+
+
+def configure_environment(args, workdir):
+    """Must run before any agents.* import: the modules read their settings at import time."""
+    os.environ["POLYVOICE_OFFLINE"] = "1"
+    os.environ["POLYVOICE_OFFLINE_LATENCY"] = (
+        f"cerebras={args.cerebras_latency},token={args.token_latency},exa={args.exa_latency},"
+        f"tts={args.tts_latency},whisper={args.whisper_latency}"
+    )
+    os.environ["POLYVOICE_TTS_CACHE_DIR"] = os.path.join(workdir, "tts")
+    os.environ["POLYVOICE_RESEARCH_CACHE"] = os.path.join(workdir, "research.sqlite3")
+    os.environ.pop("POLYVOICE_API_URL", None)
+    os.environ.pop("POLYVOICE_AUDIO_PORT", None)
+    os.environ.pop("POLYVOICE_WHISPER_ADDRESS", None)
+
+
+def quiet_streamlit():
+    """Bare-mode Streamlit warns on every call made outside a script run."""
+    from streamlit import config
+    from streamlit.logger import set_log_level
+
+    config.get_config_options()  # loading the config resets the log level, so load it first
+    set_log_level("error")
+
+
+def run_benchmark(args):
+    workdir = tempfile.mkdtemp(prefix="polyvoice-bench-")
+    try:
+        configure_environment(args, workdir)
+        from agents.clients import get_clients, provider_stats
+        from agents.orchestrator import research_cache_stats, answer_cache_stats
+        import agents.voice_agent, agents.stt_agent  # noqa: F401 -- import streamlit before quieting it
+        quiet_streamlit()
+
+        cb, exa, eleven_client = get_clients()
+        recorder = Recorder()
+        instrument_stages(recorder)
+        scenarios = {}
+        started = time.perf_counter()
+        if "pipeline" in args.scenarios:
+            scenarios.update(bench_pipeline(recorder, cb, exa, args.modes, args.requests,
+                                             args.concurrency, args.repeat_queries))
+        if "tts" in args.scenarios:
+            scenarios.update(bench_tts(recorder, args.requests, args.concurrency, args.voice_id))
+        if "stt" in args.scenarios:
+            scenarios.update(bench_stt(recorder, load_stt_fixtures(args.stt_seconds), args.stt_repeats))
+
+        return {
+            "commit": git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "config": {
+                key: value for key, value in vars(args).items() if key not in ("json", "compare")
+            },
+            "wall_s": round(time.perf_counter() - started, 3),
+            "stages": recorder.summary(),
+            "scenarios": scenarios,
+            "provider_calls": {
+                "cerebras": cb.chat.completions.calls,
+                "exa": exa.calls,
+                "elevenlabs": eleven_client.text_to_speech.calls,
+            },
+            "providers": provider_stats(),
+            "caches": {"research": research_cache_stats(), "answers": answer_cache_stats()},
+            "peak_rss_mb": peak_rss_mb(),
+        }
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", nargs="+", default=["pipeline", "tts", "stt"],
+                        choices=["pipeline", "tts", "stt"])
+    parser.add_argument("--modes", nargs="+", default=["serial", "concurrent", "stream"],
+                        choices=["serial", "concurrent", "stream"], help="run_pipeline modes")
+    parser.add_argument("--requests", type=int, default=12, help="requests per pipeline mode / TTS phase")
+    parser.add_argument("--concurrency", type=int, default=4, help="simultaneous users")
+    parser.add_argument("--repeat-queries", action="store_true",
+                        help="reuse the same questions (measures the caches instead of the providers)")
+    parser.add_argument("--cerebras-latency", type=float, default=0.30, help="per completion (s)")
+    parser.add_argument("--token-latency", type=float, default=0.005, help="per streamed token (s)")
+    parser.add_argument("--exa-latency", type=float, default=0.80, help="per search (s)")
+    parser.add_argument("--tts-latency", type=float, default=0.50, help="per synthesis (s)")
+    parser.add_argument("--whisper-latency", type=float, default=0.20, help="per transcription (s)")
+    parser.add_argument("--voice-id", default="c1uwEpPUcC16tq1udqxk")
+    parser.add_argument("--stt-seconds", type=float, default=6.0, help="audio per STT fixture")
+    parser.add_argument("--stt-repeats", type=int, default=2)
+    parser.add_argument("--json", help="write the report to this file")
+    parser.add_argument("--compare", help="print deltas against an earlier report")
+    args = parser.parse_args()
+
+    report = run_benchmark(args)
+    print(json.dumps(report, indent=2))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            print(compare(json.load(f), report), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,216 @@
+"""
+Startup benchmark: import times, Streamlit cold start and first-answer latency.
+
+    python -m benchmarks.startup_benchmark                       # offline stand-ins
+    python -m benchmarks.startup_benchmark --budget-ms 1500 --json startup.json
+    python -m benchmarks.startup_benchmark --live                # real providers (.env keys)
+
+Every probe runs in a fresh interpreter, so nothing is already imported or cached:
+
+  * imports: wall time of importing each agents module (and each provider SDK on its own),
+    plus which heavy SDKs an import dragged in. The app's imports must stay under
+    --budget-ms and must not load cerebras / exa_py / elevenlabs / whisper / torch; the
+    exit status is 1 when they do.
+  * app: the first script run of app.py (Streamlit AppTest) and a rerun.
+  * first answer: process start -> first streamed delta / full result for one question
+    asked --think-s after start, with and without the background warm-up (POLYVOICE_WARMUP).
+
+Offline, the stand-ins never import the provider SDKs, so the warm-up gap mostly shows
+with --live.
+"""
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.pipeline_benchmark import git_commit, percentiles, REPO_ROOT
+
+HEAVY_MODULES = ["cerebras", "exa_py", "elevenlabs", "whisper", "torch", "streamlit_webrtc"]
+# What app.py imports before its first render
+APP_MODULES = [
+    "agents.orchestrator", "agents.quiz_agent", "agents.voice_agent", "agents.memory",
+    "agents.lesson_store", "agents.clients", "agents.prefetch", "agents.api_client", "agents.warmup",
+]
+AGENT_MODULES = APP_MODULES + ["agents.stt_agent", "api_server"]
+SDK_MODULES = ["cerebras.cloud.sdk", "exa_py", "elevenlabs.client", "whisper", "streamlit_webrtc"]
+
+
+# --- CHILD PROBES (run in a fresh interpreter) ---
+def probe_import(modules):
+    import importlib
+
+    started = time.perf_counter()
+    try:
+        for name in modules:
+            importlib.import_module(name)
+    except ImportError as e:
+        return {"error": f"{type(e).__name__}: {e}"}
+    elapsed = time.perf_counter() - started
+    loaded = sorted({m for m in HEAVY_MODULES if any(k == m or k.startswith(m + ".") for k in sys.modules)})
+    return {"seconds": elapsed, "heavy_loaded": loaded}
+
+
+def probe_app():
+    from streamlit.testing.v1 import AppTest
+
+    started = time.perf_counter()
+    at = AppTest.from_file(os.path.join(REPO_ROOT, "app.py"), default_timeout=120)
+    at.run()
+    first = time.perf_counter() - started
+    started = time.perf_counter()
+    at.run()
+    rerun = time.perf_counter() - started
+    loaded = sorted({m for m in HEAVY_MODULES if any(k == m or k.startswith(m + ".") for k in sys.modules)})
+    return {"first_run": first, "rerun": rerun, "exceptions": len(at.exception), "heavy_loaded": loaded}
+
+
+def probe_first_answer(process_start, think_s, warm):
+    from agents import warmup
+
+    if warm:
+        warmup.start_background()
+    time.sleep(think_s)  # the student reads the page and types a question
+    asked = time.time()
+    from agents.orchestrator import run_pipeline_stream
+    from agents.clients import get_clients
+
+    cb, exa, _ = get_clients()
+    first_delta = None
+    for event, _ in run_pipeline_stream(cb, exa, "How do volcanoes erupt?", "plain", []):
+        if event == "delta" and first_delta is None:
+            first_delta = time.time()
+    done = time.time()
+    return {
+        "start_to_first_delta": first_delta - process_start,
+        "question_to_first_delta": first_delta - asked,
+        "question_to_result": done - asked,
+        "warmup": warmup.last_report,
+    }
+
+
+# --- PARENT ---
+def run_child(args_list, env):
+    """Runs one probe in a new interpreter; returns its JSON result."""
+    cmd = [sys.executable, "-m", "benchmarks.startup_benchmark", "--child", json.dumps(args_list)]
+    out = subprocess.run(cmd, cwd=REPO_ROOT, env=env, capture_output=True, text=True, timeout=600)
+    lines = [line for line in out.stdout.splitlines() if line.startswith("{")]
+    if out.returncode != 0 or not lines:
+        return {"error": (out.stderr.strip().splitlines() or ["no output"])[-1]}
+    return json.loads(lines[-1])
+
+
+def child_main(spec):
+    kind = spec[0]
+    if kind == "import":
+        result = probe_import(spec[1])
+    elif kind == "app":
+        result = probe_app()
+    else:
+        result = probe_first_answer(spec[1], spec[2], spec[3])
+    print(json.dumps(result))
+
+
+def _repeat(label, count, spec_fn, env):
+    """Runs a probe `count` times; returns {metric: percentiles} over the numeric fields."""
+    samples, extra = {}, {}
+    for _ in range(count):
+        result = run_child(spec_fn(), env)
+        if "error" in result:
+            return {"error": result["error"]}
+        for key, value in result.items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool) and key != "exceptions":
+                samples.setdefault(key, []).append(value)
+            else:
+                extra[key] = value
+    print(f"  {label} done", file=sys.stderr)
+    return {**{key: percentiles(values) for key, values in samples.items()}, **extra}
+
+
+def run_benchmark(args):
+    workdir = tempfile.mkdtemp(prefix="polyvoice-startup-")
+    try:
+        return _run_probes(args, workdir)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def _run_probes(args, workdir):
+    env = dict(os.environ, PYTHONPATH=REPO_ROOT, POLYVOICE_TTS_CACHE_DIR=os.path.join(workdir, "tts"),
+               POLYVOICE_RESEARCH_CACHE=os.path.join(workdir, "research.sqlite3"))
+    for name in ("POLYVOICE_API_URL", "POLYVOICE_AUDIO_PORT", "POLYVOICE_WARMUP", "POLYVOICE_LESSON_STORE"):
+        env.pop(name, None)
+    if not args.live:
+        env["POLYVOICE_OFFLINE"] = "1"
+        env["POLYVOICE_OFFLINE_LATENCY"] = (
+            f"cerebras={args.cerebras_latency},token={args.token_latency},exa={args.exa_latency}"
+        )
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "config": {key: value for key, value in vars(args).items() if key not in ("json", "child")},
+        "imports": {},
+        "sdk_imports": {},
+    }
+    if "imports" in args.probes:
+        for module in AGENT_MODULES + ["app modules"]:
+            modules = APP_MODULES if module == "app modules" else [module]
+            report["imports"][module] = _repeat(module, args.repeats, lambda: ["import", modules], env)
+        for module in SDK_MODULES:
+            report["sdk_imports"][module] = _repeat(module, 1, lambda: ["import", [module]], env)
+    if "app" in args.probes:
+        report["app"] = _repeat("app.py", args.repeats, lambda: ["app"], env)
+    if "first-answer" in args.probes:
+        report["first_answer"] = {}
+        for warm in (False, True):
+            report["first_answer"]["warm" if warm else "cold"] = _repeat(
+                f"first answer ({'warm' if warm else 'cold'})", args.repeats,
+                lambda: ["first-answer", time.time(), args.think_s, warm], env,
+            )
+
+    # Import budget: the modules the first render needs, without the provider SDKs
+    app_imports = report["imports"].get("app modules")
+    if app_imports and "seconds" in app_imports:
+        report["budget"] = {
+            "budget_ms": args.budget_ms,
+            "app_import_p50_ms": app_imports["seconds"]["p50_ms"],
+            "heavy_loaded": app_imports["heavy_loaded"],
+            "ok": app_imports["seconds"]["p50_ms"] <= args.budget_ms and not app_imports["heavy_loaded"],
+        }
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--probes", nargs="+", default=["imports", "app", "first-answer"],
+                        choices=["imports", "app", "first-answer"])
+    parser.add_argument("--repeats", type=int, default=3, help="fresh processes per probe")
+    parser.add_argument("--budget-ms", type=float, default=1500, help="import budget for the app's modules")
+    parser.add_argument("--think-s", type=float, default=1.0, help="process start -> question")
+    parser.add_argument("--live", action="store_true", help="real providers instead of the stand-ins")
+    parser.add_argument("--cerebras-latency", type=float, default=0.30, help="per completion (s), offline")
+    parser.add_argument("--token-latency", type=float, default=0.005, help="per streamed token (s), offline")
+    parser.add_argument("--exa-latency", type=float, default=0.80, help="per search (s), offline")
+    parser.add_argument("--json", help="write the report to this file")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child_main(json.loads(args.child))
+        return
+    report = run_benchmark(args)
+    print(json.dumps(report, indent=2))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+    if not report.get("budget", {}).get("ok", True):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()